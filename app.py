@@ -1,13 +1,39 @@
 from flask import Flask, request,jsonify
 import json
-from app.analysis.english_tool import ocr_with_azure_gpt4o_text
-from app.analysis.math_tool import ocr_with_azure_gpt4o_math
-from app.analysis.map_tool import ocr_with_azure_gpt4o_image
-from app.analysis.sendmail import send_email
+import os
+from app.utils.lazy_utils import lazy_callable
+from app.utils.openai_utils import get_latency_stats, get_usage_stats
+from app.utils.parse_utils import get_parse_stats
+from app.utils.prompt_utils import PROMPTS
+from app.utils.rate_limit_utils import get_rate_limit_stats
+from app.utils.resilience_utils import get_resilience_stats
+from app.utils.routing_utils import get_routing_stats
+from app.utils.cache_utils import RESULT_CACHE, OCR_CACHE
+from app.utils.image_utils import get_preprocessing_stats, get_detail_stats, get_hosting_stats
+from app.utils.reference_utils import REFERENCE_IMAGES
+from app.storage.blob_storage import STORAGE, blob_ref, create_upload, get_blob_cache_stats, uploads_enabled, validate_upload, verify_upload_token
+from app.jobs.job_queue import JOB_QUEUE, public_job, validate_job
+from app.jobs.worker import start_workers
+from app import config
 
 
 app = Flask(__name__)   
 
+# The grading tools are imported on the first request that needs them, keeping startup fast
+ocr_with_azure_gpt4o_text = lazy_callable("app.analysis.english_tool", "ocr_with_azure_gpt4o_text")
+ocr_with_azure_gpt4o_math = lazy_callable("app.analysis.math_tool", "ocr_with_azure_gpt4o_math")
+ocr_with_azure_gpt4o_image = lazy_callable("app.analysis.map_tool", "ocr_with_azure_gpt4o_image")
+validate_notifications = lazy_callable("app.analysis.sendmail", "validate_notifications")
+queue_emails = lazy_callable("app.analysis.sendmail", "queue_emails")
+get_email_stats = lazy_callable("app.analysis.sendmail", "get_email_stats")
+
+def init_app():
+    """Starts the app's background work; called once by the serving process, never on import."""
+    # Encode the configured teacher reference images before the first submission arrives
+    REFERENCE_IMAGES.preload()
+    # Local testing runs job workers in-process; in production set JOB_INPROCESS_WORKERS=0 and run app.jobs.worker
+    start_workers(config.JOB_INPROCESS_WORKERS)
+
 @app.route('/')
 def index():
     return "Hello, World!"
@@ -15,27 +41,87 @@ def index():
 @app.route('/ocr/text', methods=['POST'])
 def ocr_text():
     path = json.loads( request.get_data().decode('utf-8') )
-    data = ocr_with_azure_gpt4o_text(path['path'], path['assignment_max_marks'], path['student_class'], path['assign_que'])
+    data = ocr_with_azure_gpt4o_text(path['path'], path['assignment_max_marks'], path['student_class'], path['assign_que'], fused=path.get('fused'), language=path.get('language'))
     return data
 
 @app.route('/ocr/math', methods=['POST'])
 def ocr_math():
     path = json.loads( request.get_data().decode('utf-8') )
-    data = ocr_with_azure_gpt4o_math(path['path'], path['assignment_max_marks'], path['student_class'], path['assign_que'])
+    data = ocr_with_azure_gpt4o_math(path['path'], path['assignment_max_marks'], path['student_class'], path['assign_que'], fused=path.get('fused'), language=path.get('language'))
     return data
 
 @app.route('/ocr/diagram', methods=['POST'])
 def ocr_diagram():
     path = json.loads( request.get_data().decode('utf-8') )
-    data = ocr_with_azure_gpt4o_image(path['path'],path['expected_output_path'] ,path['assignment_max_marks'], path['student_class'], path['assign_que'])
+    data = ocr_with_azure_gpt4o_image(path['path'],path['expected_output_path'] ,path['assignment_max_marks'], path['student_class'], path['assign_que'], language=path.get('language'))
     return data
 
+@app.route('/uploads', methods=['POST'])
+def start_upload():
+    # Hands out a short-lived URL the client PUTs the image to; grade it by passing the returned "blob" as the path
+    body = request.get_json(silent=True) or {}
+    if not uploads_enabled():
+        return jsonify({"error": "Direct uploads are disabled until SECRET_KEY is set"}), 503
+    error = validate_upload(body)
+    if error:
+        return jsonify({"error": error}), 400
+    return jsonify(create_upload(body['content_type'], request.host_url)), 201
+
+@app.route('/uploads/<token>', methods=['PUT'])
+def put_upload(token):
+    # Local storage only: streams the body to disk, standing in for the storage service's own endpoint
+    blob_name = verify_upload_token(token) if STORAGE.name == "local" else None
+    if blob_name is None:
+        return jsonify({"error": "Upload URL is invalid or has expired"}), 403
+    if (request.content_length or 0) > config.UPLOAD_MAX_BYTES:
+        return jsonify({"error": f"Upload is larger than {config.UPLOAD_MAX_BYTES} bytes"}), 413
+    writer = STORAGE.writer(blob_name, config.UPLOAD_MAX_BYTES)
+    try:
+        for chunk in iter(lambda: request.stream.read(config.UPLOAD_CHUNK_SIZE), b""):
+            writer.write(chunk)
+    except ValueError as e:
+        writer.abort()
+        return jsonify({"error": str(e)}), 413
+    writer.commit()
+    return jsonify({"blob": blob_ref(blob_name), "size": writer.size}), 201
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    # Queues a grading job and answers immediately; poll GET /jobs/<id> or pass a callback_url
+    job = json.loads( request.get_data().decode('utf-8') )
+    kind = job.get('kind', 'text')
+    error = validate_job(kind, job)
+    if error:
+        return jsonify({"error": error}), 400
+    job_id = JOB_QUEUE.submit(kind, job, job.get('callback_url'))
+    return jsonify({"id": job_id, "status": "queued"}), 202, {"Location": f"/jobs/{job_id}"}
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = JOB_QUEUE.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(public_job(job)), 200
+
 @app.route('/notify', methods=['POST'])
 def notify():
+    # Queues one email, or a "notifications" list of them, and answers before any is sent
     notification = request.json
-    print(f"Notification: {notification['message']}")
-    send_email(notification['subject'], notification['message'], notification['to'])
-    return jsonify({"message": "Notification sent"}), 200
+    notifications = notification.get('notifications') or [notification]
+    error = validate_notifications(notifications)
+    if error:
+        return jsonify({"error": error}), 400
+    if not queue_emails(notifications, digest=notification.get('digest', True)):
+        return jsonify({"error": "Email queue is full, retry later"}), 503
+    return jsonify({"message": "Notification queued", "queued": len(notifications)}), 202
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return jsonify({"latency": get_latency_stats(), "result_cache": RESULT_CACHE.stats(), "ocr_cache": OCR_CACHE.stats(), "image_preprocessing": get_preprocessing_stats(), "vision_detail": get_detail_stats(), "image_hosting": get_hosting_stats(), "reference_images": REFERENCE_IMAGES.stats(), "jobs": JOB_QUEUE.stats(), "rate_limits": get_rate_limit_stats(), "resilience": get_resilience_stats(), "routing": get_routing_stats(), "token_usage": get_usage_stats(), "prompts": PROMPTS.stats(), "structured_output": get_parse_stats(), "email": get_email_stats(), "blob_cache": get_blob_cache_stats()}), 200
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    debug = True
+    # The debug reloader runs this file in a watcher and a serving child; only the child starts workers
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        init_app()
+    app.run(debug=debug)
\ No newline at end of file
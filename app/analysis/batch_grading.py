@@ -0,0 +1,94 @@
+import asyncio
+
+from app import config
+from app.utils.cache_utils import RESULT_CACHE
+from app.utils.lazy_utils import lazy_callable
+
+# Async graders a batch can fan out to, keyed by the "mode" field of /ocr/batch; imported on first use
+BATCH_GRADERS = {
+    "text": lazy_callable("app.analysis.english_tool", "aocr_with_azure_gpt4o_text"),
+    "math": lazy_callable("app.analysis.math_tool", "aocr_with_azure_gpt4o_math"),
+}
+
+BATCH_FIELDS = ["assignment_max_marks", "student_class", "assign_que"]
+
+
+def validate_batch(batch):
+    """Returns an error message for an unusable /ocr/batch body, or None; checked before the response starts streaming."""
+    mode = batch.get('mode', 'text')
+    if mode not in BATCH_GRADERS:
+        return f"Unsupported mode '{mode}'. Use one of: {', '.join(BATCH_GRADERS)}"
+    paths = batch.get('paths')
+    if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+        return "'paths' must be a list of image paths"
+    if not paths or len(paths) > config.BATCH_MAX_SHEETS:
+        return f"'paths' must list between 1 and {config.BATCH_MAX_SHEETS} images"
+    missing = [field for field in BATCH_FIELDS if field not in batch]
+    if missing:
+        return f"Missing fields: {', '.join(missing)}"
+    concurrency = batch.get('concurrency')
+    if concurrency is not None and (not isinstance(concurrency, int) or isinstance(concurrency, bool) or concurrency < 1):
+        return "'concurrency' must be a whole number of at least 1"
+    return None
+
+
+def sheet_key(mode, image_path_or_url, assignment_max_marks, student_class, assign_que, fused=None, language=None):
+    """The result cache key the grader would use for this sheet, so graded sheets are recognised up front."""
+    return BATCH_GRADERS[mode].cache_key(image_path_or_url, assignment_max_marks, student_class, assign_que, fused=fused, language=language)
+
+
+async def grade_batch(mode, paths, assignment_max_marks, student_class, assign_que, concurrency=None, fused=None, language=None):
+    """Grades a class of sheets for one question, yielding each student's result as soon as it is ready.
+
+    Identical sheets in the batch are graded once, sheets already in the
+    result cache are returned without a new LLM call, and at most
+    `concurrency` sheets are in flight at a time (capped by
+    BATCH_MAX_CONCURRENCY).
+    """
+    grader = BATCH_GRADERS[mode]
+    # Callers may ask for less parallelism than the configured cap, never more
+    semaphore = asyncio.Semaphore(min(concurrency or config.BATCH_MAX_CONCURRENCY, config.BATCH_MAX_CONCURRENCY))
+    summary = {"total": len(paths), "graded": 0, "duplicates": 0, "previously_graded": 0, "errors": 0}
+
+    keys = await asyncio.gather(*[
+        asyncio.to_thread(sheet_key, mode, path, assignment_max_marks, student_class, assign_que, fused, language)
+        for path in paths
+    ])
+
+    # One thread for every lookup: the cache is SQLite behind a lock, so they run one at a time anyway
+    previous_results = await asyncio.to_thread(lambda: [RESULT_CACHE.get(key) for key in keys])
+
+    pending = {}
+    for path, key, previous_result in zip(paths, keys, previous_results):
+        if previous_result is not None:
+            summary["previously_graded"] += 1
+            yield {"path": path, "status": "previously_graded", "result": previous_result}
+        else:
+            pending.setdefault(key, []).append(path)
+
+    async def grade_one(key, sheet_paths):
+        async with semaphore:
+            result = await grader(sheet_paths[0], assignment_max_marks, student_class, assign_que, fused=fused, language=language)
+        return key, sheet_paths, result
+
+    tasks = [asyncio.create_task(grade_one(key, sheet_paths)) for key, sheet_paths in pending.items()]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            key, sheet_paths, result = await next_done
+            # The analysis tools report failures as strings rather than raising
+            if isinstance(result, str):
+                summary["errors"] += len(sheet_paths)
+                for path in sheet_paths:
+                    yield {"path": path, "status": "error", "error": result}
+                continue
+            summary["graded"] += 1
+            summary["duplicates"] += len(sheet_paths) - 1
+            yield {"path": sheet_paths[0], "status": "graded", "result": result}
+            for path in sheet_paths[1:]:
+                yield {"path": path, "status": "duplicate", "duplicate_of": sheet_paths[0], "result": result}
+    finally:
+        # Client went away mid-stream: stop paying for sheets nobody will read
+        for task in tasks:
+            task.cancel()
+
+    yield {"summary": summary}
@@ -1,181 +1,247 @@
-import os
-import base64
-from openai import AzureOpenAI
-# from langchain_openai import AzureChatOpenAI 
-from langchain_openai import AzureChatOpenAI
-import json
-import re
+import asyncio
 
-from dotenv import load_dotenv
+from app import config
+from app.ocr import ocr_processor
+from app.utils.cache_utils import OCR_CACHE, RESULT_CACHE, cached_grading
+from app.utils.image_utils import abuild_image_part, build_image_part
+from app.utils.routing_utils import SCORING_TIER, VISION_TIER, arouted, routed
+from app.utils.resilience_utils import call_with_retries, acall_with_retries
+from app.utils.openai_utils import record_latency, record_usage
+from app.utils.parse_utils import JSON_MODE, parse_json_reply
+from app.utils.prompt_utils import PROMPTS
+from app.utils.stream_utils import astream_evaluation
 
 # --- Configuration ---
-# Load environment variables from .env file
-load_dotenv()
+# Credentials and deployment names come from app/config.py, which loads .env once
+IMAGE_ROUTE = "text" # Selects grayscale preprocessing and the VISION_DETAIL_OVERRIDES entry
 
-AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
-AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
-GPT4O_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_GPT4O_DEPLOYMENT_NAME")
-AZURE_OPENAI_API_VERSION = "2024-05-01-preview" # Or your preferred version
 
-llm = AzureChatOpenAI(model=GPT4O_DEPLOYMENT_NAME, api_version=AZURE_OPENAI_API_VERSION, azure_endpoint=AZURE_OPENAI_ENDPOINT, api_key=AZURE_OPENAI_API_KEY)
+# Grading prompts are files in app/prompts/, with optional grade band and language variants.
+# Each is a static system prefix Azure can cache plus a per-student user turn (app/utils/prompt_utils.py).
+EVALUATION_PROMPT = "english.evaluation"
+# Single-call ("fused") mode: transcription and evaluation come back in one JSON response
+FUSED_EVALUATION_PROMPT = "english.fused"
 
+def prompt_version(arguments):
+    """Part of every result cache key: the prompt variants this student is graded with, so editing one invalidates earlier grades."""
+    return PROMPTS.version_for((EVALUATION_PROMPT, FUSED_EVALUATION_PROMPT), arguments["student_class"], arguments["language"])
 
-from langchain_core.prompts import PromptTemplate
+def llm_response(ocr_data,assignment_max_marks,student_class,assign_que,prompt=None):
+    prompt = prompt or PROMPTS.get(EVALUATION_PROMPT, student_class)
+    messages = prompt.messages(ocr_data=ocr_data,assign_que=assign_que,student_class=student_class,assignment_max_marks=assignment_max_marks)
+    with record_latency("english_tool.llm_response"):
+        response = call_with_retries("english_tool.llm_response", routed(SCORING_TIER, lambda deployment, timeout: deployment.chat_llm().invoke(messages, timeout=timeout, response_format=JSON_MODE)))
+    record_usage("english_tool.llm_response", response)
+    return response.content
 
-def llm_response(ocr_data,assignment_max_marks,student_class,assign_que):
-    prompt = PromptTemplate.from_template(
-    """
-            You are an assignment evaluator. Your role is to assess student responses for school assignments ranging from 5th to 12th grade.
-            You will be provided with:
-            The assignment question and max marks to be given
-            The student uploaded answer
-            The teacher's expected answer
-            The full chapter notes
-            Your tasks are:
-            Evaluate the student's answer.
-            Assign a score out of max marks, based on accuracy, completeness, clarity, and relevance.
-            Provide constructive feedback in a bullet-point format that is age-appropriate and encourages learning.
-            Identify any missing details or misconceptions in the student's response.
-            Suggest specific areas of improvement to help the student enhance their understanding.
-            Recommend 2-3 credible scholarly or educational resources (e.g., Khan Academy, JSTOR, National Geographic, or government education portals) that can help the student better understand the concept.
-            Do not fabricate information. If no scholarly references are available, clearly state that.
-            Ensure the credibility of all feedback and references before finalizing the response.
-            
-            Below is the user input:
-            “Assignment Question:\n”
-            {assign_que}
-
-            “Student’s Class:\n”
-            {student_class}
-            
-            “Student’s answer:\n”
-            {ocr_data}
-            
-            “Assignment Max Marks:\n”
-            {assignment_max_marks}   
-            
-        
-            Please provide the output in json structure strictly.
-            Use the following output format:
-            ## Score:
-            <only scored number>
-            
-            ## Feedback:
-            - <Point 1>
-            - <Point 2>
-            - <Point 3>
-            (Add more points as needed)
-            
-            ## Area of Improvement:
-            - <List specific areas or concepts the student should focus on>
-            
-            ## Scholarly Reference Links:
-            - <Link 1>
-            - <Link 2>
-            - <Link 3>
-            (If unavailable,     state "No credible references found.")
+async def allm_response(ocr_data,assignment_max_marks,student_class,assign_que,prompt=None):
+    """Async variant of llm_response for the asyncio grading path."""
+    prompt = prompt or PROMPTS.get(EVALUATION_PROMPT, student_class)
+    messages = prompt.messages(ocr_data=ocr_data,assign_que=assign_que,student_class=student_class,assignment_max_marks=assignment_max_marks)
+    with record_latency("english_tool.llm_response"):
+        response = await acall_with_retries("english_tool.llm_response", arouted(SCORING_TIER, lambda deployment, timeout: deployment.chat_llm().ainvoke(messages, timeout=timeout, response_format=JSON_MODE)))
+    record_usage("english_tool.llm_response", response)
+    return response.content
+
+
+
+# --- Helper Functions ---
+def transcribe_image(image_path_or_url, prompt):
+    """Runs the transcription step on the backend configured for this route (see app/ocr/ocr_processor.py).
+
+    Returns None if a local image could not be read.
     """
+    return ocr_processor.transcribe_image(image_path_or_url, prompt, IMAGE_ROUTE, "english_tool.ocr")
+
+async def atranscribe_image(image_path_or_url, prompt):
+    """Async variant of transcribe_image."""
+    return await ocr_processor.atranscribe_image(image_path_or_url, prompt, IMAGE_ROUTE, "english_tool.ocr")
+
+def use_fused(fused):
+    """Fused mode is an Azure vision call, so it only applies while Azure also transcribes this route."""
+    if fused is None:
+        fused = config.FUSED_GRADING
+    return fused and ocr_processor.get_backend(IMAGE_ROUTE).name == "azure"
+
+# Results are keyed by whether fused mode applies, so fused=None (the default) and an explicit value share an entry
+CACHE_KEY_NORMALIZERS = {"fused": lambda fused: bool(use_fused(fused))}
+
+def format_output(raw_llm_output_string, processed_evaluation_result, evaluation_prompt):
+    """Parses the evaluator's reply and pairs it with the OCR transcription and the prompt version used."""
+    processed_evaluation_result = parse_json_reply(processed_evaluation_result, "english_tool.llm_response")
+    return {
+        "result": processed_evaluation_result,
+        "ocr_text": raw_llm_output_string,
+        "prompt_version": str(evaluation_prompt)
+    }
+
+def build_fused_messages(evaluation_prompt, image_part, assignment_max_marks, student_class, assign_que):
+    """Builds the single request that both transcribes and grades the answer; the student's image goes last."""
+    return evaluation_prompt.messages(
+        trailing_parts=[image_part],
+        assign_que=assign_que,
+        student_class=student_class,
+        assignment_max_marks=assignment_max_marks
     )
-    return llm.invoke(prompt.format(ocr_data=ocr_data,assign_que=assign_que,student_class=student_class,assignment_max_marks=assignment_max_marks)).content
 
+def format_fused_output(raw_llm_output_string, image_path_or_url, prompt, evaluation_prompt):
+    """Splits the fused JSON reply into the usual result/ocr_text shape and keeps the transcription for re-grading."""
+    evaluation = parse_json_reply(raw_llm_output_string, "english_tool.fused")
+    ocr_text = evaluation.pop("ocr_text", "")
+    if ocr_text:
+        OCR_CACHE.set(ocr_processor.transcription_key(IMAGE_ROUTE, image_path_or_url, prompt), ocr_text)
+    return {
+        "result": evaluation,
+        "ocr_text": ocr_text,
+        "prompt_version": str(evaluation_prompt)
+    }
 
+def grade_image_fused(image_path_or_url, assignment_max_marks, student_class, assign_que, prompt, language=None):
+    """Transcribes and grades in one vision call using JSON response format.
 
-# --- Helper Functions ---
-def encode_image_to_base64(image_path):
-    """Encodes a local image file to a base64 string."""
-    try:
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-    except FileNotFoundError:
-        print(f"Error: Image file not found at {image_path}")
+    Returns None if a local image could not be encoded.
+    """
+    image_part = build_image_part(image_path_or_url, IMAGE_ROUTE)
+    if not image_part:
         return None
-    except Exception as e:
-        print(f"Error encoding image: {e}")
+
+    evaluation_prompt = PROMPTS.get(FUSED_EVALUATION_PROMPT, student_class, language)
+    print("Sending fused grading request to Azure OpenAI GPT-4o...")
+    with record_latency("english_tool.fused"):
+        response = call_with_retries("english_tool.fused", routed(VISION_TIER, lambda deployment, timeout: deployment.client().chat.completions.create(
+            model=deployment.name,
+            messages=build_fused_messages(evaluation_prompt, image_part, assignment_max_marks, student_class, assign_que),
+            response_format=JSON_MODE,
+            max_tokens=3000,  # Room for the transcription plus the evaluation
+            timeout=timeout,
+        )))
+    print("Received response.")
+    record_usage("english_tool.fused", response)
+    return format_fused_output(response.choices[0].message.content, image_path_or_url, prompt, evaluation_prompt)
+
+async def agrade_image_fused(image_path_or_url, assignment_max_marks, student_class, assign_que, prompt, language=None):
+    """Async variant of grade_image_fused."""
+    image_part = await abuild_image_part(image_path_or_url, IMAGE_ROUTE)
+    if not image_part:
         return None
 
-def get_image_mime_type(image_path):
-    """Determines the MIME type of an image based on its extension."""
-    ext = os.path.splitext(image_path)[1].lower()
-    if ext == ".png":
-        return "image/png"
-    elif ext in [".jpg", ".jpeg"]:
-        return "image/jpeg"
-    elif ext == ".gif":
-        return "image/gif"
-    elif ext == ".webp":
-        return "image/webp"
-    else:
-        # Default or raise an error if you want to be strict
-        print(f"Warning: Unknown image type for extension {ext}. Defaulting to image/jpeg.")
-        print("Supported formats typically include PNG, JPEG, GIF, WEBP.")
-        return "image/jpeg"
+    evaluation_prompt = PROMPTS.get(FUSED_EVALUATION_PROMPT, student_class, language)
+    print("Sending fused grading request to Azure OpenAI GPT-4o...")
+    with record_latency("english_tool.fused"):
+        response = await acall_with_retries("english_tool.fused", arouted(VISION_TIER, lambda deployment, timeout: deployment.async_client().chat.completions.create(
+            model=deployment.name,
+            messages=build_fused_messages(evaluation_prompt, image_part, assignment_max_marks, student_class, assign_que),
+            response_format=JSON_MODE,
+            max_tokens=3000,
+            timeout=timeout,
+        )))
+    print("Received response.")
+    record_usage("english_tool.fused", response)
+    return await asyncio.to_thread(format_fused_output, response.choices[0].message.content, image_path_or_url, prompt, evaluation_prompt)
 
 # --- Main OCR Function ---
-def ocr_with_azure_gpt4o_text(image_path_or_url,assignment_max_marks,student_class,assign_que,prompt="Extract all text from this image.",):
+@cached_grading("english_tool", prompt_version, normalizers=CACHE_KEY_NORMALIZERS)
+def ocr_with_azure_gpt4o_text(image_path_or_url,assignment_max_marks,student_class,assign_que,prompt="Extract all text from this image.",fused=None,language=None,):
 
-    if not all([AZURE_OPENAI_API_KEY, AZURE_OPENAI_ENDPOINT, GPT4O_DEPLOYMENT_NAME]):
+    if not config.AZURE_READY:
         return "Error: Azure OpenAI credentials or deployment name not configured. Please check your .env file."
 
     try:
-        client = AzureOpenAI(
-            api_key=AZURE_OPENAI_API_KEY,
-            api_version=AZURE_OPENAI_API_VERSION,
-            azure_endpoint=AZURE_OPENAI_ENDPOINT
-        )
-
-        image_data_url = ""
-        if image_path_or_url.startswith("http://") or image_path_or_url.startswith("https://"):
-            # If it's a URL, GPT-4o can fetch it directly
-            image_data_url = image_path_or_url
-            print(f"Using image URL: {image_data_url}")
-        else:
-            # If it's a local path, encode it
-            print(f"Using local image path: {image_path_or_url}")
-            base64_image = encode_image_to_base64(image_path_or_url)
-            if not base64_image:
-                return "Error: Could not encode local image."
-            mime_type = get_image_mime_type(image_path_or_url)
-            image_data_url = f"data:{mime_type};base64,{base64_image}"
-
-        print("Sending request to Azure OpenAI GPT-4o...")
-        response = client.chat.completions.create(
-            model=GPT4O_DEPLOYMENT_NAME,  # Your GPT-4o deployment name
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": image_data_url,
-                                # "detail": "low" # or "high" or "auto" - "high" might be better for OCR
-                            },
-                        },
-                    ],
-                }
-            ],
-            max_tokens=2000  # Adjust as needed based on expected text length
-        )
-        print("Received response.")
-        raw_llm_output_string = response.choices[0].message.content
+        # Fused mode saves a round trip, but a stored transcription makes the text-only scoring call cheaper still
+        if use_fused(fused) and OCR_CACHE.get(ocr_processor.transcription_key(IMAGE_ROUTE, image_path_or_url, prompt)) is None:
+            output_data = grade_image_fused(image_path_or_url, assignment_max_marks, student_class, assign_que, prompt, language)
+            return output_data if output_data is not None else "Error: Could not encode local image."
+
+        raw_llm_output_string = transcribe_image(image_path_or_url, prompt)
+        if raw_llm_output_string is None:
+            return "Error: Could not encode local image."
+        evaluation_prompt = PROMPTS.get(EVALUATION_PROMPT, student_class, language)
         processed_evaluation_result = llm_response(
                 raw_llm_output_string,
                 assignment_max_marks,
                 student_class,
-                assign_que
+                assign_que,
+                prompt=evaluation_prompt
             )
         print(raw_llm_output_string)
-        processed_evaluation_result = json.loads(re.sub(r"(^```(?:json)?\s*)|(\s*```$)", "", processed_evaluation_result.strip()).strip())
-        output_data = {
-            "result": processed_evaluation_result,
-            "ocr_text": raw_llm_output_string
-        }
-        return output_data
+        return format_output(raw_llm_output_string, processed_evaluation_result, evaluation_prompt)
     
     except Exception as e:
         return f"An API error occurred: {e}"
 
+@cached_grading("english_tool", prompt_version, normalizers=CACHE_KEY_NORMALIZERS)
+async def aocr_with_azure_gpt4o_text(image_path_or_url,assignment_max_marks,student_class,assign_que,prompt="Extract all text from this image.",fused=None,language=None,):
+    """Async variant of ocr_with_azure_gpt4o_text: awaits both LLM calls instead of blocking a worker."""
+
+    if not config.AZURE_READY:
+        return "Error: Azure OpenAI credentials or deployment name not configured. Please check your .env file."
+
+    try:
+        if use_fused(fused):
+            ocr_key = await asyncio.to_thread(ocr_processor.transcription_key, IMAGE_ROUTE, image_path_or_url, prompt)
+            if await asyncio.to_thread(OCR_CACHE.get, ocr_key) is None:
+                output_data = await agrade_image_fused(image_path_or_url, assignment_max_marks, student_class, assign_que, prompt, language)
+                return output_data if output_data is not None else "Error: Could not encode local image."
+
+        raw_llm_output_string = await atranscribe_image(image_path_or_url, prompt)
+        if raw_llm_output_string is None:
+            return "Error: Could not encode local image."
+        evaluation_prompt = PROMPTS.get(EVALUATION_PROMPT, student_class, language)
+        processed_evaluation_result = await allm_response(
+                raw_llm_output_string,
+                assignment_max_marks,
+                student_class,
+                assign_que,
+                prompt=evaluation_prompt
+            )
+        return format_output(raw_llm_output_string, processed_evaluation_result, evaluation_prompt)
+
+    except Exception as e:
+        return f"An API error occurred: {e}"
+
+async def astream_ocr_with_azure_gpt4o_text(image_path_or_url,assignment_max_marks,student_class,assign_que,prompt="Extract all text from this image.",language=None,):
+    """Streaming variant of aocr_with_azure_gpt4o_text: yields events for /ocr/text/stream.
+
+    Sends the transcription as soon as it is ready, then the scoring reply
+    as it is generated (see app/utils/stream_utils.py), then the same result
+    the non-streaming call returns. Always transcribes and scores in two
+    calls so the transcription can go out first; fused mode does not apply.
+    The result is shared with the non-streaming call through the result cache.
+    """
+
+    if not config.AZURE_READY:
+        yield {"event": "error", "error": "Error: Azure OpenAI credentials or deployment name not configured. Please check your .env file."}
+        return
+
+    try:
+        key = await asyncio.to_thread(aocr_with_azure_gpt4o_text.cache_key, image_path_or_url, assignment_max_marks, student_class, assign_que, prompt=prompt, fused=False, language=language)
+        cached = await asyncio.to_thread(RESULT_CACHE.get, key)
+        if cached is not None:
+            print("Result cache hit for english_tool.")
+            yield {"event": "transcription", "text": cached["ocr_text"]}
+            yield {"event": "result", "result": cached}
+            return
+
+        raw_llm_output_string = await atranscribe_image(image_path_or_url, prompt)
+        if raw_llm_output_string is None:
+            yield {"event": "error", "error": "Error: Could not encode local image."}
+            return
+        yield {"event": "transcription", "text": raw_llm_output_string}
+
+        evaluation_prompt = PROMPTS.get(EVALUATION_PROMPT, student_class, language)
+        messages = evaluation_prompt.messages(ocr_data=raw_llm_output_string,assign_que=assign_que,student_class=student_class,assignment_max_marks=assignment_max_marks)
+        reply = []
+        async for event in astream_evaluation("english_tool.llm_response", SCORING_TIER, messages, response_format=JSON_MODE):
+            if event["event"] == "delta":
+                reply.append(event["text"])
+            yield event
+        output_data = format_output(raw_llm_output_string, "".join(reply), evaluation_prompt)
+        await asyncio.to_thread(RESULT_CACHE.set, key, output_data)
+        yield {"event": "result", "result": output_data}
+
+    except Exception as e:
+        yield {"event": "error", "error": f"An API error occurred: {e}"}
+
 
 
 
@@ -1,169 +1,76 @@
-import os
-import base64
-from openai import AzureOpenAI
-from langchain_openai import AzureChatOpenAI
-import json
-import re
-from dotenv import load_dotenv
-from langchain_core.prompts import PromptTemplate
-
-load_dotenv()
-
-AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
-AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
-GPT4O_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_GPT4O_DEPLOYMENT_NAME")
-AZURE_OPENAI_API_VERSION = "2024-05-01-preview" # Or your preferred version
-
-llm = AzureChatOpenAI(model=GPT4O_DEPLOYMENT_NAME, api_version=AZURE_OPENAI_API_VERSION, azure_endpoint=AZURE_OPENAI_ENDPOINT, api_key=AZURE_OPENAI_API_KEY)
-
-def encode_image_to_base64(image_path):
-    """Encodes a local image file to a base64 string."""
-    try:
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-    except FileNotFoundError:
-        print(f"Error: Image file not found at {image_path}")
-        return None
-    except Exception as e:
-        print(f"Error encoding image: {e}")
-        return None
-
-def get_image_mime_type(image_path):
-    """Determines the MIME type of an image based on its extension."""
-    ext = os.path.splitext(image_path)[1].lower()
-    if ext == ".png":
-        return "image/png"
-    elif ext in [".jpg", ".jpeg"]:
-        return "image/jpeg"
-    elif ext == ".gif":
-        return "image/gif"
-    elif ext == ".webp":
-        return "image/webp"
-    else:
-        print(f"Warning: Unknown image type for extension {ext}. Defaulting to image/jpeg.")
-        print("Supported formats typically include PNG, JPEG, GIF, WEBP.")
-        return "image/jpeg"
-
-DEFAULT_EVALUATION_PROMPT_TEMPLATE = """You are an assignment evaluator. Your role is to assess student responses for school assignments ranging from 5th to 12th grade.
-You will be receiving two images: the first is the student's submitted answer image, and the second is the teacher's expected answer image.
-Your primary goal is to compare the student's image with the teacher's image. Specifically, check if the student's image content matches the teacher's image content and if the student has labeled all the required elements as per the assignment question, if applicable.
-As the teach uploaded image is a digital image, you should focus on the visual aspects and labeling accuracy of the student's hand-drawn work in comparison to the teacher's digital image. Rather than extracting text, you will evaluate the visual and labeling aspects of the student's work.
-As the student uploaded image is a hand-drawn work, so you will get to see a lot of difference in visual aspects, so check if the student labeled correctly or not.
-
-Marks Distribution (if not otherwise specified by the question or max marks context):
-- 30% of marks for overall visual matching with the teacher's image.
-- 70% of marks for correct labeling and answering specific question components based on the teacher's image and the question.
-
-You will be provided with:
-- The assignment question and maximum marks.
-- The student's uploaded answer (as the first image). Which is an image of their hand-draw work.
-- The teacher's expected answer (as the second image). Which is an image of the digital Image.
-- (Full chapter notes might be included by the user in the context below, if available. If not, evaluate based on the provided images and question.)
-
-Your tasks are:
-1. Evaluate the student's answer by analyzing the first image and comparing it to the second image and the assignment question.
-2. Assign a score out of the provided 'Assignment Max Marks'. This score should reflect accuracy, completeness (including all required labels if it's a labeling task), clarity, and relevance.
-3. Provide constructive feedback in a bullet-point format that is age-appropriate for the 'Student’s Class' and encourages learning.
-4. Identify any missing details or misconceptions in the student's response (first image).
-5. Suggest specific areas of improvement to help the student enhance their understanding.
-6. Recommend 2-3 credible scholarly or educational resources (e.g., Khan Academy, JSTOR, National Geographic, or government education portals) relevant to the assignment question that can help the student.
-7. Do not fabricate information. If no scholarly references are readily available or appropriate, clearly state that.
-8. Ensure the credibility of all feedback and references.
-
-Below is the user input:
-Assignment Question:
-{assign_que}
-
-Student’s Class:
-{student_class}
-
-Assignment Max Marks:
-{assignment_max_marks}
-
-Instructions for output:
-Please provide your entire response as a single, valid JSON object. The JSON object should have the following keys:
-- "score": A numerical value representing the marks awarded.
-- "feedback": A list of strings, where each string is a feedback point.
-- "area_of_improvement": A list of strings, where each string suggests an area for improvement.
-"""
+import asyncio
+from app import config
+from app.utils.cache_utils import RESULT_CACHE, cached_grading
+from app.utils.image_utils import abuild_image_part, build_image_part
+from app.utils.reference_utils import REFERENCE_IMAGES
+from app.utils.routing_utils import VISION_TIER, arouted, routed
+from app.utils.resilience_utils import call_with_retries, acall_with_retries
+from app.utils.openai_utils import record_latency, record_usage
+from app.utils.parse_utils import JSON_MODE, parse_json_reply
+from app.utils.prompt_utils import PROMPTS
+from app.utils.stream_utils import astream_evaluation
+
+# --- Configuration ---
+# Credentials and deployment names come from app/config.py, which loads .env once
+IMAGE_ROUTE = "diagram" # Keeps colour and selects the VISION_DETAIL_OVERRIDES entry
+
+# The rubric (app/prompts/map.evaluation*.txt) and the teacher's reference image are the same for the
+# whole class and form the cached prompt prefix; the question fields and the student's image come last
+EVALUATION_PROMPT = "map.evaluation"
+
+def prompt_version(arguments):
+    """Part of every result cache key: editing the prompt variant a student is graded with invalidates earlier grades."""
+    if arguments["prompt"] is not None:
+        return str(arguments["prompt"])
+    return PROMPTS.version_for((EVALUATION_PROMPT,), arguments["student_class"], arguments["language"])
+
+def build_evaluation_messages(prompt, image_part, original_image_part, assignment_max_marks, student_class, assign_que):
+    """Builds the rubric + teacher image + question + student image request."""
+    return prompt.messages(
+        leading_parts=[original_image_part],
+        trailing_parts=[image_part],
+        assign_que=assign_que,
+        student_class=student_class,
+        assignment_max_marks=assignment_max_marks
+    )
+
+def parse_evaluation(raw_llm_output_string, evaluation_prompt):
+    """Parses the JSON evaluation (see app/utils/parse_utils.py) and records the prompt version used."""
+    evaluation = parse_json_reply(raw_llm_output_string, "map_tool.evaluate")
+    evaluation["prompt_version"] = str(evaluation_prompt)
+    return evaluation
 
 # --- Main OCR Function ---
-def ocr_with_azure_gpt4o_image(image_path_or_url,expected_output_path,assignment_max_marks,student_class,assign_que,prompt=DEFAULT_EVALUATION_PROMPT_TEMPLATE,):
+@cached_grading("map_tool", prompt_version, image_args=("image_path_or_url", "expected_output_path"), fingerprinters={"expected_output_path": REFERENCE_IMAGES.fingerprint})
+def ocr_with_azure_gpt4o_image(image_path_or_url,expected_output_path,assignment_max_marks,student_class,assign_que,prompt=None,language=None,):
 
-    if not all([AZURE_OPENAI_API_KEY, AZURE_OPENAI_ENDPOINT, GPT4O_DEPLOYMENT_NAME]):
+    if not config.AZURE_READY:
         return "Error: Azure OpenAI credentials or deployment name not configured. Please check your .env file."
 
     try:
-        client = AzureOpenAI(
-            api_key=AZURE_OPENAI_API_KEY,
-            api_version=AZURE_OPENAI_API_VERSION,
-            azure_endpoint=AZURE_OPENAI_ENDPOINT
-        )
-
-        image_data_url = ""
-        original_image_data_url = ""
-        if image_path_or_url.startswith("http://") or image_path_or_url.startswith("https://"):
-            image_data_url = image_path_or_url
-            print(f"Using image URL: {image_data_url}")
-        else:
-            print(f"Using local image path: {image_path_or_url}")
-            base64_image = encode_image_to_base64(image_path_or_url)
-            if not base64_image:
-                return "Error: Could not encode local image."
-            mime_type = get_image_mime_type(image_path_or_url)
-            image_data_url = f"data:{mime_type};base64,{base64_image}"
-        
-        if expected_output_path.startswith("http://") or expected_output_path.startswith("https://"):
-            original_image_data_url = expected_output_path
-            print(f"Using expected output image URL: {original_image_data_url}")
-        else:
-            print(f"Using expected output local image path: {expected_output_path}")
-            base64_expected_image = encode_image_to_base64(expected_output_path)
-            if not base64_expected_image:
-                return "Error: Could not encode expected output image."
-            mime_type = get_image_mime_type(expected_output_path)
-            original_image_data_url = f"data:{mime_type};base64,{base64_expected_image}"
-
-        formatted_prompt = prompt.format(
-            assign_que=assign_que,
-            student_class=student_class,
-            assignment_max_marks=assignment_max_marks
-        )
-
-        message_content_list = [
-            {"type": "text", "text": formatted_prompt},
-            {
-                "type": "image_url",
-                "image_url": {
-                    "url": image_data_url,
-                    "detail": "high"
-                },
-            },
-            {
-                "type": "image_url",
-                "image_url": {
-                    "url": original_image_data_url,
-                    "detail": "high"
-                },
-            },
-        ]
+        prompt = prompt or PROMPTS.get(EVALUATION_PROMPT, student_class, language)
+        image_part = build_image_part(image_path_or_url, IMAGE_ROUTE)
+        if not image_part:
+            return "Error: Could not encode local image."
+        # The teacher's image is the same for the whole class, it is only encoded once
+        original_image_part = REFERENCE_IMAGES.image_part(expected_output_path, IMAGE_ROUTE)
+        if not original_image_part:
+            return "Error: Could not encode expected output image."
 
         print("Sending request to Azure OpenAI GPT-4o...")
-        response = client.chat.completions.create(
-            model=GPT4O_DEPLOYMENT_NAME,
-            messages=[
-                {
-                    "role": "user",
-                    "content": message_content_list,
-                }
-            ],
-            max_tokens=2000 
-        )
+        with record_latency("map_tool.evaluate"):
+            response = call_with_retries("map_tool.evaluate", routed(VISION_TIER, lambda deployment, timeout: deployment.client().chat.completions.create(
+                model=deployment.name,
+                messages=build_evaluation_messages(prompt, image_part, original_image_part, assignment_max_marks, student_class, assign_que),
+                response_format=JSON_MODE,
+                max_tokens=2000,
+                timeout=timeout,
+            )))
         print("Received response.")
+        record_usage("map_tool.evaluate", response)
         raw_llm_output_string = response.choices[0].message.content
-        print (response.choices[0].message.content)
         print(raw_llm_output_string)
-        processed_evaluation_result = json.loads(re.sub(r"(^```(?:json)?\s*)|(\s*```$)", "", raw_llm_output_string.strip()).strip())
+        processed_evaluation_result = parse_evaluation(raw_llm_output_string, prompt)
         # output_data = {
         #     "result": processed_evaluation_result,
         #     "ocr_text": raw_llm_output_string 
@@ -172,3 +79,84 @@ def ocr_with_azure_gpt4o_image(image_path_or_url,expected_output_path,assignment
     
     except Exception as e:
         return f"An API error occurred: {e}"
+
+@cached_grading("map_tool", prompt_version, image_args=("image_path_or_url", "expected_output_path"), fingerprinters={"expected_output_path": REFERENCE_IMAGES.fingerprint})
+async def aocr_with_azure_gpt4o_image(image_path_or_url,expected_output_path,assignment_max_marks,student_class,assign_que,prompt=None,language=None,):
+    """Async variant of ocr_with_azure_gpt4o_image: awaits the LLM call instead of blocking a worker."""
+
+    if not config.AZURE_READY:
+        return "Error: Azure OpenAI credentials or deployment name not configured. Please check your .env file."
+
+    try:
+        prompt = prompt or PROMPTS.get(EVALUATION_PROMPT, student_class, language)
+        # File reads and base64 encoding are blocking, keep them off the event loop
+        image_part, original_image_part = await asyncio.gather(
+            abuild_image_part(image_path_or_url, IMAGE_ROUTE),
+            asyncio.to_thread(REFERENCE_IMAGES.image_part, expected_output_path, IMAGE_ROUTE),
+        )
+        if not image_part:
+            return "Error: Could not encode local image."
+        if not original_image_part:
+            return "Error: Could not encode expected output image."
+
+        print("Sending request to Azure OpenAI GPT-4o...")
+        with record_latency("map_tool.evaluate"):
+            response = await acall_with_retries("map_tool.evaluate", arouted(VISION_TIER, lambda deployment, timeout: deployment.async_client().chat.completions.create(
+                model=deployment.name,
+                messages=build_evaluation_messages(prompt, image_part, original_image_part, assignment_max_marks, student_class, assign_que),
+                response_format=JSON_MODE,
+                max_tokens=2000,
+                timeout=timeout,
+            )))
+        print("Received response.")
+        record_usage("map_tool.evaluate", response)
+        return parse_evaluation(response.choices[0].message.content, prompt)
+
+    except Exception as e:
+        return f"An API error occurred: {e}"
+
+async def astream_ocr_with_azure_gpt4o_image(image_path_or_url,expected_output_path,assignment_max_marks,student_class,assign_que,prompt=None,language=None,):
+    """Streaming variant of aocr_with_azure_gpt4o_image: yields events for /ocr/diagram/stream.
+
+    There is no transcription step, so the evaluation is streamed as it is
+    generated (see app/utils/stream_utils.py), followed by the same result
+    the non-streaming call returns and shares through the result cache.
+    """
+
+    if not config.AZURE_READY:
+        yield {"event": "error", "error": "Error: Azure OpenAI credentials or deployment name not configured. Please check your .env file."}
+        return
+
+    try:
+        key = await asyncio.to_thread(aocr_with_azure_gpt4o_image.cache_key, image_path_or_url, expected_output_path, assignment_max_marks, student_class, assign_que, prompt=prompt, language=language)
+        cached = await asyncio.to_thread(RESULT_CACHE.get, key)
+        if cached is not None:
+            print("Result cache hit for map_tool.")
+            yield {"event": "result", "result": cached}
+            return
+
+        prompt = prompt or PROMPTS.get(EVALUATION_PROMPT, student_class, language)
+        image_part, original_image_part = await asyncio.gather(
+            abuild_image_part(image_path_or_url, IMAGE_ROUTE),
+            asyncio.to_thread(REFERENCE_IMAGES.image_part, expected_output_path, IMAGE_ROUTE),
+        )
+        if not image_part:
+            yield {"event": "error", "error": "Error: Could not encode local image."}
+            return
+        if not original_image_part:
+            yield {"event": "error", "error": "Error: Could not encode expected output image."}
+            return
+
+        print("Streaming request to Azure OpenAI GPT-4o...")
+        messages = build_evaluation_messages(prompt, image_part, original_image_part, assignment_max_marks, student_class, assign_que)
+        reply = []
+        async for event in astream_evaluation("map_tool.evaluate", VISION_TIER, messages, response_format=JSON_MODE, max_tokens=2000):
+            if event["event"] == "delta":
+                reply.append(event["text"])
+            yield event
+        processed_evaluation_result = parse_evaluation("".join(reply), prompt)
+        await asyncio.to_thread(RESULT_CACHE.set, key, processed_evaluation_result)
+        yield {"event": "result", "result": processed_evaluation_result}
+
+    except Exception as e:
+        yield {"event": "error", "error": f"An API error occurred: {e}"}
@@ -1,34 +1,302 @@
+import queue
 import smtplib
+import threading
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from flask import Flask, request, jsonify
-import os
 
-from dotenv import load_dotenv
-load_dotenv()
-
-app = Flask(__name__)
+from app import config
 
 # Email configuration
-EMAIL_ADDRESS = os.getenv("GOOGLE_APP_EMAIL")
-EMAIL_PASSWORD = os.getenv("GOOGLE_APP_PASSWORD")
+EMAIL_ADDRESS = config.GOOGLE_APP_EMAIL
+EMAIL_PASSWORD = config.GOOGLE_APP_PASSWORD
 
-def send_email(subject, body, to):
+def build_message(subject, body, to):
+    """Builds a plain-text email; `to` is one address or a list of them."""
     msg = MIMEMultipart()
-    msg['From'] = EMAIL_ADDRESS
-    msg['To'] = to
+    msg['From'] = EMAIL_ADDRESS or config.EMAIL_FROM
+    msg['To'] = to if isinstance(to, str) else ", ".join(to)
     msg['Subject'] = subject
 
     msg.attach(MIMEText(body, 'plain'))
-    print("Preparing to send email...")
+    return msg
+
+
+# --- SMTP Sessions ---
+class SMTPSession:
+    """One SMTP connection, kept open between messages and reopened when the server drops it.
+
+    STARTTLS and login happen once per connection instead of once per
+    message. Login is skipped when no password is configured, e.g. against
+    a local test server.
+    """
+
+    def __init__(self, host, port, username=None, password=None, starttls=True, timeout=30):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.connects = 0
+        self._server = None
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                server.starttls()
+            if self.username and self.password:
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+        self._server = server
+        self.connects += 1
+
+    def send(self, message):
+        """Sends one message, reconnecting once if the kept-open connection has gone away."""
+        for attempt in (1, 2):
+            if self._server is None:
+                self._connect()
+            try:
+                self._server.send_message(message)
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError):
+                # Servers close idle or long-lived sessions; only a fresh connection failing is an error
+                self.close()
+                if attempt == 2:
+                    raise
+
+    def close(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            self._server.close()
+        self._server = None
+
+
+# --- Background Dispatcher ---
+class EmailDispatcher:
+    """Sends queued emails from a small pool of threads, each holding its own SMTPSession.
+
+    Callers only enqueue, so /notify answers without waiting on SMTP. The
+    queue is bounded at `max_queue` messages. A bulk submit that does not
+    fit is refused as a whole, so the caller can retry it later without
+    sending duplicates. Sessions idle for `idle_timeout` seconds are closed
+    and reopened on the next message. The threads start with the first
+    submit.
+    """
+
+    def __init__(self, session_factory, workers, max_queue, idle_timeout):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.idle_timeout = idle_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._sessions = []
+        self._stats = {"queued": 0, "sent": 0, "failed": 0, "rejected": 0}
+
+    def _start(self):
+        for index in range(self.workers):
+            session = self.session_factory()
+            self._sessions.append(session)
+            threading.Thread(target=self._run, args=(session,), name=f"email-sender-{index}", daemon=True).start()
+
+    def submit(self, messages):
+        """Queues every message, or none of them if the queue lacks room; returns whether they were queued."""
+        with self._lock:
+            if not self._sessions:
+                self._start()
+            if self._queue.maxsize - self._queue.qsize() < len(messages):
+                self._stats["rejected"] += len(messages)
+                return False
+            for message in messages:
+                self._queue.put_nowait(message)
+            self._stats["queued"] += len(messages)
+        return True
+
+    def _count(self, outcome):
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def _run(self, session):
+        while True:
+            try:
+                message = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                session.close()
+                continue
+            try:
+                session.send(message)
+                self._count("sent")
+                print(f"Email sent to {message['To']}")
+            except Exception as e:
+                self._count("failed")
+                print(f"Error sending email to {message['To']}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """Blocks until every queued email has been sent or has failed."""
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                "pending": self._queue.qsize(),
+                "connects": sum(session.connects for session in self._sessions),
+            }
+
 
-    try:
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.starttls()
-            server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-            server.sendmail(EMAIL_ADDRESS, to, msg.as_string())
-            print("Email sent successfully")
-    except Exception as e:
-        print("Error sending email:", e)
+EMAIL_DISPATCHER = EmailDispatcher(
+    lambda: SMTPSession(config.SMTP_HOST, config.SMTP_PORT, EMAIL_ADDRESS, EMAIL_PASSWORD, config.SMTP_STARTTLS, config.SMTP_TIMEOUT),
+    workers=config.SMTP_POOL_SIZE,
+    max_queue=config.EMAIL_QUEUE_MAX,
+    idle_timeout=config.SMTP_IDLE_TIMEOUT,
+)
+
+
+# --- Digests ---
+class DigestCoalescer:
+    """Holds notifications for `window` seconds and merges those for the same recipient into one email.
+
+    The window starts with the first notification for a recipient, so no
+    email waits longer than `window`. A digest that reaches `max_items` goes
+    out at once. A single notification is sent as it is; two or more become
+    one message built from `subject_template` and `item_template`. Both can
+    use {to} and {count}; the item template also gets each notification's
+    {subject} and {message}. If the send queue is full, the digest is held
+    for another window rather than dropped.
+    """
+
+    def __init__(self, dispatcher, window, max_items, max_pending, subject_template, item_template):
+        self.dispatcher = dispatcher
+        self.window = window
+        self.max_items = max_items
+        self.max_pending = max_pending
+        self.subject_template = subject_template
+        self.item_template = item_template
+        self._pending = {} # recipient key -> {"to", "deadline", "notifications"}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stats = {"notifications": 0, "digests": 0, "messages_merged": 0, "sessions_saved": 0, "deferred": 0}
+
+    @staticmethod
+    def recipient_key(to):
+        addresses = [to] if isinstance(to, str) else to
+        return tuple(sorted(address.strip().lower() for address in addresses))
+
+    def add(self, notifications):
+        """Adds notifications to their recipients' pending digests; returns False, adding none, if too many are held."""
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="email-digest", daemon=True)
+                self._thread.start()
+            if sum(len(group["notifications"]) for group in self._pending.values()) + len(notifications) > self.max_pending:
+                return False
+            now = time.monotonic()
+            for notification in notifications:
+                group = self._pending.setdefault(
+                    self.recipient_key(notification['to']),
+                    {"to": notification['to'], "deadline": now + self.window, "notifications": []},
+                )
+                group["notifications"].append(notification)
+                if len(group["notifications"]) >= self.max_items:
+                    group["deadline"] = now
+            self._stats["notifications"] += len(notifications)
+            self._condition.notify()
+        return True
+
+    def build_digest(self, to, notifications):
+        """Returns the one email sent for a recipient's pending notifications."""
+        if len(notifications) == 1:
+            return build_message(notifications[0]['subject'], notifications[0]['message'], to)
+        fields = {"to": to if isinstance(to, str) else ", ".join(to), "count": len(notifications)}
+        body = "\n\n".join(self.item_template.format(**fields, subject=n['subject'], message=n['message']) for n in notifications)
+        return build_message(self.subject_template.format(**fields), body, to)
+
+    def _flush_due(self):
+        """Sends every digest whose window has closed."""
+        with self._condition:
+            now = time.monotonic()
+            due = [key for key, group in self._pending.items() if group["deadline"] <= now]
+            groups = [self._pending.pop(key) for key in due]
+        for group in groups:
+            notifications = group["notifications"]
+            if not self.dispatcher.submit([self.build_digest(group["to"], notifications)]):
+                with self._condition:
+                    self._stats["deferred"] += 1
+                    held = self._pending.setdefault(self.recipient_key(group["to"]), {**group, "notifications": []})
+                    held["notifications"][:0] = notifications
+                    held["deadline"] = time.monotonic() + self.window
+                continue
+            with self._condition:
+                self._stats["digests"] += 1
+                if len(notifications) > 1:
+                    self._stats["messages_merged"] += len(notifications)
+                    # Each notification used to be its own email and SMTP session
+                    self._stats["sessions_saved"] += len(notifications) - 1
+
+    def _run(self):
+        while True:
+            self._flush_due()
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                # add() notifies, so a digest that fills up early is not left waiting for its deadline
+                wait = min(group["deadline"] for group in self._pending.values()) - time.monotonic()
+                if wait > 0:
+                    self._condition.wait(timeout=wait)
+
+    def stats(self):
+        with self._condition:
+            return {**self._stats, "pending": sum(len(group["notifications"]) for group in self._pending.values())}
+
+
+DIGESTS = DigestCoalescer(
+    EMAIL_DISPATCHER,
+    window=config.NOTIFY_DIGEST_WINDOW,
+    max_items=config.NOTIFY_DIGEST_MAX_ITEMS,
+    max_pending=config.EMAIL_QUEUE_MAX,
+    subject_template=config.NOTIFY_DIGEST_SUBJECT,
+    item_template=config.NOTIFY_DIGEST_ITEM,
+)
+
+
+def validate_notifications(notifications):
+    """Returns an error message for a malformed /notify body, or None."""
+    if not notifications:
+        return "No notifications given"
+    for notification in notifications:
+        missing = [field for field in ("subject", "message", "to") if not notification.get(field)]
+        if missing:
+            return f"Missing fields: {', '.join(missing)}"
+    return None
+
+
+def queue_emails(notifications, digest=True):
+    """Queues /notify entries ({"subject", "message", "to"}) for background sending; returns False if the queue is full.
+
+    With NOTIFY_DIGEST_WINDOW set they are first held and merged per
+    recipient; `digest=False` sends them straight away.
+    """
+    if digest and config.NOTIFY_DIGEST_WINDOW > 0:
+        print(f"Holding {len(notifications)} notification(s) for digest")
+        return DIGESTS.add(notifications)
+    messages = [build_message(n['subject'], n['message'], n['to']) for n in notifications]
+    print(f"Queueing {len(messages)} notification email(s)")
+    return EMAIL_DISPATCHER.submit(messages)
+
+
+def send_email(subject, body, to):
+    """Queues one email for background sending; returns False if the queue is full."""
+    return EMAIL_DISPATCHER.submit([build_message(subject, body, to)])
 
 
+def get_email_stats():
+    """Returns counts of queued, sent, failed and rejected emails, the current backlog, SMTP connections opened and digest merging."""
+    return {**EMAIL_DISPATCHER.stats(), "digest": DIGESTS.stats()}
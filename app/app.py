@@ -0,0 +1,174 @@
+# app/app.py
+# ASGI entry point for the asyncio grading path.
+# Run with: hypercorn app.app:app --bind 0.0.0.0:5000
+# Each /ocr/* request awaits the vision and scoring calls instead of holding a
+# worker thread, so one process can keep many submissions in flight.
+import asyncio
+import json
+
+from quart import Quart, request, jsonify
+
+from app.analysis.batch_grading import grade_batch, validate_batch
+from app import config
+from app.utils.openai_utils import get_latency_stats, get_usage_stats
+from app.utils.parse_utils import get_parse_stats
+from app.utils.prompt_utils import PROMPTS
+from app.utils.rate_limit_utils import get_rate_limit_stats
+from app.utils.resilience_utils import get_resilience_stats
+from app.utils.routing_utils import get_routing_stats
+from app.utils.cache_utils import RESULT_CACHE, OCR_CACHE
+from app.utils.image_utils import get_preprocessing_stats, get_detail_stats, get_hosting_stats
+from app.utils.lazy_utils import lazy_callable
+from app.utils.reference_utils import REFERENCE_IMAGES
+from app.storage.blob_storage import STORAGE, blob_ref, create_upload, get_blob_cache_stats, uploads_enabled, validate_upload, verify_upload_token
+from app.jobs.job_queue import JOB_QUEUE, public_job, validate_job
+from app.jobs.worker import start_workers
+
+
+app = Quart(__name__)
+
+# The grading tools are imported on the first request that needs them, keeping startup fast
+aocr_with_azure_gpt4o_text = lazy_callable("app.analysis.english_tool", "aocr_with_azure_gpt4o_text")
+aocr_with_azure_gpt4o_math = lazy_callable("app.analysis.math_tool", "aocr_with_azure_gpt4o_math")
+aocr_with_azure_gpt4o_image = lazy_callable("app.analysis.map_tool", "aocr_with_azure_gpt4o_image")
+astream_ocr_with_azure_gpt4o_text = lazy_callable("app.analysis.english_tool", "astream_ocr_with_azure_gpt4o_text")
+astream_ocr_with_azure_gpt4o_math = lazy_callable("app.analysis.math_tool", "astream_ocr_with_azure_gpt4o_math")
+astream_ocr_with_azure_gpt4o_image = lazy_callable("app.analysis.map_tool", "astream_ocr_with_azure_gpt4o_image")
+validate_notifications = lazy_callable("app.analysis.sendmail", "validate_notifications")
+queue_emails = lazy_callable("app.analysis.sendmail", "queue_emails")
+get_email_stats = lazy_callable("app.analysis.sendmail", "get_email_stats")
+
+@app.before_serving
+async def startup():
+    # Runs once the server starts, not on import, so tests and tooling can import the app without side effects
+    # Encode the configured teacher reference images before the first submission arrives
+    await asyncio.to_thread(REFERENCE_IMAGES.preload)
+    # Local testing runs job workers in-process; in production set JOB_INPROCESS_WORKERS=0 and run app.jobs.worker
+    start_workers(config.JOB_INPROCESS_WORKERS)
+
+@app.route('/')
+async def index():
+    return "Hello, World!"
+
+@app.route('/ocr/text', methods=['POST'])
+async def ocr_text():
+    path = json.loads( (await request.get_data()).decode('utf-8') )
+    data = await aocr_with_azure_gpt4o_text(path['path'], path['assignment_max_marks'], path['student_class'], path['assign_que'], fused=path.get('fused'), language=path.get('language'))
+    return data
+
+@app.route('/ocr/math', methods=['POST'])
+async def ocr_math():
+    path = json.loads( (await request.get_data()).decode('utf-8') )
+    data = await aocr_with_azure_gpt4o_math(path['path'], path['assignment_max_marks'], path['student_class'], path['assign_que'], fused=path.get('fused'), language=path.get('language'))
+    return data
+
+@app.route('/ocr/diagram', methods=['POST'])
+async def ocr_diagram():
+    path = json.loads( (await request.get_data()).decode('utf-8') )
+    data = await aocr_with_azure_gpt4o_image(path['path'],path['expected_output_path'] ,path['assignment_max_marks'], path['student_class'], path['assign_que'], language=path.get('language'))
+    return data
+
+async def ndjson_events(events):
+    # One JSON object per line, flushed as soon as the grader yields it
+    async for event in events:
+        yield json.dumps(event) + "\n"
+
+@app.route('/ocr/text/stream', methods=['POST'])
+async def ocr_text_stream():
+    # Streams the transcription, then the scoring reply as it is generated, then the full result
+    path = json.loads( (await request.get_data()).decode('utf-8') )
+    events = astream_ocr_with_azure_gpt4o_text(path['path'], path['assignment_max_marks'], path['student_class'], path['assign_que'], language=path.get('language'))
+    return ndjson_events(events), 200, {"Content-Type": "application/x-ndjson"}
+
+@app.route('/ocr/math/stream', methods=['POST'])
+async def ocr_math_stream():
+    path = json.loads( (await request.get_data()).decode('utf-8') )
+    events = astream_ocr_with_azure_gpt4o_math(path['path'], path['assignment_max_marks'], path['student_class'], path['assign_que'], language=path.get('language'))
+    return ndjson_events(events), 200, {"Content-Type": "application/x-ndjson"}
+
+@app.route('/ocr/diagram/stream', methods=['POST'])
+async def ocr_diagram_stream():
+    path = json.loads( (await request.get_data()).decode('utf-8') )
+    events = astream_ocr_with_azure_gpt4o_image(path['path'], path['expected_output_path'], path['assignment_max_marks'], path['student_class'], path['assign_que'], language=path.get('language'))
+    return ndjson_events(events), 200, {"Content-Type": "application/x-ndjson"}
+
+@app.route('/ocr/batch', methods=['POST'])
+async def ocr_batch():
+    # Grades a whole class for one question and streams one NDJSON line per student
+    batch = json.loads( (await request.get_data()).decode('utf-8') )
+    # Once streaming starts the status is already 200, so anything that would fail mid-batch is rejected here
+    error = validate_batch(batch)
+    if error:
+        return jsonify({"error": error}), 400
+
+    async def stream_results():
+        async for item in grade_batch(batch.get('mode', 'text'), batch['paths'], batch['assignment_max_marks'], batch['student_class'], batch['assign_que'], batch.get('concurrency'), batch.get('fused'), batch.get('language')):
+            yield json.dumps(item) + "\n"
+
+    return stream_results(), 200, {"Content-Type": "application/x-ndjson"}
+
+@app.route('/uploads', methods=['POST'])
+async def start_upload():
+    # Hands out a short-lived URL the client PUTs the image to; grade it by passing the returned "blob" as the path
+    body = await request.get_json(silent=True) or {}
+    if not uploads_enabled():
+        return jsonify({"error": "Direct uploads are disabled until SECRET_KEY is set"}), 503
+    error = validate_upload(body)
+    if error:
+        return jsonify({"error": error}), 400
+    return jsonify(create_upload(body['content_type'], request.host_url)), 201
+
+@app.route('/uploads/<token>', methods=['PUT'])
+async def put_upload(token):
+    # Local storage only: streams the body to disk chunk by chunk, standing in for the storage service's own endpoint
+    blob_name = verify_upload_token(token) if STORAGE.name == "local" else None
+    if blob_name is None:
+        return jsonify({"error": "Upload URL is invalid or has expired"}), 403
+    if (request.content_length or 0) > config.UPLOAD_MAX_BYTES:
+        return jsonify({"error": f"Upload is larger than {config.UPLOAD_MAX_BYTES} bytes"}), 413
+    writer = await asyncio.to_thread(STORAGE.writer, blob_name, config.UPLOAD_MAX_BYTES)
+    try:
+        async for chunk in request.body:
+            await asyncio.to_thread(writer.write, chunk)
+    except ValueError as e:
+        await asyncio.to_thread(writer.abort)
+        return jsonify({"error": str(e)}), 413
+    await asyncio.to_thread(writer.commit)
+    return jsonify({"blob": blob_ref(blob_name), "size": writer.size}), 201
+
+@app.route('/jobs', methods=['POST'])
+async def submit_job():
+    # Queues a grading job and answers immediately; poll GET /jobs/<id> or pass a callback_url
+    job = json.loads( (await request.get_data()).decode('utf-8') )
+    kind = job.get('kind', 'text')
+    error = validate_job(kind, job)
+    if error:
+        return jsonify({"error": error}), 400
+    job_id = await asyncio.to_thread(JOB_QUEUE.submit, kind, job, job.get('callback_url'))
+    return jsonify({"id": job_id, "status": "queued"}), 202, {"Location": f"/jobs/{job_id}"}
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+async def get_job(job_id):
+    job = await asyncio.to_thread(JOB_QUEUE.get, job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(public_job(job)), 200
+
+@app.route('/notify', methods=['POST'])
+async def notify():
+    # Queues one email, or a "notifications" list of them; the SMTP pool sends them off the event loop
+    notification = await request.get_json()
+    notifications = notification.get('notifications') or [notification]
+    error = validate_notifications(notifications)
+    if error:
+        return jsonify({"error": error}), 400
+    if not queue_emails(notifications, digest=notification.get('digest', True)):
+        return jsonify({"error": "Email queue is full, retry later"}), 503
+    return jsonify({"message": "Notification queued", "queued": len(notifications)}), 202
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    return jsonify({"latency": get_latency_stats(), "result_cache": RESULT_CACHE.stats(), "ocr_cache": OCR_CACHE.stats(), "image_preprocessing": get_preprocessing_stats(), "vision_detail": get_detail_stats(), "image_hosting": get_hosting_stats(), "reference_images": REFERENCE_IMAGES.stats(), "jobs": JOB_QUEUE.stats(), "rate_limits": get_rate_limit_stats(), "resilience": get_resilience_stats(), "routing": get_routing_stats(), "token_usage": get_usage_stats(), "prompts": PROMPTS.stats(), "structured_output": get_parse_stats(), "email": get_email_stats(), "blob_cache": get_blob_cache_stats()}), 200
+
+if __name__ == "__main__":
+    app.run(debug=True)
@@ -1,4 +1,5 @@
 # app/config.py
+import json
 import os
 from dotenv import load_dotenv
 
@@ -7,7 +8,8 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # --- Flask Configuration ---
-SECRET_KEY = os.getenv('SECRET_KEY', 'a_default_secret_key_if_not_set') # Change in production!
+DEFAULT_SECRET_KEY = 'a_default_secret_key_if_not_set'
+SECRET_KEY = os.getenv('SECRET_KEY', DEFAULT_SECRET_KEY) # Change in production! Local upload URLs stay disabled until it is
 DEBUG = os.getenv('FLASK_DEBUG', 'True').lower() == 'true'
 HOST = os.getenv('HOST', '127.0.0.1')
 PORT = int(os.getenv('PORT', 5000))
@@ -22,16 +24,189 @@ GPT4O_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_GPT4O_DEPLOYMENT_NAME")
 GPT4O_MINI_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_GPT4O_MINI_DEPLOYMENT_NAME") # Add if you use 4o-mini deployment
 O1_MINI_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_O1_MINI_DEPLOYMENT_NAME") # Add if you use o1-mini deployment
 
-# --- Azure Blob Storage Configuration (Placeholder) ---
+# --- Deployment Routing ---
+# Calls are spread over deployments by live latency and error rate, skipping throttled ones (app/utils/routing_utils.py).
+# The text-only scoring step goes to GPT-4o-mini when it is configured, with GPT-4o as the fallback.
+ROUTE_SCORING_TO_MINI = os.getenv("ROUTE_SCORING_TO_MINI", "True").lower() == "true"
+# Extra deployments/regions as a JSON list, e.g.
+# [{"name": "gpt-4o", "endpoint": "https://my-westeurope.openai.azure.com/", "api_key": "...", "tiers": ["vision", "scoring"], "priority": 0}]
+# "tiers" defaults to both; a higher "priority" number is only used when every lower one is throttled.
+AZURE_OPENAI_DEPLOYMENTS = json.loads(os.getenv("AZURE_OPENAI_DEPLOYMENTS", "[]"))
+ROUTER_LATENCY_ALPHA = float(os.getenv("ROUTER_LATENCY_ALPHA", 0.2)) # Weight of the newest call in the latency/error averages
+ROUTER_ERROR_PENALTY = float(os.getenv("ROUTER_ERROR_PENALTY", 4)) # A 100% error rate counts as 5x the latency
+
+# --- Transcription Backends ---
+# Which backend transcribes each route's images (app/ocr/ocr_processor.py): "azure", "ollama" or "fake".
+# Per-route overrides, e.g. "text=ollama,math=azure". Scoring always goes to Azure.
+OCR_BACKEND_DEFAULT = os.getenv("OCR_BACKEND_DEFAULT", "azure")
+OCR_BACKENDS = {
+    route.strip(): backend.strip()
+    for route, backend in (item.split("=", 1) for item in os.getenv("OCR_BACKENDS", "").split(",") if "=" in item)
+}
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+OLLAMA_VISION_MODEL = os.getenv("OLLAMA_VISION_MODEL", "llava")
+
+# --- Azure OpenAI Connection Pool ---
+# Shared by every analysis tool and LangChain llm via app/utils/openai_utils.py
+OPENAI_POOL_MAX_CONNECTIONS = int(os.getenv("OPENAI_POOL_MAX_CONNECTIONS", 20))
+OPENAI_POOL_MAX_KEEPALIVE = int(os.getenv("OPENAI_POOL_MAX_KEEPALIVE", 10))
+OPENAI_ASYNC_POOL_MAX_CONNECTIONS = int(os.getenv("OPENAI_ASYNC_POOL_MAX_CONNECTIONS", 100)) # Used by the asyncio grading path (app/app.py)
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", 60)) # Seconds an idle connection is kept open
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", 10))
+OPENAI_REQUEST_TIMEOUT = float(os.getenv("OPENAI_REQUEST_TIMEOUT", 120)) # Vision calls on large images can be slow
+
+# --- LLM Call Resilience ---
+# Retries, per-attempt timeouts and hedging around every analysis tool LLM call (app/utils/resilience_utils.py).
+# These replace the OpenAI SDK's own retries, which are turned off on the shared clients.
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", 45)) # Seconds before one attempt is abandoned and retried
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", 3))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", 1)) # Full-jitter exponential backoff between attempts
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", 20))
+# Hedging sends a duplicate request when an attempt outlasts the recent p95 latency and takes the first answer.
+# It trades extra tokens for tail latency, so it is off by default.
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "False").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 95))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20)) # Calls seen per label before hedging starts
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", 2)) # Never hedge sooner than this
+LLM_HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", 16)) # Threads for hedged sync calls
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", 200)) # Recent attempts per label the percentile is taken over
+
+# --- Azure OpenAI Rate Limits ---
+# Every deployment call waits for its requests/tokens-per-minute budget (app/utils/rate_limit_utils.py),
+# for at most LLM_ATTEMPT_TIMEOUT; a call that would wait longer fails that attempt as a timeout.
+# Match these to the deployment quotas in Azure OpenAI Studio; 0 means unlimited.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "True").lower() == "true"
+RATE_LIMIT_DEFAULT_RPM = int(os.getenv("RATE_LIMIT_DEFAULT_RPM", 0))
+RATE_LIMIT_DEFAULT_TPM = int(os.getenv("RATE_LIMIT_DEFAULT_TPM", 0))
+# Per-deployment budgets, e.g. "gpt-4o=300:50000,gpt-4o-mini=1000:200000" (rpm:tpm)
+RATE_LIMIT_OVERRIDES = {
+    name.strip(): tuple(int(limit) for limit in limits.split(":", 1))
+    for name, limits in (item.split("=", 1) for item in os.getenv("RATE_LIMIT_OVERRIDES", "").split(",") if "=" in item)
+}
+RATE_LIMIT_MAX_CONCURRENCY = int(os.getenv("RATE_LIMIT_MAX_CONCURRENCY", 0)) # In-flight calls per deployment and process; 0 = unlimited
+RATE_LIMIT_DEFAULT_BACKOFF = float(os.getenv("RATE_LIMIT_DEFAULT_BACKOFF", 10)) # Pause after a 429 without Retry-After
+
+# --- Fused Grading ---
+# Default for /ocr/text and /ocr/math: transcribe and score in one JSON-mode call instead of two.
+# Requests can still opt in or out with "fused": true/false.
+FUSED_GRADING = os.getenv("FUSED_GRADING", "False").lower() == "true"
+
+# --- Batch Grading (/ocr/batch) ---
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", 8)) # Sheets graded in parallel per batch
+BATCH_MAX_SHEETS = int(os.getenv("BATCH_MAX_SHEETS", 200))
+
+# --- Grading Jobs (POST /jobs) ---
+# Queued in SQLite (app/jobs/job_queue.py) and run by `python -m app.jobs.worker` processes
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", ".cache/jobs.sqlite3") # Local disk only: SQLite WAL does not work over network filesystems
+JOB_INPROCESS_WORKERS = int(os.getenv("JOB_INPROCESS_WORKERS", 2)) # Worker threads inside the web process; 0 when workers run separately
+JOB_WORKER_THREADS = int(os.getenv("JOB_WORKER_THREADS", 4)) # Default threads per `python -m app.jobs.worker` process
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1)) # Seconds an idle worker waits before polling again
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", 600)) # A job not finished by then is handed to another worker
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_CALLBACK_TIMEOUT = float(os.getenv("JOB_CALLBACK_TIMEOUT", 10))
+JOB_CALLBACK_SCHEMES = os.getenv("JOB_CALLBACK_SCHEMES", "https").split(",") # URL schemes a callback_url may use
+JOB_CALLBACK_ALLOW_PRIVATE = os.getenv("JOB_CALLBACK_ALLOW_PRIVATE", "False").lower() == "true" # Local testing only: allow loopback/private callback hosts
+
+# --- Result Cache ---
+# Graded results keyed on image SHA-256 + question inputs + prompt version (app/utils/cache_utils.py)
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", ".cache/grading_cache.sqlite3")
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "True").lower() == "true"
+RESULT_CACHE_MEMORY_ENTRIES = int(os.getenv("RESULT_CACHE_MEMORY_ENTRIES", 512))
+RESULT_CACHE_MAX_DISK_BYTES = int(os.getenv("RESULT_CACHE_MAX_DISK_BYTES", 256 * 1024 * 1024))
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", 30 * 24 * 3600)) # One term's worth of re-runs
+# OCR transcriptions keyed on image SHA-256 + OCR prompt, reused when only the question or rubric changes
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "True").lower() == "true"
+OCR_CACHE_MEMORY_ENTRIES = int(os.getenv("OCR_CACHE_MEMORY_ENTRIES", 1024))
+OCR_CACHE_MAX_DISK_BYTES = int(os.getenv("OCR_CACHE_MAX_DISK_BYTES", 128 * 1024 * 1024))
+OCR_CACHE_TTL_SECONDS = int(os.getenv("OCR_CACHE_TTL_SECONDS", 90 * 24 * 3600))
+
+# --- Email (POST /notify) ---
+# Queued and sent in the background over persistent SMTP sessions (app/analysis/sendmail.py).
+# For local testing run `python -m aiosmtpd -n -l localhost:8025` and set SMTP_HOST=localhost, SMTP_PORT=8025, SMTP_STARTTLS=False.
+GOOGLE_APP_EMAIL = os.getenv("GOOGLE_APP_EMAIL")
+GOOGLE_APP_PASSWORD = os.getenv("GOOGLE_APP_PASSWORD") # Gmail app password, not the account password; login is skipped without one
+EMAIL_FROM = os.getenv("EMAIL_FROM", "noreply@localhost") # Sender when GOOGLE_APP_EMAIL is not set
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "True").lower() == "true"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", 30))
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", 2)) # Sender threads, each keeping one SMTP session open
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", 60)) # Close a session unused this long; the next email reconnects
+EMAIL_QUEUE_MAX = int(os.getenv("EMAIL_QUEUE_MAX", 1000)) # Emails waiting to be sent before /notify answers 503
+# Digests: notifications to the same address within the window go out as one email ("digest": false skips this)
+NOTIFY_DIGEST_WINDOW = float(os.getenv("NOTIFY_DIGEST_WINDOW", 0)) # Seconds to hold notifications for merging; 0 sends each one
+NOTIFY_DIGEST_MAX_ITEMS = int(os.getenv("NOTIFY_DIGEST_MAX_ITEMS", 50)) # Send a digest early once it holds this many
+NOTIFY_DIGEST_SUBJECT = os.getenv("NOTIFY_DIGEST_SUBJECT", "{count} new notifications") # Fields: {to}, {count}
+NOTIFY_DIGEST_ITEM = os.getenv("NOTIFY_DIGEST_ITEM", "{subject}\n{message}") # Fields: {to}, {count}, {subject}, {message}
+
+# --- Blob Storage ---
+# Images referenced as "blob://<name>" (app/storage/blob_storage.py). Azure when an account is set, else a local directory.
 AZURE_STORAGE_ACCOUNT_NAME = os.getenv("AZURE_STORAGE_ACCOUNT_NAME")
 AZURE_STORAGE_ACCOUNT_KEY = os.getenv("AZURE_STORAGE_ACCOUNT_KEY")
 AZURE_STORAGE_CONTAINER_NAME = os.getenv("AZURE_STORAGE_CONTAINER_NAME")
+BLOB_STORAGE_BACKEND = os.getenv("BLOB_STORAGE_BACKEND", "azure" if AZURE_STORAGE_ACCOUNT_NAME else "local") # "azure" or "local"
+BLOB_LOCAL_ROOT = os.getenv("BLOB_LOCAL_ROOT", ".cache/blobs") # Container directories for the local backend
+BLOB_CHUNK_SIZE = int(os.getenv("BLOB_CHUNK_SIZE", 4 * 1024 * 1024)) # Block size for chunked uploads and ranged downloads
+BLOB_MAX_CONCURRENCY = int(os.getenv("BLOB_MAX_CONCURRENCY", 4)) # Chunks moved in parallel per blob
+# Read-through cache of fetched blobs, so each image is downloaded once and then read from disk
+BLOB_CACHE_DIR = os.getenv("BLOB_CACHE_DIR", ".cache/blob_cache")
+BLOB_CACHE_MAX_BYTES = int(os.getenv("BLOB_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+BLOB_CACHE_TTL_SECONDS = float(os.getenv("BLOB_CACHE_TTL_SECONDS", 3600)) # After this a cached copy is checked against the blob's etag
+
+# --- Direct Uploads (POST /uploads) ---
+# Clients PUT images straight to storage with a short-lived URL and grade them as "blob://" references
+UPLOAD_URL_TTL_SECONDS = int(os.getenv("UPLOAD_URL_TTL_SECONDS", 900))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 16 * 1024 * 1024)) # Enforced by the local backend's PUT route; Quart's default body limit is the same
+UPLOAD_PREFIX = os.getenv("UPLOAD_PREFIX", "uploads") # Blob name prefix for uploaded images
+UPLOAD_CONTENT_TYPES = os.getenv("UPLOAD_CONTENT_TYPES", "image/jpeg,image/png,image/webp,image/gif").split(",")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 64 * 1024)) # Request body read size when streaming a local upload to disk
+
+# --- Image Preprocessing ---
+# Local images are EXIF-rotated, downscaled and re-encoded before base64 encoding (app/utils/image_utils.py)
+IMAGE_PREPROCESS_ENABLED = os.getenv("IMAGE_PREPROCESS_ENABLED", "True").lower() == "true"
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", 1600)) # Longest side in pixels after thumbnailing
+IMAGE_GRAYSCALE_OCR = os.getenv("IMAGE_GRAYSCALE_OCR", "True").lower() == "true" # Text/math only; diagrams keep colour
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "JPEG") # JPEG or WEBP
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 85))
+IMAGE_ENCODE_WORKERS = int(os.getenv("IMAGE_ENCODE_WORKERS", 4)) # Images preprocessed/base64-encoded at once per process
+
+# --- Hosted Images ---
+# Local images this large are uploaded to blob storage and sent to the model as a SAS URL instead of base64 (Azure storage only)
+IMAGE_URL_MIN_BYTES = int(os.getenv("IMAGE_URL_MIN_BYTES", 1024 * 1024)) # 0 always inlines
+IMAGE_URL_TTL_SECONDS = int(os.getenv("IMAGE_URL_TTL_SECONDS", 3600)) # How long the model can fetch the URL; covers retries and queued jobs
+IMAGE_URL_PREFIX = os.getenv("IMAGE_URL_PREFIX", "vision") # Blob name prefix; give it a lifecycle rule to expire old images
+IMAGE_URL_CHECK_SECONDS = int(os.getenv("IMAGE_URL_CHECK_SECONDS", 3600)) # Re-check a hosted blob still exists after this; keep the lifecycle age well above it plus the URL TTL
+
+# --- Vision Detail Selection ---
+# Per-route detail overrides, e.g. "diagram=high,text=low". Routes without one are chosen from content density.
+VISION_DETAIL_OVERRIDES = {
+    route.strip(): detail.strip()
+    for route, detail in (item.split("=", 1) for item in os.getenv("VISION_DETAIL_OVERRIDES", "").split(",") if "=" in item)
+}
+VISION_DETAIL_LOW_MAX_INK = float(os.getenv("VISION_DETAIL_LOW_MAX_INK", 0.05)) # Below both "low" thresholds -> low
+VISION_DETAIL_LOW_MAX_EDGES = float(os.getenv("VISION_DETAIL_LOW_MAX_EDGES", 0.10))
+VISION_DETAIL_HIGH_MIN_INK = float(os.getenv("VISION_DETAIL_HIGH_MIN_INK", 0.20)) # Above either "high" threshold -> high
+VISION_DETAIL_HIGH_MIN_EDGES = float(os.getenv("VISION_DETAIL_HIGH_MIN_EDGES", 0.25))
+VISION_DETAIL_LOG_PATH = os.getenv("VISION_DETAIL_LOG_PATH") # Optional JSONL log of every decision, for tuning
+
+# --- Prompt Templates ---
+# Grading prompts are files named <subject>.<kind>[.<grade band>][.<language>].txt (app/utils/prompt_utils.py)
+PROMPT_DIR = os.getenv("PROMPT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts"))
+PROMPT_RELOAD_INTERVAL = float(os.getenv("PROMPT_RELOAD_INTERVAL", 5)) # Seconds between checks for edited files; 0 disables reloading
+PROMPT_DEFAULT_LANGUAGE = os.getenv("PROMPT_DEFAULT_LANGUAGE", "en") # Language of the files without a language suffix
 
 # --- Tool Specific Configurations ---
 # For diagram analysis: path to the reference map
 # Consider making this configurable or fetching from storage
 REFERENCE_MAP_PATH = os.getenv("REFERENCE_MAP_PATH", "path/to/your/correct_map.jpg")
 # Ensure this reference map exists or is handled!
+# Teacher reference images are preprocessed and encoded once, then reused for every submission
+# (app/utils/reference_utils.py). Paths listed here are encoded at startup and never evicted.
+REFERENCE_IMAGE_PATHS = [REFERENCE_MAP_PATH] + [
+    path.strip() for path in os.getenv("REFERENCE_IMAGE_PATHS", "").split(",") if path.strip()
+]
+REFERENCE_CACHE_MAX_ENTRIES = int(os.getenv("REFERENCE_CACHE_MAX_ENTRIES", 64)) # One per active assignment
+REFERENCE_CACHE_VALIDATE = os.getenv("REFERENCE_CACHE_VALIDATE", "mtime") # "mtime", or "hash" to survive touched-but-unchanged files
 
 # --- Validation ---
 # Simple check for required Azure keys for the tools
@@ -0,0 +1,214 @@
+import ipaddress
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+from app import config
+
+# Request fields each job kind needs, mirroring the body of the matching /ocr/* route
+JOB_KINDS = {
+    "text": ("path", "assignment_max_marks", "student_class", "assign_que"),
+    "math": ("path", "assignment_max_marks", "student_class", "assign_que"),
+    "diagram": ("path", "expected_output_path", "assignment_max_marks", "student_class", "assign_que"),
+}
+
+
+def validate_job(kind, payload):
+    """Returns an error message for an unusable job submission, or None if it can be queued."""
+    if kind not in JOB_KINDS:
+        return f"Unsupported kind '{kind}'. Use one of: {', '.join(JOB_KINDS)}"
+    missing = [field for field in JOB_KINDS[kind] if field not in payload]
+    if missing:
+        return f"Missing fields for '{kind}' job: {', '.join(missing)}"
+    if payload.get('callback_url') is not None:
+        return callback_url_error(payload['callback_url'])
+    return None
+
+
+# --- Callback URLs ---
+# Azure's host endpoint: a public address, but only reachable from inside Azure VMs
+_BLOCKED_ADDRESSES = {ipaddress.ip_address("168.63.129.16")}
+
+
+def _is_public_address(address):
+    address = ipaddress.ip_address(address)
+    if address.version == 6 and address.ipv4_mapped is not None:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast and address not in _BLOCKED_ADDRESSES
+
+
+def callback_url_error(callback_url, resolve=False):
+    """Returns why a callback URL may not be posted to, or None.
+
+    The worker posts job results from inside our network, so callbacks may
+    only go to public hosts over JOB_CALLBACK_SCHEMES; loopback, private,
+    link-local (cloud metadata) and reserved addresses are refused.
+    Addresses written into the URL are checked at submission; with
+    `resolve` the host name is looked up and every address it resolves to
+    is checked, as the worker does before each delivery.
+    """
+    if not isinstance(callback_url, str):
+        return "'callback_url' must be a string"
+    parsed = urlparse(callback_url)
+    if parsed.scheme not in config.JOB_CALLBACK_SCHEMES:
+        return f"'callback_url' must use one of: {', '.join(config.JOB_CALLBACK_SCHEMES)}"
+    if not parsed.hostname:
+        return "'callback_url' has no host"
+    if config.JOB_CALLBACK_ALLOW_PRIVATE:
+        return None
+    try:
+        addresses = [parsed.hostname] if not resolve else [
+            info[4][0] for info in socket.getaddrinfo(parsed.hostname, parsed.port or 443, proto=socket.IPPROTO_TCP)
+        ]
+    except (socket.gaierror, ValueError) as e:
+        return f"'callback_url' host cannot be resolved: {e}"
+    for address in addresses:
+        try:
+            public = _is_public_address(address)
+        except ValueError:
+            continue # A host name, only checked once resolved
+        if not public:
+            return f"'callback_url' points to a non-public address: {address}"
+    return None
+
+
+# --- SQLite Job Queue ---
+class JobQueue:
+    """Durable grading job queue in a SQLite table, shared by the web tier and any number of worker processes.
+
+    Workers claim a job by taking a lease on it. A job whose worker died is
+    picked up again once the lease runs out, up to max_attempts times. The
+    database runs in WAL mode, whose shared-memory index only works between
+    processes on one host, so all of them must run on the same machine with
+    JOB_DB_PATH on a local disk.
+    """
+
+    def __init__(self, db_path, lease_seconds, max_attempts):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+
+    def _connection(self):
+        # One connection per thread: workers and request handlers claim and update concurrently
+        db = getattr(self._local, "db", None)
+        if db is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL") # Lets the web tier and worker processes on this host share the file
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, callback_url TEXT,"
+                " status TEXT NOT NULL, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0,"
+                " worker TEXT, lease_until REAL, callback_status TEXT,"
+                " created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)")
+            self._local.db = db
+        return db
+
+    def submit(self, kind, payload, callback_url=None):
+        """Queues a job and returns its id."""
+        job_id = uuid.uuid4().hex
+        self._connection().execute(
+            "INSERT INTO jobs (id, kind, payload, callback_url, status, created_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+            (job_id, kind, json.dumps(payload), callback_url, time.time()),
+        )
+        return job_id
+
+    def claim(self, worker_id):
+        """Leases the oldest runnable job to worker_id and returns it, or None if the queue is empty.
+
+        Runnable means queued, or running with an expired lease and attempts left.
+        """
+        db = self._connection()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE") # Only one claimer at a time may pick a row
+        try:
+            # Jobs whose worker died on the last attempt are not retried forever
+            db.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Worker lease expired too many times', finished_at = ?"
+                " WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            row = db.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_until < ?)"
+                " ORDER BY created_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1,"
+                " started_at = ? WHERE id = ?",
+                (worker_id, now + self.lease_seconds, now, row[0]),
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return self.get(row[0])
+
+    def complete(self, job_id, worker_id, result):
+        return self._finish(job_id, worker_id, "succeeded", result=json.dumps(result))
+
+    def fail(self, job_id, worker_id, error):
+        return self._finish(job_id, worker_id, "failed", error=error)
+
+    def _finish(self, job_id, worker_id, status, result=None, error=None):
+        """Stores the outcome if worker_id still holds the job; returns False if another worker has re-claimed it."""
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL"
+            " WHERE id = ? AND worker = ? AND status = 'running'",
+            (status, result, error, time.time(), job_id, worker_id),
+        )
+        return cursor.rowcount == 1
+
+    def set_callback_status(self, job_id, callback_status):
+        self._connection().execute("UPDATE jobs SET callback_status = ? WHERE id = ?", (callback_status, job_id))
+
+    def get(self, job_id):
+        """Returns the job as a dict, or None for an unknown id."""
+        db = self._connection()
+        cursor = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        job = dict(zip([column[0] for column in cursor.description], row))
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def stats(self):
+        counts = dict(self._connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in ("queued", "running", "succeeded", "failed")}
+
+
+JOB_QUEUE = JobQueue(
+    config.JOB_DB_PATH,
+    lease_seconds=config.JOB_LEASE_SECONDS,
+    max_attempts=config.JOB_MAX_ATTEMPTS,
+)
+
+
+def public_job(job):
+    """The fields of a job returned by GET /jobs/<id> and posted to callback URLs."""
+    return {
+        "id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "result": job["result"],
+        "error": job["error"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
@@ -0,0 +1,108 @@
+# app/jobs/worker.py
+# Runs queued grading jobs from the SQLite job queue.
+# Run with: python -m app.jobs.worker [threads]
+# Start as many worker processes as needed on the web tier's host; the web tier only
+# queues jobs and reads their status. The queue is SQLite in WAL mode, which needs
+# every process on one machine: JOB_DB_PATH must not be on a network filesystem.
+import os
+import socket
+import sys
+import threading
+import uuid
+
+import httpx
+
+from app import config
+from app.jobs.job_queue import JOB_QUEUE, callback_url_error, public_job
+from app.utils.lazy_utils import lazy_callable
+
+# Imported on the first job, so the web tier can start in-process workers without loading the tools
+ocr_with_azure_gpt4o_text = lazy_callable("app.analysis.english_tool", "ocr_with_azure_gpt4o_text")
+ocr_with_azure_gpt4o_math = lazy_callable("app.analysis.math_tool", "ocr_with_azure_gpt4o_math")
+ocr_with_azure_gpt4o_image = lazy_callable("app.analysis.map_tool", "ocr_with_azure_gpt4o_image")
+
+# How each job kind calls its grading function, from the stored request payload
+JOB_HANDLERS = {
+    "text": lambda job: ocr_with_azure_gpt4o_text(job['path'], job['assignment_max_marks'], job['student_class'], job['assign_que'], fused=job.get('fused'), language=job.get('language')),
+    "math": lambda job: ocr_with_azure_gpt4o_math(job['path'], job['assignment_max_marks'], job['student_class'], job['assign_que'], fused=job.get('fused'), language=job.get('language')),
+    "diagram": lambda job: ocr_with_azure_gpt4o_image(job['path'], job['expected_output_path'], job['assignment_max_marks'], job['student_class'], job['assign_que'], language=job.get('language')),
+}
+
+
+def deliver_callback(job):
+    """POSTs the finished job to its callback URL, recording the outcome on the job.
+
+    The host is looked up and checked again first, as what it resolves to
+    may have changed after submission. Redirects are not followed.
+    """
+    error = callback_url_error(job["callback_url"], resolve=True)
+    if error:
+        callback_status = f"refused ({error})"
+    else:
+        try:
+            response = httpx.post(job["callback_url"], json=public_job(job), timeout=config.JOB_CALLBACK_TIMEOUT)
+            callback_status = f"delivered ({response.status_code})"
+        except httpx.HTTPError as e:
+            callback_status = f"failed ({e})"
+    print(f"Job {job['id']} callback {callback_status}")
+    JOB_QUEUE.set_callback_status(job["id"], callback_status)
+
+
+def run_job(job):
+    """Grades one claimed job and stores its result or error. The tools report failures as strings."""
+    print(f"Running {job['kind']} job {job['id']} (attempt {job['attempts']})")
+    try:
+        result = JOB_HANDLERS[job["kind"]](job["payload"])
+    except Exception as e:
+        result = f"Job failed: {e}"
+    if isinstance(result, str):
+        finished = JOB_QUEUE.fail(job["id"], job["worker"], result)
+    else:
+        finished = JOB_QUEUE.complete(job["id"], job["worker"], result)
+    if not finished:
+        # Our lease ran out and another worker took the job over; its outcome is the one that counts
+        print(f"Job {job['id']} was re-claimed by another worker, discarding this result")
+        return
+    if job["callback_url"]:
+        deliver_callback(JOB_QUEUE.get(job["id"]))
+
+
+def worker_loop(worker_id, stop_event):
+    """Claims and runs jobs until stop_event is set, polling while the queue is empty."""
+    while not stop_event.is_set():
+        try:
+            job = JOB_QUEUE.claim(worker_id)
+        except Exception as e:
+            print(f"Warning: {worker_id} could not claim a job: {e}")
+            job = None
+        if job is None:
+            stop_event.wait(config.JOB_POLL_INTERVAL)
+            continue
+        run_job(job)
+
+
+def start_workers(count, stop_event=None):
+    """Starts `count` daemon worker threads in this process and returns them."""
+    stop_event = stop_event or threading.Event()
+    prefix = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    threads = []
+    for index in range(count):
+        thread = threading.Thread(
+            target=worker_loop, args=(f"{prefix}-{index}", stop_event), name=f"job-worker-{index}", daemon=True
+        )
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else config.JOB_WORKER_THREADS
+    stop_event = threading.Event()
+    threads = start_workers(count, stop_event)
+    print(f"Started {count} job worker threads on {config.JOB_DB_PATH}")
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        # Jobs in flight are picked up again by another worker once their lease expires
+        stop_event.set()
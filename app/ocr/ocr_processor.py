@@ -0,0 +1,233 @@
+import asyncio
+import base64
+import os
+
+import httpx
+
+from app import config
+from app.storage.blob_storage import resolve_image
+from app.utils.cache_utils import OCR_CACHE, image_fingerprint, transcription_cache_key
+from app.utils.image_utils import abuild_image_part, build_image_part, preprocess_image
+from app.utils.openai_utils import record_latency, record_usage
+from app.utils.resilience_utils import acall_with_retries, call_with_retries
+from app.utils.routing_utils import VISION_TIER, arouted, routed
+
+
+def build_ocr_messages(prompt, image_part):
+    """Builds the transcription request sent to the Azure vision model."""
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                image_part,
+            ],
+        }
+    ]
+
+
+# --- Transcription Backends ---
+class AzureVisionBackend:
+    """Transcribes with the GPT-4o vision deployments, through the deployment router."""
+
+    name = "azure"
+
+    @property
+    def model_id(self):
+        # Same id the OCR cache used before backends existed, so stored transcriptions stay valid
+        return config.GPT4O_DEPLOYMENT_NAME
+
+    def transcribe(self, image_path_or_url, prompt, route, label):
+        """Returns the transcription, or None if a local image could not be encoded."""
+        image_part = build_image_part(image_path_or_url, route)
+        if not image_part:
+            return None
+        print("Sending request to Azure OpenAI GPT-4o...")
+        with record_latency(label):
+            response = call_with_retries(label, routed(VISION_TIER, lambda deployment, timeout: deployment.client().chat.completions.create(
+                model=deployment.name,
+                messages=build_ocr_messages(prompt, image_part),
+                max_tokens=2000,  # Adjust as needed based on expected text length
+                timeout=timeout,
+            )))
+        print("Received response.")
+        record_usage(label, response)
+        return response.choices[0].message.content
+
+    async def atranscribe(self, image_path_or_url, prompt, route, label):
+        """Async variant of transcribe."""
+        image_part = await abuild_image_part(image_path_or_url, route)
+        if not image_part:
+            return None
+        print("Sending request to Azure OpenAI GPT-4o...")
+        with record_latency(label):
+            response = await acall_with_retries(label, arouted(VISION_TIER, lambda deployment, timeout: deployment.async_client().chat.completions.create(
+                model=deployment.name,
+                messages=build_ocr_messages(prompt, image_part),
+                max_tokens=2000,
+                timeout=timeout,
+            )))
+        print("Received response.")
+        record_usage(label, response)
+        return response.choices[0].message.content
+
+
+class OllamaBackend:
+    """Transcribes with a local LLaVA-style model served by Ollama, as in trial_file/ollamafile.py.
+
+    The `ollama` package is only needed when this backend is selected.
+    """
+
+    name = "ollama"
+
+    def __init__(self, host, model):
+        self.host = host
+        self.model = model
+        self._client = None
+        self._async_client = None
+
+    @property
+    def model_id(self):
+        return f"ollama:{self.model}"
+
+    def _image_bytes(self, image_path_or_url, route):
+        """Reads the image as bytes, preprocessed like the Azure path; None if a local file cannot be read."""
+        image_path_or_url = resolve_image(image_path_or_url)
+        if image_path_or_url.startswith("http://") or image_path_or_url.startswith("https://"):
+            # Ollama cannot fetch URLs itself
+            response = httpx.get(image_path_or_url, timeout=config.OPENAI_CONNECT_TIMEOUT, follow_redirects=True)
+            response.raise_for_status()
+            return response.content
+        if not os.path.exists(image_path_or_url):
+            print(f"Error: Image file not found at {image_path_or_url}")
+            return None
+        if config.IMAGE_PREPROCESS_ENABLED:
+            try:
+                image_bytes, _, _ = preprocess_image(image_path_or_url, grayscale=route != "diagram" and config.IMAGE_GRAYSCALE_OCR)
+                return image_bytes
+            except Exception as e:
+                print(f"Warning: Could not preprocess image ({e}). Sending original bytes.")
+        with open(image_path_or_url, "rb") as image_file:
+            return image_file.read()
+
+    def _messages(self, prompt, image_bytes):
+        return [{"role": "user", "content": prompt, "images": [base64.b64encode(image_bytes).decode("ascii")]}]
+
+    def _get_client(self):
+        if self._client is None:
+            import ollama
+            self._client = ollama.Client(host=self.host, timeout=config.LLM_ATTEMPT_TIMEOUT)
+        return self._client
+
+    def _get_async_client(self):
+        if self._async_client is None:
+            import ollama
+            self._async_client = ollama.AsyncClient(host=self.host, timeout=config.LLM_ATTEMPT_TIMEOUT)
+        return self._async_client
+
+    def transcribe(self, image_path_or_url, prompt, route, label):
+        image_bytes = self._image_bytes(image_path_or_url, route)
+        if image_bytes is None:
+            return None
+        client = self._get_client()
+        print(f"Sending request to Ollama model '{self.model}'...")
+        with record_latency(label):
+            response = call_with_retries(label, lambda timeout: client.chat(model=self.model, messages=self._messages(prompt, image_bytes)))
+        print("Received response.")
+        return response["message"]["content"]
+
+    async def atranscribe(self, image_path_or_url, prompt, route, label):
+        image_bytes = await asyncio.to_thread(self._image_bytes, image_path_or_url, route)
+        if image_bytes is None:
+            return None
+        client = self._get_async_client()
+        print(f"Sending request to Ollama model '{self.model}'...")
+        with record_latency(label):
+            response = await acall_with_retries(label, lambda timeout: client.chat(model=self.model, messages=self._messages(prompt, image_bytes)))
+        print("Received response.")
+        return response["message"]["content"]
+
+
+class FakeBackend:
+    """In-process backend with deterministic output and no network, for tests and offline runs.
+
+    `transcriptions` maps an image path or SHA-256 to its text; any other
+    image gets a placeholder naming its hash. Every call is recorded in
+    `calls`.
+    """
+
+    name = "fake"
+    model_id = "fake"
+
+    def __init__(self, transcriptions=None):
+        self.transcriptions = transcriptions or {}
+        self.calls = []
+
+    def transcribe(self, image_path_or_url, prompt, route, label):
+        self.calls.append((image_path_or_url, prompt, route))
+        image_path_or_url = resolve_image(image_path_or_url)
+        if image_path_or_url in self.transcriptions:
+            return self.transcriptions[image_path_or_url]
+        if not (image_path_or_url.startswith("http://") or image_path_or_url.startswith("https://")) and not os.path.exists(image_path_or_url):
+            print(f"Error: Image file not found at {image_path_or_url}")
+            return None
+        fingerprint = image_fingerprint(image_path_or_url)
+        return self.transcriptions.get(fingerprint, f"[fake transcription of image {fingerprint[:12]}]")
+
+    async def atranscribe(self, image_path_or_url, prompt, route, label):
+        return self.transcribe(image_path_or_url, prompt, route, label)
+
+
+BACKENDS = {
+    "azure": AzureVisionBackend(),
+    "ollama": OllamaBackend(config.OLLAMA_HOST, config.OLLAMA_VISION_MODEL),
+    "fake": FakeBackend(),
+}
+
+
+def register_backend(backend):
+    """Adds or replaces a backend by its name, e.g. a FakeBackend with canned transcriptions in a test."""
+    BACKENDS[backend.name] = backend
+
+
+def get_backend(route):
+    """Returns the transcription backend for a route ("text" or "math") per OCR_BACKENDS, else OCR_BACKEND_DEFAULT."""
+    return BACKENDS[config.OCR_BACKENDS.get(route, config.OCR_BACKEND_DEFAULT)]
+
+
+# --- Cached Transcription ---
+def transcription_key(route, image_path_or_url, prompt):
+    """OCR_CACHE key for the route's current backend; a transcription by one backend is not reused for another."""
+    return transcription_cache_key(image_path_or_url, prompt, get_backend(route).model_id)
+
+
+def transcribe_image(image_path_or_url, prompt, route, label):
+    """Transcribes an image with the route's backend, reusing a stored transcription of the same image and prompt.
+
+    Returns None if a local image could not be read.
+    """
+    ocr_key = transcription_key(route, image_path_or_url, prompt)
+    cached_transcription = OCR_CACHE.get(ocr_key)
+    if cached_transcription is not None:
+        print("Reusing cached OCR transcription.")
+        return cached_transcription
+
+    transcription = get_backend(route).transcribe(image_path_or_url, prompt, route, label)
+    if transcription is not None:
+        OCR_CACHE.set(ocr_key, transcription)
+    return transcription
+
+
+async def atranscribe_image(image_path_or_url, prompt, route, label):
+    """Async variant of transcribe_image."""
+    # Hashing and the SQLite cache are blocking, keep them off the event loop
+    ocr_key = await asyncio.to_thread(transcription_key, route, image_path_or_url, prompt)
+    cached_transcription = await asyncio.to_thread(OCR_CACHE.get, ocr_key)
+    if cached_transcription is not None:
+        print("Reusing cached OCR transcription.")
+        return cached_transcription
+
+    transcription = await get_backend(route).atranscribe(image_path_or_url, prompt, route, label)
+    if transcription is not None:
+        await asyncio.to_thread(OCR_CACHE.set, ocr_key, transcription)
+    return transcription
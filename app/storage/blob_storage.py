@@ -0,0 +1,532 @@
+import base64
+import hashlib
+import hmac
+import json
+import mimetypes
+import os
+import posixpath
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from app import config
+
+# Images stored through this module are passed to the tools as "blob://<name>"
+BLOB_SCHEME = "blob://"
+
+
+def is_blob_ref(image_path_or_url):
+    return image_path_or_url.startswith(BLOB_SCHEME)
+
+
+def blob_ref(name):
+    return f"{BLOB_SCHEME}{name}"
+
+
+# --- Storage Backends ---
+class BlobWriter:
+    """Writes an upload to a local blob chunk by chunk, so no request body is held in memory whole.
+
+    Nothing is visible under the blob's name until commit(). write() raises
+    ValueError once more than `max_bytes` have arrived.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.size = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._partial = f"{path}.{uuid.uuid4().hex}.part"
+        self._file = open(self._partial, "wb")
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise ValueError(f"Upload is larger than {self.max_bytes} bytes")
+        self._file.write(chunk)
+
+    def commit(self):
+        self._file.close()
+        os.replace(self._partial, self.path)
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._partial):
+            os.remove(self._partial)
+
+
+class LocalBlobStorage:
+    """Blob storage on the local disk, one directory per container, for development and tests.
+
+    Same methods as AzureBlobStorage. Files are written to a temporary name
+    and renamed, so a reader never sees half an upload.
+    """
+
+    name = "local"
+
+    def __init__(self, root, container):
+        self.root = root
+        self.container = container
+        self.directory = os.path.join(root, container)
+
+    def _path(self, blob_name):
+        path = os.path.abspath(os.path.join(self.directory, blob_name))
+        if not path.startswith(os.path.abspath(self.directory) + os.sep):
+            raise ValueError(f"Blob name escapes the container: {blob_name}")
+        return path
+
+    def upload(self, blob_name, data, content_type=None):
+        """Stores a file path or bytes under blob_name; returns its properties."""
+        path = self._path(blob_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{uuid.uuid4().hex}.part"
+        if isinstance(data, (bytes, bytearray)):
+            with open(partial, "wb") as blob_file:
+                blob_file.write(data)
+        else:
+            shutil.copyfile(data, partial)
+        os.replace(partial, path)
+        return self.properties(blob_name)
+
+    def download(self, blob_name, destination):
+        """Copies the blob to a local file; returns its properties."""
+        shutil.copyfile(self._path(blob_name), destination)
+        return self.properties(blob_name)
+
+    def read_range(self, blob_name, offset, length):
+        with open(self._path(blob_name), "rb") as blob_file:
+            blob_file.seek(offset)
+            return blob_file.read(length)
+
+    def properties(self, blob_name):
+        """Returns {"size", "etag", "content_type"}; raises FileNotFoundError for a missing blob."""
+        stat = os.stat(self._path(blob_name))
+        return {
+            "size": stat.st_size,
+            "etag": f"{stat.st_mtime_ns:x}-{stat.st_size:x}",
+            "content_type": mimetypes.guess_type(blob_name)[0],
+        }
+
+    def url(self, blob_name):
+        return f"file://{self._path(blob_name)}"
+
+    def writer(self, blob_name, max_bytes):
+        """Returns a BlobWriter for streaming an upload into blob_name."""
+        return BlobWriter(self._path(blob_name), max_bytes)
+
+    def upload_url(self, blob_name, expires_at, content_type, base_url):
+        """A signed PUT /uploads/<token> URL on this app, standing in for a storage SAS URL."""
+        return {
+            "url": f"{base_url.rstrip('/')}/uploads/{sign_upload_token(blob_name, expires_at)}",
+            "method": "PUT",
+            "headers": {"Content-Type": content_type},
+        }
+
+    def read_url(self, blob_name, expires_at):
+        """None: the model cannot fetch from this machine's disk, so local images are always inlined."""
+        return None
+
+    def blob_name_for_url(self, url):
+        """The blob name for a URL into this container, or None; local blobs have no public URLs."""
+        return None
+
+
+class AzureBlobStorage:
+    """Blob storage in an Azure Storage container.
+
+    Uploads and downloads larger than one chunk are split into `chunk_size`
+    blocks or ranges and moved `max_concurrency` at a time by the SDK. The
+    `azure-storage-blob` package is only needed when this backend is
+    configured.
+    """
+
+    name = "azure"
+
+    def __init__(self, account_name, account_key, container, chunk_size, max_concurrency):
+        self.account_url = f"https://{account_name}.blob.core.windows.net"
+        self.account_name = account_name
+        self.account_key = account_key
+        self.container = container
+        self.chunk_size = chunk_size
+        self.max_concurrency = max_concurrency
+        self._container_client = None
+        self._lock = threading.Lock()
+
+    def _client(self):
+        if self._container_client is None:
+            with self._lock:
+                if self._container_client is None:
+                    from azure.storage.blob import BlobServiceClient
+                    service = BlobServiceClient(
+                        account_url=self.account_url,
+                        credential=self.account_key,
+                        max_single_put_size=self.chunk_size,
+                        max_block_size=self.chunk_size,
+                        max_single_get_size=self.chunk_size,
+                        max_chunk_get_size=self.chunk_size,
+                    )
+                    self._container_client = service.get_container_client(self.container)
+        return self._container_client
+
+    def upload(self, blob_name, data, content_type=None):
+        from azure.storage.blob import ContentSettings
+        content_settings = ContentSettings(content_type=content_type or mimetypes.guess_type(blob_name)[0])
+        if isinstance(data, (bytes, bytearray)):
+            self._client().upload_blob(blob_name, data, overwrite=True, content_settings=content_settings, max_concurrency=self.max_concurrency)
+        else:
+            with open(data, "rb") as source:
+                self._client().upload_blob(
+                    blob_name, source, length=os.path.getsize(data), overwrite=True,
+                    content_settings=content_settings, max_concurrency=self.max_concurrency,
+                )
+        return self.properties(blob_name)
+
+    def download(self, blob_name, destination):
+        try:
+            downloader = self._client().download_blob(blob_name, max_concurrency=self.max_concurrency)
+        except Exception as e:
+            if type(e).__name__ == "ResourceNotFoundError":
+                raise FileNotFoundError(blob_name) from e
+            raise
+        with open(destination, "wb") as target:
+            downloader.readinto(target)
+        return {
+            "size": downloader.properties.size,
+            "etag": downloader.properties.etag,
+            "content_type": downloader.properties.content_settings.content_type,
+        }
+
+    def read_range(self, blob_name, offset, length):
+        return self._client().download_blob(blob_name, offset=offset, length=length, max_concurrency=self.max_concurrency).readall()
+
+    def properties(self, blob_name):
+        try:
+            properties = self._client().get_blob_client(blob_name).get_blob_properties()
+        except Exception as e:
+            if type(e).__name__ == "ResourceNotFoundError":
+                raise FileNotFoundError(blob_name) from e
+            raise
+        return {"size": properties.size, "etag": properties.etag, "content_type": properties.content_settings.content_type}
+
+    def url(self, blob_name):
+        return f"{self.account_url}/{self.container}/{blob_name}"
+
+    def upload_url(self, blob_name, expires_at, content_type, base_url):
+        """A SAS URL that lets the client create this one blob until expires_at, without going through the app."""
+        from azure.storage.blob import BlobSasPermissions, generate_blob_sas
+        sas = generate_blob_sas(
+            self.account_name,
+            self.container,
+            blob_name,
+            account_key=self.account_key,
+            permission=BlobSasPermissions(create=True, write=True),
+            expiry=datetime.fromtimestamp(expires_at, timezone.utc),
+        )
+        return {
+            "url": f"{self.url(blob_name)}?{sas}",
+            "method": "PUT",
+            "headers": {"Content-Type": content_type, "x-ms-blob-type": "BlockBlob"},
+        }
+
+    def read_url(self, blob_name, expires_at):
+        """A SAS URL that lets anyone holding it read this one blob until expires_at."""
+        from azure.storage.blob import BlobSasPermissions, generate_blob_sas
+        sas = generate_blob_sas(
+            self.account_name,
+            self.container,
+            blob_name,
+            account_key=self.account_key,
+            permission=BlobSasPermissions(read=True),
+            expiry=datetime.fromtimestamp(expires_at, timezone.utc),
+        )
+        return f"{self.url(blob_name)}?{sas}"
+
+    def blob_name_for_url(self, url):
+        """The blob name for a URL into this container (any SAS query dropped), or None."""
+        prefix = f"{self.account_url}/{self.container}/"
+        if not url.startswith(prefix):
+            return None
+        return url[len(prefix):].split("?", 1)[0]
+
+
+def build_storage():
+    """Azure Blob Storage when an account is configured, otherwise the local-disk stand-in."""
+    if config.BLOB_STORAGE_BACKEND == "azure":
+        return AzureBlobStorage(
+            config.AZURE_STORAGE_ACCOUNT_NAME,
+            config.AZURE_STORAGE_ACCOUNT_KEY,
+            config.AZURE_STORAGE_CONTAINER_NAME,
+            config.BLOB_CHUNK_SIZE,
+            config.BLOB_MAX_CONCURRENCY,
+        )
+    return LocalBlobStorage(config.BLOB_LOCAL_ROOT, config.AZURE_STORAGE_CONTAINER_NAME or "uploads")
+
+
+STORAGE = build_storage()
+
+
+# --- Direct Uploads ---
+def uploads_enabled():
+    """Whether POST /uploads can hand out URLs.
+
+    Local upload URLs are signed with SECRET_KEY, so they are refused while
+    it is unset or the public default; anyone could forge them otherwise.
+    """
+    return STORAGE.name != "local" or config.SECRET_KEY not in ("", config.DEFAULT_SECRET_KEY)
+
+
+def is_upload_name(blob_name):
+    """Whether a blob name lies under UPLOAD_PREFIX, so an upload URL can never overwrite other blobs."""
+    return (
+        isinstance(blob_name, str)
+        and posixpath.normpath(blob_name) == blob_name
+        and blob_name.startswith(f"{config.UPLOAD_PREFIX}/")
+    )
+
+
+def sign_upload_token(blob_name, expires_at):
+    """Token naming the blob a local upload URL may write and until when, signed with SECRET_KEY."""
+    payload = base64.urlsafe_b64encode(json.dumps([blob_name, int(expires_at)]).encode("utf-8")).decode("ascii").rstrip("=")
+    signature = hmac.new(config.SECRET_KEY.encode("utf-8"), payload.encode("ascii"), hashlib.sha256).hexdigest()
+    return f"{payload}.{signature}"
+
+
+def verify_upload_token(token):
+    """Returns the blob name a token allows writing, or None if it is forged, malformed, expired or outside UPLOAD_PREFIX."""
+    if not uploads_enabled():
+        return None
+    payload, _, signature = token.partition(".")
+    expected = hmac.new(config.SECRET_KEY.encode("utf-8"), payload.encode("ascii", "ignore"), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(signature, expected):
+        return None
+    try:
+        blob_name, expires_at = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except (TypeError, ValueError):
+        return None
+    if not is_upload_name(blob_name) or not isinstance(expires_at, int) or time.time() >= expires_at:
+        return None
+    return blob_name
+
+
+def validate_upload(body):
+    """Returns an error message for a malformed POST /uploads body, or None."""
+    if body.get('content_type') not in config.UPLOAD_CONTENT_TYPES:
+        return f"'content_type' must be one of: {', '.join(config.UPLOAD_CONTENT_TYPES)}"
+    return None
+
+
+def create_upload(content_type, base_url):
+    """Starts an upload session: a new blob name and a short-lived URL the client PUTs the image to.
+
+    The image goes straight to storage (or, for local storage, is streamed
+    to disk by PUT /uploads/<token>). The client then grades it by passing
+    the returned "blob" reference as the image path.
+    """
+    blob_name = f"{config.UPLOAD_PREFIX}/{uuid.uuid4().hex}{mimetypes.guess_extension(content_type) or ''}"
+    expires_at = time.time() + config.UPLOAD_URL_TTL_SECONDS
+    return {
+        "blob": blob_ref(blob_name),
+        "upload": STORAGE.upload_url(blob_name, expires_at, content_type, base_url),
+        "expires_at": int(expires_at),
+        "max_bytes": config.UPLOAD_MAX_BYTES,
+    }
+
+
+# --- Read-Through Cache ---
+class BlobCache:
+    """Local copies of recently used blobs, so each image is fetched from storage once.
+
+    `resolve` turns a "blob://" reference, or a URL into the configured
+    container, into the path of a local copy. The tools then read,
+    preprocess and hash it like any uploaded file, instead of the model
+    fetching a public URL itself. A copy older than `ttl_seconds` is checked
+    against the blob's etag before reuse and fetched again only if the blob
+    changed. The least recently used copies are deleted past `max_bytes`.
+    Concurrent requests for the same blob share one download.
+    """
+
+    def __init__(self, storage, directory, max_bytes, ttl_seconds):
+        self.storage = storage
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = None # blob name -> {"path", "size", "etag", "checked_at"}, oldest use first
+        self._lock = threading.Lock()
+        self._blob_locks = {}
+        self._stats = {"hits": 0, "misses": 0, "revalidations": 0, "evictions": 0, "bytes_downloaded": 0}
+
+    def _local_path(self, blob_name):
+        digest = hashlib.sha256(blob_name.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + os.path.splitext(blob_name)[1].lower())
+
+    def _load_index(self):
+        """Picks up copies left by an earlier process from their .json sidecars."""
+        entries = OrderedDict()
+        found = []
+        for dirpath, _, file_names in os.walk(self.directory):
+            for file_name in file_names:
+                if not file_name.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(dirpath, file_name), encoding="utf-8") as sidecar:
+                        entry = json.load(sidecar)
+                    if os.path.exists(entry["path"]):
+                        found.append((os.path.getmtime(entry["path"]), entry))
+                except (OSError, ValueError, KeyError):
+                    continue
+        for _, entry in sorted(found, key=lambda item: item[0]):
+            entry["checked_at"] = 0.0 # Revalidate once in this process
+            entries[entry["name"]] = entry
+        return entries
+
+    def blob_name(self, image_path_or_url):
+        """The blob an image reference points to, or None for a local path or an outside URL."""
+        if is_blob_ref(image_path_or_url):
+            return image_path_or_url[len(BLOB_SCHEME):]
+        if image_path_or_url.startswith("https://"):
+            return self.storage.blob_name_for_url(image_path_or_url)
+        return None
+
+    def resolve(self, image_path_or_url):
+        """Returns a local path for a blob reference, downloading it if needed; other inputs are returned unchanged."""
+        blob_name = self.blob_name(image_path_or_url)
+        if blob_name is None:
+            return image_path_or_url
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load_index()
+            blob_lock = self._blob_locks.setdefault(blob_name, threading.Lock())
+        with blob_lock:
+            return self._fetch(blob_name)
+
+    def _fetch(self, blob_name):
+        with self._lock:
+            entry = self._entries.get(blob_name)
+            if entry is not None:
+                self._entries.move_to_end(blob_name)
+        if entry is not None and os.path.exists(entry["path"]):
+            if time.monotonic() - entry["checked_at"] < self.ttl_seconds:
+                self._count("hits")
+                return entry["path"]
+            self._count("revalidations")
+            if self.storage.properties(blob_name)["etag"] == entry["etag"]:
+                entry["checked_at"] = time.monotonic()
+                self._count("hits")
+                return entry["path"]
+
+        self._count("misses")
+        path = self._local_path(blob_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{uuid.uuid4().hex}.part"
+        try:
+            properties = self.storage.download(blob_name, partial)
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        entry = {"name": blob_name, "path": path, "size": properties["size"], "etag": properties["etag"]}
+        with open(f"{path}.json", "w", encoding="utf-8") as sidecar:
+            json.dump(entry, sidecar)
+        entry["checked_at"] = time.monotonic()
+        print(f"Fetched blob {blob_name} ({properties['size']} bytes) into the local cache")
+        with self._lock:
+            self._stats["bytes_downloaded"] += properties["size"]
+            self._entries[blob_name] = entry
+            self._entries.move_to_end(blob_name)
+            self._evict(keep=blob_name)
+        return path
+
+    def _evict(self, keep):
+        # Called with self._lock held
+        total = sum(entry["size"] for entry in self._entries.values())
+        for blob_name in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            if blob_name == keep:
+                continue
+            entry = self._entries.pop(blob_name)
+            total -= entry["size"]
+            self._stats["evictions"] += 1
+            for path in (entry["path"], f"{entry['path']}.json"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _count(self, outcome):
+        with self._lock:
+            self._stats[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            entries = self._entries or {}
+            return {
+                **self._stats,
+                "backend": self.storage.name,
+                "entries": len(entries),
+                "bytes": sum(entry["size"] for entry in entries.values()),
+            }
+
+
+BLOB_CACHE = BlobCache(STORAGE, config.BLOB_CACHE_DIR, config.BLOB_CACHE_MAX_BYTES, config.BLOB_CACHE_TTL_SECONDS)
+
+
+def resolve_image(image_path_or_url):
+    """Local path for a "blob://" reference or a URL into our container; anything else is returned as is.
+
+    Raises FileNotFoundError for a missing blob and ValueError for a name
+    outside the container.
+    """
+    return BLOB_CACHE.resolve(image_path_or_url)
+
+
+def get_blob_cache_stats():
+    return BLOB_CACHE.stats()
+
+
+# --- Hosted Images ---
+_hosted_lock = threading.Lock()
+_hosted_names = OrderedDict() # Blob name -> when it was last seen in storage, most recent last
+HOSTED_NAMES_MAX = 4096
+
+
+def can_host_images():
+    """Whether the storage backend gives out URLs the vision model can fetch."""
+    return STORAGE.name != "local"
+
+
+def host_image(data, content_type):
+    """Stores an image (bytes or a file path) once and returns (time-limited read URL, upload seconds).
+
+    The blob is named after a hash of its content, so the same image is
+    uploaded once however often it is graded; upload seconds is None when
+    it was already stored. The URL stays valid for IMAGE_URL_TTL_SECONDS.
+    A blob seen more than IMAGE_URL_CHECK_SECONDS ago is looked up again,
+    since a lifecycle rule may have deleted it since.
+    """
+    if isinstance(data, (bytes, bytearray)):
+        digest = hashlib.sha256(data).hexdigest()
+    else:
+        with open(data, "rb") as image_file:
+            digest = hashlib.file_digest(image_file, "sha256").hexdigest()
+    blob_name = f"{config.IMAGE_URL_PREFIX}/{digest}{mimetypes.guess_extension(content_type) or ''}"
+
+    upload_seconds = None
+    with _hosted_lock:
+        seen_at = _hosted_names.get(blob_name)
+    if seen_at is None or time.monotonic() - seen_at > config.IMAGE_URL_CHECK_SECONDS:
+        try:
+            STORAGE.properties(blob_name)
+        except FileNotFoundError:
+            start = time.perf_counter()
+            STORAGE.upload(blob_name, data, content_type)
+            upload_seconds = time.perf_counter() - start
+        with _hosted_lock:
+            _hosted_names[blob_name] = time.monotonic()
+            _hosted_names.move_to_end(blob_name)
+            while len(_hosted_names) > HOSTED_NAMES_MAX:
+                _hosted_names.popitem(last=False)
+    return STORAGE.read_url(blob_name, time.time() + config.IMAGE_URL_TTL_SECONDS), upload_seconds
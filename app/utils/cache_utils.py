@@ -0,0 +1,282 @@
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from app import config
+from app.storage.blob_storage import resolve_image
+
+
+# --- Cache Keys ---
+def image_fingerprint(image_path_or_url):
+    """SHA-256 of a local image's bytes; remote URLs are fingerprinted by the URL itself.
+
+    Blob references are fingerprinted by the bytes of their cached local copy.
+    """
+    try:
+        image_path_or_url = resolve_image(image_path_or_url)
+    except (OSError, ValueError):
+        # A missing or invalid blob; the grader reports it, so key on the reference
+        return hashlib.sha256(image_path_or_url.encode("utf-8")).hexdigest()
+    if image_path_or_url.startswith("http://") or image_path_or_url.startswith("https://"):
+        return hashlib.sha256(image_path_or_url.encode("utf-8")).hexdigest()
+    digest = hashlib.sha256()
+    try:
+        with open(image_path_or_url, "rb") as image_file:
+            for chunk in iter(lambda: image_file.read(1024 * 1024), b""):
+                digest.update(chunk)
+    except OSError:
+        # Let the grader report the missing file; key on the path instead
+        return hashlib.sha256(image_path_or_url.encode("utf-8")).hexdigest()
+    return digest.hexdigest()
+
+
+def template_version(template_text):
+    """Short content hash of a prompt template, so editing a prompt invalidates its cached results."""
+    return hashlib.sha256(template_text.encode("utf-8")).hexdigest()[:12]
+
+
+def make_cache_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+# --- Two-Tier Cache ---
+class ResultCache:
+    """In-memory LRU in front of a SQLite table, with TTL and size-based eviction.
+
+    Values must be JSON-serialisable; every get returns a fresh copy. Several
+    namespaces can share one SQLite file.
+    """
+
+    def __init__(self, namespace, db_path, memory_max_entries, max_disk_bytes, ttl_seconds, enabled=True):
+        self.namespace = namespace
+        self.enabled = enabled
+        self.db_path = db_path
+        self.memory_max_entries = memory_max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "sets": 0, "expired": 0, "evictions": 0}
+
+    def _connection(self):
+        if self._db is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL") # Lets several worker processes share the file
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL, accessed_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries (namespace, accessed_at)")
+            db.commit()
+            self._db = db
+        return self._db
+
+    def _remember(self, key, expires_at, payload):
+        self._memory[key] = (expires_at, payload)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Returns the cached value, or None on a miss, an expired entry or a disabled cache."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, payload = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return json.loads(payload)
+                del self._memory[key]
+                self._stats["expired"] += 1
+
+            try:
+                db = self._connection()
+                row = db.execute(
+                    "SELECT value, expires_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                    (self.namespace, key),
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    db.execute(
+                        "UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                        (now, self.namespace, key),
+                    )
+                    db.commit()
+                    self._remember(key, row[1], row[0])
+                    self._stats["disk_hits"] += 1
+                    return json.loads(row[0])
+                if row is not None:
+                    db.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+                    db.commit()
+                    self._stats["expired"] += 1
+            except sqlite3.Error as e:
+                print(f"Warning: {self.namespace} cache read failed: {e}")
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        payload = json.dumps(value)
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            self._remember(key, expires_at, payload)
+            self._stats["sets"] += 1
+            try:
+                db = self._connection()
+                db.execute(
+                    "INSERT OR REPLACE INTO cache_entries (namespace, key, value, size, expires_at, accessed_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.namespace, key, payload, len(payload), expires_at, now),
+                )
+                self._evict_disk(db, now)
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"Warning: {self.namespace} cache write failed: {e}")
+
+    def _evict_disk(self, db, now):
+        """Drops expired rows, then least recently used rows until the namespace fits max_disk_bytes."""
+        db.execute("DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?", (self.namespace, now))
+        total = db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cache_entries WHERE namespace = ?", (self.namespace,)
+        ).fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+        # Evict down to 90% so we are not evicting on every write
+        target = self.max_disk_bytes * 0.9
+        rows = db.execute(
+            "SELECT key, size FROM cache_entries WHERE namespace = ? ORDER BY accessed_at ASC", (self.namespace,)
+        ).fetchall()
+        for key, size in rows:
+            if total <= target:
+                break
+            db.execute("DELETE FROM cache_entries WHERE namespace = ? AND key = ?", (self.namespace, key))
+            self._memory.pop(key, None)
+            total -= size
+            self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            db = self._connection()
+            db.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+            db.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
+
+
+RESULT_CACHE = ResultCache(
+    "grading_results",
+    config.CACHE_DB_PATH,
+    memory_max_entries=config.RESULT_CACHE_MEMORY_ENTRIES,
+    max_disk_bytes=config.RESULT_CACHE_MAX_DISK_BYTES,
+    ttl_seconds=config.RESULT_CACHE_TTL_SECONDS,
+    enabled=config.RESULT_CACHE_ENABLED,
+)
+
+# Vision transcriptions, so re-grading with a new question or rubric only re-runs the text scoring step
+OCR_CACHE = ResultCache(
+    "ocr_transcriptions",
+    config.CACHE_DB_PATH,
+    memory_max_entries=config.OCR_CACHE_MEMORY_ENTRIES,
+    max_disk_bytes=config.OCR_CACHE_MAX_DISK_BYTES,
+    ttl_seconds=config.OCR_CACHE_TTL_SECONDS,
+    enabled=config.OCR_CACHE_ENABLED,
+)
+
+
+def transcription_cache_key(image_path_or_url, ocr_prompt, deployment_name):
+    """OCR_CACHE key: the image bytes, the transcription prompt and the vision deployment."""
+    return make_cache_key("ocr", image_fingerprint(image_path_or_url), ocr_prompt, deployment_name)
+
+
+# --- Grading Function Decorator ---
+def cached_grading(tool_name, prompt_version, image_args=("image_path_or_url",), cache=RESULT_CACHE, fingerprinters=None, normalizers=None):
+    """Serves a grading function's result from `cache` when the same images are graded with the same inputs.
+
+    The key covers the SHA-256 of every image argument, all other arguments
+    (question, class, max marks, prompt) and the prompt-template version.
+    `prompt_version` may be a function of the call's arguments, for tools
+    whose prompt depends on the student's grade band or language.
+    `fingerprinters` maps an image argument to a function used instead of
+    image_fingerprint, e.g. one that remembers the hash of a reference image.
+    `normalizers` maps other arguments to a function applied before keying,
+    so equivalent values (e.g. fused=None meaning "the default") share a key.
+    Error strings returned by the tools are never cached. Works on both the
+    sync and async tool entry points; the resulting function also exposes
+    `cache_key(...)` so callers can look a result up without grading.
+    """
+    fingerprinters = fingerprinters or {}
+    normalizers = normalizers or {}
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def cache_key(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            parts = {
+                name: fingerprinters.get(name, image_fingerprint)(value) if name in image_args else str(normalizers.get(name, str)(value))
+                for name, value in bound.arguments.items()
+            }
+            version = prompt_version(bound.arguments) if callable(prompt_version) else prompt_version
+            return make_cache_key(tool_name, version, parts)
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                if not cache.enabled:
+                    return await func(*args, **kwargs)
+                # Hashing reads the whole image and the cache is SQLite, keep both off the event loop
+                key = await asyncio.to_thread(cache_key, *args, **kwargs)
+                cached = await asyncio.to_thread(cache.get, key)
+                if cached is not None:
+                    print(f"Result cache hit for {tool_name}.")
+                    return cached
+                result = await func(*args, **kwargs)
+                if not isinstance(result, str):
+                    await asyncio.to_thread(cache.set, key, result)
+                return result
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not cache.enabled:
+                    return func(*args, **kwargs)
+                key = cache_key(*args, **kwargs)
+                cached = cache.get(key)
+                if cached is not None:
+                    print(f"Result cache hit for {tool_name}.")
+                    return cached
+                result = func(*args, **kwargs)
+                if not isinstance(result, str):
+                    cache.set(key, result)
+                return result
+
+        wrapper.cache_key = cache_key
+        return wrapper
+
+    return decorator
@@ -0,0 +1,390 @@
+import asyncio
+import binascii
+import json
+import math
+import mmap
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image, ImageFilter, ImageOps
+
+from app import config
+from app.storage.blob_storage import can_host_images, host_image, resolve_image
+
+# EXIF tag holding the camera orientation of phone photos
+EXIF_ORIENTATION_TAG = 0x0112
+
+OUTPUT_MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+# Input bytes base64-encoded per step; a multiple of 3 so no chunk but the last needs padding
+ENCODE_CHUNK_BYTES = 3 * 16 * 1024
+
+
+# --- Helper Functions ---
+def _base64_into(buffer, offset, data):
+    """Base64-encodes `data` chunk by chunk straight into `buffer` at `offset`; returns the end offset."""
+    with memoryview(data) as view:
+        for start in range(0, len(view), ENCODE_CHUNK_BYTES):
+            encoded = binascii.b2a_base64(view[start:start + ENCODE_CHUNK_BYTES], newline=False)
+            buffer[offset:offset + len(encoded)] = encoded
+            offset += len(encoded)
+    return offset
+
+def bytes_to_data_url(data, mime_type):
+    """Builds a base64 "data:" URL from a bytes-like object (bytes, bytearray, mmap).
+
+    The URL is written into one preallocated buffer of its exact final size,
+    instead of holding a base64 bytes copy, a decoded str and the f-string
+    at the same time.
+    """
+    header = f"data:{mime_type};base64,".encode("ascii")
+    buffer = bytearray(len(header) + 4 * math.ceil(len(data) / 3))
+    buffer[:len(header)] = header
+    _base64_into(buffer, len(header), data)
+    return buffer.decode("ascii")
+
+def encode_image_to_data_url(image_path, mime_type=None):
+    """Encodes a local image file to a base64 "data:" URL, streaming from a memory-mapped file.
+
+    The file is never copied onto the Python heap; only the URL itself is
+    allocated. Returns None if the file cannot be read.
+    """
+    mime_type = mime_type or get_image_mime_type(image_path)
+    try:
+        with open(image_path, "rb") as image_file:
+            if os.fstat(image_file.fileno()).st_size == 0:
+                # mmap cannot map an empty file, and there is nothing to grade anyway
+                print(f"Error: Image file is empty at {image_path}")
+                return None
+            with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return bytes_to_data_url(mapped, mime_type)
+    except FileNotFoundError:
+        print(f"Error: Image file not found at {image_path}")
+        return None
+    except Exception as e:
+        print(f"Error encoding image: {e}")
+        return None
+
+def get_image_mime_type(image_path):
+    """Determines the MIME type of an image based on its extension."""
+    ext = os.path.splitext(image_path)[1].lower()
+    if ext == ".png":
+        return "image/png"
+    elif ext in [".jpg", ".jpeg"]:
+        return "image/jpeg"
+    elif ext == ".gif":
+        return "image/gif"
+    elif ext == ".webp":
+        return "image/webp"
+    else:
+        # Default or raise an error if you want to be strict
+        print(f"Warning: Unknown image type for extension {ext}. Defaulting to image/jpeg.")
+        print("Supported formats typically include PNG, JPEG, GIF, WEBP.")
+        return "image/jpeg"
+
+def estimate_image_tokens(width, height, detail="high"):
+    """Estimates GPT-4o vision input tokens for an image using the published tiling rules."""
+    if detail == "low":
+        return 85
+    # Fit within 2048x2048, then scale so the shortest side is at most 768, then count 512px tiles
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+# --- Vision Detail Selection ---
+_detail_lock = threading.Lock()
+_detail_decisions = {}
+
+def measure_content_density(img):
+    """Returns (ink_coverage, edge_density) of an image, measured on a small contrast-stretched grayscale copy.
+
+    Ink coverage is the share of dark pixels; edge density is the share of
+    pixels on a strong edge. A short answer on a clean page scores low on
+    both, a full page of working or a detailed diagram scores high.
+    """
+    sample = img.convert("L")
+    sample.thumbnail((256, 256))
+    sample = ImageOps.autocontrast(sample, cutoff=2)
+    pixel_count = sample.width * sample.height
+    ink_coverage = sum(sample.histogram()[:100]) / pixel_count
+    edge_density = sum(sample.filter(ImageFilter.FIND_EDGES).histogram()[48:]) / pixel_count
+    return ink_coverage, edge_density
+
+def choose_detail(dimensions, ink_coverage, edge_density):
+    """Picks "low", "high" or "auto" vision detail from image size and content density."""
+    if max(dimensions) <= 512:
+        # Low detail already sees the whole image at full resolution
+        return "low"
+    if ink_coverage < config.VISION_DETAIL_LOW_MAX_INK and edge_density < config.VISION_DETAIL_LOW_MAX_EDGES:
+        return "low"
+    if ink_coverage > config.VISION_DETAIL_HIGH_MIN_INK or edge_density > config.VISION_DETAIL_HIGH_MIN_EDGES:
+        return "high"
+    return "auto"
+
+def _log_detail_decision(route, label, decision):
+    """Counts detail decisions per route and appends them to VISION_DETAIL_LOG_PATH for tuning the thresholds."""
+    with _detail_lock:
+        route_counts = _detail_decisions.setdefault(route, {})
+        route_counts[decision["detail"]] = route_counts.get(decision["detail"], 0) + 1
+        if config.VISION_DETAIL_LOG_PATH:
+            try:
+                with open(config.VISION_DETAIL_LOG_PATH, "a", encoding="utf-8") as log_file:
+                    log_file.write(json.dumps({"route": route, "label": label, **decision}) + "\n")
+            except OSError as e:
+                print(f"Warning: Could not write detail decision log: {e}")
+    print(f"Vision detail for {route} {label}: {decision['detail']} ({decision['reason']})")
+
+def get_detail_stats():
+    """Returns how often each detail level was chosen, per route."""
+    with _detail_lock:
+        return {route: dict(counts) for route, counts in _detail_decisions.items()}
+
+
+# --- Preprocessing ---
+def _flatten_transparency(img):
+    """Composites a transparent image onto white, as it would appear on the page.
+
+    Converting straight to RGB or L drops alpha and leaves whatever colour
+    the transparent pixels hold, usually black, so a transparent-background
+    diagram would come out as a black JPEG.
+    """
+    if img.mode == "P" and "transparency" in img.info:
+        img = img.convert("RGBA")
+    if img.mode not in ("RGBA", "LA", "PA"):
+        return img
+    background = Image.new("RGBA", img.size, (255, 255, 255, 255))
+    background.alpha_composite(img.convert("RGBA"))
+    return background.convert("RGB")
+
+_stats_lock = threading.Lock()
+_preprocess_stats = {"images": 0, "bytes_in": 0, "bytes_out": 0, "tokens_in": 0, "tokens_out": 0}
+
+def preprocess_image(image_path, max_edge=None, grayscale=False, output_format=None, quality=None):
+    """Loads a local image, applies its EXIF rotation, downscales and re-encodes it.
+
+    Adapted from preprocess_image in trial_file/imageanalysis.py. Returns
+    (image_bytes, mime_type, report) where report lists bytes, estimated
+    vision tokens before and after, and the content density of the result.
+    If re-encoding would not shrink an image that needed no rotation or
+    resize, the original bytes are kept.
+    """
+    max_edge = max_edge or config.IMAGE_MAX_EDGE
+    output_format = (output_format or config.IMAGE_OUTPUT_FORMAT).upper()
+    quality = quality or config.IMAGE_QUALITY
+
+    # Pillow decodes straight from the file, so the upload is not also held as a bytes copy
+    original_size = os.path.getsize(image_path)
+    with Image.open(image_path) as img:
+        original_dimensions = img.size
+        rotated = img.getexif().get(EXIF_ORIENTATION_TAG, 1) != 1
+        img = ImageOps.exif_transpose(img)
+        resized = max(img.size) > max_edge
+        img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS) # Resize maintaining aspect ratio
+        img = _flatten_transparency(img).convert("L" if grayscale else "RGB")
+
+    buffered = BytesIO()
+    img.save(buffered, format=output_format, quality=quality, optimize=True)
+    processed_bytes = buffered.getvalue()
+    mime_type = OUTPUT_MIME_TYPES.get(output_format, "image/jpeg")
+    processed_dimensions = img.size
+    ink_coverage, edge_density = measure_content_density(img)
+
+    if len(processed_bytes) >= original_size and not (rotated or resized):
+        with open(image_path, "rb") as image_file:
+            processed_bytes = image_file.read()
+        mime_type = get_image_mime_type(image_path)
+        processed_dimensions = original_dimensions
+
+    report = {
+        "original_bytes": original_size,
+        "processed_bytes": len(processed_bytes),
+        "bytes_saved": original_size - len(processed_bytes),
+        "original_dimensions": original_dimensions,
+        "processed_dimensions": processed_dimensions,
+        "tokens_before": estimate_image_tokens(*original_dimensions),
+        "tokens_after": estimate_image_tokens(*processed_dimensions),
+        "ink_coverage": ink_coverage,
+        "edge_density": edge_density,
+    }
+    report["tokens_saved"] = report["tokens_before"] - report["tokens_after"]
+    return processed_bytes, mime_type, report
+
+def _record_preprocessing(report):
+    with _stats_lock:
+        _preprocess_stats["images"] += 1
+        _preprocess_stats["bytes_in"] += report["original_bytes"]
+        _preprocess_stats["bytes_out"] += report["processed_bytes"]
+        _preprocess_stats["tokens_in"] += report["tokens_before"]
+        _preprocess_stats["tokens_out"] += report["tokens_after"]
+
+def get_preprocessing_stats():
+    """Returns totals of images preprocessed, bytes and estimated vision tokens before/after."""
+    with _stats_lock:
+        stats = dict(_preprocess_stats)
+    stats["bytes_saved"] = stats["bytes_in"] - stats["bytes_out"]
+    stats["tokens_saved"] = stats["tokens_in"] - stats["tokens_out"]
+    return stats
+
+# --- Inline vs Hosted Images ---
+_hosting_lock = threading.Lock()
+_hosting_stats = {
+    "inlined": 0, "inlined_request_bytes": 0,
+    "hosted": 0, "hosted_request_bytes": 0, "hosted_inline_bytes": 0, "uploads": 0, "upload_seconds": 0.0,
+}
+
+def _record_hosting(**counts):
+    with _hosting_lock:
+        for key, value in counts.items():
+            _hosting_stats[key] += value
+
+def _image_url(data, mime_type, label):
+    """The URL a local image (bytes or a file path) is sent to the model as.
+
+    Images of at least IMAGE_URL_MIN_BYTES are uploaded to blob storage and
+    sent as a time-limited URL, when the storage backend has URLs the model
+    can fetch; smaller ones, and any whose upload fails, are inlined as a
+    base64 data URL. Returns None if the file cannot be read.
+    """
+    size = len(data) if isinstance(data, (bytes, bytearray)) else os.path.getsize(data)
+    if config.IMAGE_URL_MIN_BYTES and size >= config.IMAGE_URL_MIN_BYTES and can_host_images():
+        try:
+            url, upload_seconds = host_image(data, mime_type)
+            _record_hosting(
+                hosted=1,
+                hosted_request_bytes=len(url),
+                # What the same image would have added to the request body inlined
+                hosted_inline_bytes=len(f"data:{mime_type};base64,") + 4 * math.ceil(size / 3),
+                uploads=upload_seconds is not None,
+                upload_seconds=upload_seconds or 0.0,
+            )
+            print(f"Sending {label} as a storage URL instead of {size} inline bytes" + (f" (uploaded in {upload_seconds:.2f}s)" if upload_seconds is not None else ""))
+            return url
+        except Exception as e:
+            print(f"Warning: Could not host {label} in blob storage ({e}). Inlining it.")
+
+    data_url = bytes_to_data_url(data, mime_type) if isinstance(data, (bytes, bytearray)) else encode_image_to_data_url(data, mime_type)
+    if data_url:
+        _record_hosting(inlined=1, inlined_request_bytes=len(data_url))
+    return data_url
+
+def get_hosting_stats():
+    """Returns how many images were inlined or sent as storage URLs, the request bytes each way, and upload time."""
+    with _hosting_lock:
+        stats = dict(_hosting_stats)
+    stats["request_bytes_saved"] = stats["hosted_inline_bytes"] - stats["hosted_request_bytes"]
+    stats["mean_upload_seconds"] = stats["upload_seconds"] / stats["uploads"] if stats["uploads"] else 0.0
+    return stats
+
+def _encode_local_image(image_path, purpose, label):
+    """Returns (image URL or None, report) for a local image; report is None if preprocessing was skipped."""
+    if config.IMAGE_PREPROCESS_ENABLED:
+        try:
+            grayscale = purpose == "ocr" and config.IMAGE_GRAYSCALE_OCR
+            image_bytes, mime_type, report = preprocess_image(image_path, grayscale=grayscale)
+            _record_preprocessing(report)
+            print(
+                f"Preprocessed {label}: {report['original_bytes']} -> {report['processed_bytes']} bytes "
+                f"(saved {report['bytes_saved']}), ~{report['tokens_before']} -> {report['tokens_after']} vision tokens "
+                f"(saved {report['tokens_saved']})"
+            )
+            return _image_url(image_bytes, mime_type, label), report
+        except FileNotFoundError:
+            print(f"Error: Image file not found at {image_path}")
+            return None, None
+        except Exception as e:
+            # Unreadable by Pillow: fall back to sending the file untouched
+            print(f"Warning: Could not preprocess {label} ({e}). Sending original bytes.")
+
+    try:
+        return _image_url(image_path, get_image_mime_type(image_path), label), None
+    except FileNotFoundError:
+        print(f"Error: Image file not found at {image_path}")
+        return None, None
+
+def _measure_local_image(image_path, report, label):
+    """Returns (dimensions, ink_coverage, edge_density) for choosing detail, or None if Pillow cannot read the image."""
+    if report is not None:
+        return report["processed_dimensions"], report["ink_coverage"], report["edge_density"]
+    try:
+        with Image.open(image_path) as img:
+            dimensions = img.size
+            img.draft("L", (256, 256)) # Cheap reduced-size JPEG decode
+            return (dimensions, *measure_content_density(img))
+    except Exception as e:
+        # e.g. HEIC: the original bytes are sent as they are and the model picks the detail
+        print(f"Warning: Could not measure {label} ({e}). Using auto detail.")
+        return None
+
+def build_image_part(image_path_or_url, route, label="image"):
+    """Builds the chat "image_url" content part for a route ("text", "math" or "diagram").
+
+    The detail level comes from VISION_DETAIL_OVERRIDES for the route if set,
+    otherwise from the image's size and content density; remote URLs that
+    cannot be inspected get "auto". Blob references are read from the local
+    blob cache. Large local images may be sent as a storage URL rather than
+    inline (see _image_url). Returns None if a local image cannot be read.
+    """
+    purpose = "diagram" if route == "diagram" else "ocr"
+    override = config.VISION_DETAIL_OVERRIDES.get(route)
+    image_path_or_url = resolve_image(image_path_or_url)
+
+    if image_path_or_url.startswith("http://") or image_path_or_url.startswith("https://"):
+        print(f"Using {label} URL: {image_path_or_url}")
+        image_data_url = image_path_or_url
+        decision = {"detail": override or "auto", "reason": "route override" if override else "remote image"}
+    else:
+        print(f"Using {label} from local path: {image_path_or_url}")
+        image_data_url, report = _encode_local_image(image_path_or_url, purpose, label)
+        if not image_data_url:
+            return None
+        measured = None if override else _measure_local_image(image_path_or_url, report, label)
+        if override:
+            decision = {"detail": override, "reason": "route override"}
+        elif measured is None:
+            decision = {"detail": "auto", "reason": "unreadable image"}
+        else:
+            dimensions, ink_coverage, edge_density = measured
+            decision = {
+                "detail": choose_detail(dimensions, ink_coverage, edge_density),
+                "reason": "content density",
+                "dimensions": list(dimensions),
+                "ink_coverage": round(ink_coverage, 4),
+                "edge_density": round(edge_density, 4),
+            }
+
+    _log_detail_decision(route, label, decision)
+    return {
+        "type": "image_url",
+        "image_url": {
+            "url": image_data_url,
+            "detail": decision["detail"],
+        },
+    }
+
+
+# --- Encoding Off The Request Thread ---
+# A small dedicated pool bounds how many images are decoded and encoded at once,
+# so a large batch cannot hold every sheet's data URL in memory at the same time.
+_encode_executor_lock = threading.Lock()
+_encode_executor = None
+
+def get_encode_executor():
+    """Returns the process-wide thread pool used for image preprocessing and base64 encoding."""
+    global _encode_executor
+    if _encode_executor is None:
+        with _encode_executor_lock:
+            if _encode_executor is None:
+                _encode_executor = ThreadPoolExecutor(
+                    max_workers=config.IMAGE_ENCODE_WORKERS, thread_name_prefix="image-encode"
+                )
+    return _encode_executor
+
+async def abuild_image_part(image_path_or_url, route, label="image"):
+    """Async variant of build_image_part: encodes on the encode pool instead of the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_encode_executor(), build_image_part, image_path_or_url, route, label)
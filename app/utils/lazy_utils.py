@@ -0,0 +1,42 @@
+import importlib
+import threading
+
+
+class LazyCallable:
+    """Stands in for a function in a module that is only imported on first use.
+
+    Calling it, or reading an attribute such as a grader's `cache_key`,
+    imports the module and forwards to the real function. The app can then
+    register routes and job handlers at startup without paying for the
+    analysis tools and their dependencies until a request needs them.
+    """
+
+    def __init__(self, module_name, attribute):
+        self.module_name = module_name
+        self.attribute = attribute
+        self._target = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        """Imports the module if needed and returns the real function."""
+        if self._target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = getattr(importlib.import_module(self.module_name), self.attribute)
+        return self._target
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        # Only reached for attributes not set in __init__, e.g. cache_key
+        return getattr(self.resolve(), name)
+
+    def __repr__(self):
+        state = "loaded" if self._target is not None else "not loaded"
+        return f"<LazyCallable {self.module_name}.{self.attribute} ({state})>"
+
+
+def lazy_callable(module_name, attribute):
+    """Returns a LazyCallable for `module_name.attribute`."""
+    return LazyCallable(module_name, attribute)
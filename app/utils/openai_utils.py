@@ -0,0 +1,223 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+
+from app import config
+from app.utils.rate_limit_utils import RATE_GOVERNOR, GovernedTransport, AsyncGovernedTransport
+
+# --- Shared Clients ---
+# One AzureOpenAI client per endpoint and one httpx connection pool per process, so grading
+# requests reuse keep-alive connections instead of paying a TLS handshake each time.
+# The openai and langchain_openai packages take over a second to import, so they are only
+# imported when the first client is built, not when the app starts.
+_client_lock = threading.Lock()
+_http_client = None
+_async_http_client = None
+_openai_clients = {}
+_async_openai_clients = {}
+_chat_llms = {}
+
+
+def _build_http_client():
+    """Creates the pooled httpx client shared by the OpenAI SDK and LangChain."""
+    transport = httpx.HTTPTransport(
+        limits=httpx.Limits(
+            max_connections=config.OPENAI_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=config.OPENAI_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=config.OPENAI_KEEPALIVE_EXPIRY,
+        ),
+    )
+    if config.RATE_LIMIT_ENABLED:
+        transport = GovernedTransport(transport, RATE_GOVERNOR)
+    return httpx.Client(
+        transport=transport,
+        timeout=httpx.Timeout(config.OPENAI_REQUEST_TIMEOUT, connect=config.OPENAI_CONNECT_TIMEOUT),
+    )
+
+
+def _build_async_http_client():
+    """Creates the pooled httpx client used by the asyncio grading path."""
+    transport = httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(
+            max_connections=config.OPENAI_ASYNC_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=config.OPENAI_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=config.OPENAI_KEEPALIVE_EXPIRY,
+        ),
+    )
+    if config.RATE_LIMIT_ENABLED:
+        transport = AsyncGovernedTransport(transport, RATE_GOVERNOR)
+    return httpx.AsyncClient(
+        transport=transport,
+        timeout=httpx.Timeout(config.OPENAI_REQUEST_TIMEOUT, connect=config.OPENAI_CONNECT_TIMEOUT),
+    )
+
+
+def get_http_client():
+    """Returns the process-wide pooled httpx client."""
+    global _http_client
+    if _http_client is None:
+        with _client_lock:
+            if _http_client is None:
+                _http_client = _build_http_client()
+    return _http_client
+
+
+def get_async_http_client():
+    """Returns the process-wide pooled httpx.AsyncClient."""
+    global _async_http_client
+    if _async_http_client is None:
+        with _client_lock:
+            if _async_http_client is None:
+                _async_http_client = _build_async_http_client()
+    return _async_http_client
+
+
+def get_openai_client(endpoint=None, api_key=None):
+    """Returns the process-wide AzureOpenAI client for an endpoint (AZURE_OPENAI_ENDPOINT by default)."""
+    endpoint = endpoint or config.AZURE_OPENAI_ENDPOINT
+    client = _openai_clients.get(endpoint)
+    if client is None:
+        http_client = get_http_client()
+        with _client_lock:
+            client = _openai_clients.get(endpoint)
+            if client is None:
+                from openai import AzureOpenAI
+                client = AzureOpenAI(
+                    api_key=api_key or config.AZURE_OPENAI_API_KEY,
+                    api_version=config.AZURE_OPENAI_API_VERSION,
+                    azure_endpoint=endpoint,
+                    http_client=http_client,
+                    max_retries=0, # Retried by app/utils/resilience_utils.py
+                )
+                _openai_clients[endpoint] = client
+    return client
+
+
+def get_async_openai_client(endpoint=None, api_key=None):
+    """Returns the process-wide AsyncAzureOpenAI client for an endpoint (AZURE_OPENAI_ENDPOINT by default)."""
+    endpoint = endpoint or config.AZURE_OPENAI_ENDPOINT
+    client = _async_openai_clients.get(endpoint)
+    if client is None:
+        http_client = get_async_http_client()
+        with _client_lock:
+            client = _async_openai_clients.get(endpoint)
+            if client is None:
+                from openai import AsyncAzureOpenAI
+                client = AsyncAzureOpenAI(
+                    api_key=api_key or config.AZURE_OPENAI_API_KEY,
+                    api_version=config.AZURE_OPENAI_API_VERSION,
+                    azure_endpoint=endpoint,
+                    http_client=http_client,
+                    max_retries=0, # Retried by app/utils/resilience_utils.py
+                )
+                _async_openai_clients[endpoint] = client
+    return client
+
+
+def get_chat_llm(deployment_name=None, endpoint=None, api_key=None):
+    """Returns a shared AzureChatOpenAI for a deployment (GPT-4o by default) on the pooled HTTP clients.
+
+    The same object serves both llm.invoke and llm.ainvoke.
+    """
+    deployment_name = deployment_name or config.GPT4O_DEPLOYMENT_NAME
+    endpoint = endpoint or config.AZURE_OPENAI_ENDPOINT
+    llm = _chat_llms.get((deployment_name, endpoint))
+    if llm is None:
+        http_client = get_http_client()
+        http_async_client = get_async_http_client()
+        with _client_lock:
+            llm = _chat_llms.get((deployment_name, endpoint))
+            if llm is None:
+                from langchain_openai import AzureChatOpenAI
+                llm = AzureChatOpenAI(
+                    model=deployment_name,
+                    api_version=config.AZURE_OPENAI_API_VERSION,
+                    azure_endpoint=endpoint,
+                    api_key=api_key or config.AZURE_OPENAI_API_KEY,
+                    http_client=http_client,
+                    http_async_client=http_async_client,
+                    max_retries=0, # Retried by app/utils/resilience_utils.py
+                )
+                _chat_llms[(deployment_name, endpoint)] = llm
+    return llm
+
+
+# --- Latency Tracking ---
+_latency_lock = threading.Lock()
+_latency_stats = {}
+
+
+def _record_latency(label, elapsed):
+    with _latency_lock:
+        stats = _latency_stats.setdefault(label, {"count": 0, "total_s": 0.0, "max_s": 0.0, "last_s": 0.0})
+        stats["count"] += 1
+        stats["total_s"] += elapsed
+        stats["max_s"] = max(stats["max_s"], elapsed)
+        stats["last_s"] = elapsed
+
+
+@contextmanager
+def record_latency(label):
+    """Times the wrapped LLM call and adds it to the per-label latency stats."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _record_latency(label, elapsed)
+        print(f"[latency] {label}: {elapsed:.2f}s")
+
+
+def get_latency_stats():
+    """Returns a snapshot of per-label call counts and average/max/last latency in seconds."""
+    with _latency_lock:
+        return {
+            label: {**stats, "avg_s": stats["total_s"] / stats["count"] if stats["count"] else 0.0}
+            for label, stats in _latency_stats.items()
+        }
+
+
+# --- Token Usage ---
+_usage_lock = threading.Lock()
+_usage_stats = {}
+
+
+def record_usage(label, response):
+    """Adds a response's prompt, cached-prompt and completion tokens to the per-label usage stats.
+
+    Accepts an OpenAI SDK ChatCompletion or a LangChain AIMessage. Cached
+    tokens are the part of the prompt Azure served from its prefix cache.
+    """
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        prompt_tokens = usage.prompt_tokens or 0
+        cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+        completion_tokens = usage.completion_tokens or 0
+    else:
+        metadata = getattr(response, "usage_metadata", None)
+        if not metadata:
+            return
+        prompt_tokens = metadata.get("input_tokens", 0)
+        cached_tokens = (metadata.get("input_token_details") or {}).get("cache_read", 0) or 0
+        completion_tokens = metadata.get("output_tokens", 0)
+
+    with _usage_lock:
+        stats = _usage_stats.setdefault(label, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0})
+        stats["calls"] += 1
+        stats["prompt_tokens"] += prompt_tokens
+        stats["cached_tokens"] += cached_tokens
+        stats["completion_tokens"] += completion_tokens
+    if cached_tokens:
+        print(f"[usage] {label}: {cached_tokens}/{prompt_tokens} prompt tokens served from cache")
+
+
+def get_usage_stats():
+    """Returns per-label token totals and the share of prompt tokens served from Azure's prefix cache."""
+    with _usage_lock:
+        return {
+            label: {**stats, "cached_ratio": stats["cached_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0}
+            for label, stats in _usage_stats.items()
+        }
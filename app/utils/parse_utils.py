@@ -0,0 +1,127 @@
+import json
+import re
+import threading
+
+from app.utils.stream_utils import JSONEventParser
+
+# response_format for calls whose reply is parsed as JSON; the prompt itself must mention JSON
+JSON_MODE = {"type": "json_object"}
+
+_FENCE = re.compile(r"(^```(?:json)?\s*)|(\s*```$)")
+# "## Score:", "## Score: 7", "**Feedback:**"
+_HEADING = re.compile(r"^\s*(?:#{1,6}\s*(?P<heading>[^:#]+)|\*\*(?P<bold>[^*:]+?):?\*\*)\s*:?\s*(?P<rest>.*)$")
+_BULLET = re.compile(r"^(?:[-*•]|\d+[.)])\s+")
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def normalize_key(key):
+    """"Area of Improvement" -> "area_of_improvement", so every reply uses the keys the prompts ask for."""
+    return re.sub(r"\W+", "_", key.strip().lower()).strip("_")
+
+
+# --- Recovery Strategies ---
+def _parse_json(text):
+    value = json.loads(_FENCE.sub("", text).strip())
+    if not isinstance(value, dict):
+        raise ValueError("expected a JSON object")
+    return value
+
+
+def _parse_embedded(text):
+    """A JSON object with prose around it, e.g. "Here is the evaluation: {...}"."""
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError("no JSON object")
+    return _parse_json(text[start:end + 1])
+
+
+def _parse_truncated(text):
+    """The complete fields and list items of a reply cut off mid-object, e.g. by max_tokens."""
+    evaluation = {}
+    for event in JSONEventParser().feed(text):
+        if not isinstance(event["key"], str):
+            continue
+        if event["event"] == "field":
+            evaluation[event["key"]] = event["value"]
+        else:
+            evaluation.setdefault(event["key"], []).append(event["value"])
+    if not evaluation:
+        raise ValueError("no complete JSON fields")
+    return evaluation
+
+
+def _parse_markdown(text):
+    """The "## Score:" / "## Feedback:" layout the scoring prompts used to ask for."""
+    sections = {}
+    lines = None
+    for line in text.splitlines():
+        heading = _HEADING.match(line)
+        if heading and (heading.group("heading") or heading.group("bold")):
+            lines = sections.setdefault(normalize_key(heading.group("heading") or heading.group("bold")), [])
+            line = heading.group("rest")
+        if lines is not None and line.strip():
+            lines.append(line.strip())
+    if not sections:
+        raise ValueError("no markdown headings")
+
+    evaluation = {}
+    for key, lines in sections.items():
+        bullets = [_BULLET.sub("", line) for line in lines if _BULLET.match(line)]
+        if bullets:
+            evaluation[key] = bullets
+            continue
+        value = "\n".join(lines)
+        number = _NUMBER.search(value) if key == "score" else None
+        evaluation[key] = (float(number.group()) if "." in number.group() else int(number.group())) if number else value
+    return evaluation
+
+
+PARSERS = [("json", _parse_json), ("embedded", _parse_embedded), ("truncated", _parse_truncated), ("markdown", _parse_markdown)]
+
+
+# --- Parse Tracking ---
+_parse_lock = threading.Lock()
+_parse_stats = {}
+
+
+def _record_parse(label, method):
+    with _parse_lock:
+        stats = _parse_stats.setdefault(label, {name: 0 for name, _ in PARSERS} | {"failed": 0})
+        stats[method] += 1
+
+
+def parse_json_reply(raw_llm_output_string, label):
+    """Parses an evaluation reply into a dict, recovering what it can instead of failing the graded call.
+
+    Tries, in order: the reply as JSON (markdown fences stripped), a JSON
+    object inside surrounding prose, the complete fields of a truncated
+    object, and the "## Heading" markdown layout. Keys are normalised to
+    snake_case. Raises ValueError only if none of them yields anything. The
+    strategy used is counted per label for /metrics.
+    """
+    text = (raw_llm_output_string or "").strip()
+    for method, parse in PARSERS:
+        try:
+            evaluation = parse(text)
+        except ValueError:
+            continue
+        _record_parse(label, method)
+        if method != "json":
+            print(f"[parse] {label}: reply was not plain JSON, recovered it as {method}")
+        return {normalize_key(key): value for key, value in evaluation.items()}
+    _record_parse(label, "failed")
+    raise ValueError(f"Could not parse the evaluation reply: {text[:80]!r}")
+
+
+def get_parse_stats():
+    """Returns per-label counts of each parse strategy, with the share of replies that needed recovery or failed."""
+    with _parse_lock:
+        snapshot = {}
+        for label, stats in _parse_stats.items():
+            total = sum(stats.values())
+            snapshot[label] = {
+                **stats,
+                "recovered_rate": (total - stats["json"] - stats["failed"]) / total if total else 0.0,
+                "failure_rate": stats["failed"] / total if total else 0.0,
+            }
+        return snapshot
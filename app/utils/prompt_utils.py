@@ -0,0 +1,191 @@
+import os
+import re
+import string
+import threading
+import time
+
+from app import config
+from app.utils.cache_utils import template_version
+
+# Separates the static system prefix from the user template in a prompt file
+USER_SECTION_MARKER = "--- user ---"
+# Grade bands a prompt file can target, by class number
+GRADE_BANDS = {"middle": range(5, 9), "senior": range(9, 13)}
+
+
+def grade_band(student_class):
+    """Maps a class such as "7" or "Class 10" to its grade band, or None if it has no class number."""
+    match = re.search(r"\d+", str(student_class))
+    if match is None:
+        return None
+    number = int(match.group())
+    return next((band for band, classes in GRADE_BANDS.items() if number in classes), None)
+
+
+# --- Split Prompts ---
+class SplitPrompt:
+    """A grading prompt kept as a static system prefix plus a short user template sent after it.
+
+    Azure OpenAI reuses the longest prompt prefix it has already seen
+    (1,024 tokens and up) at lower cost and latency. The prefix must match
+    byte for byte. So the rubric and output format live in `system`, which
+    is never formatted, and only `user` carries the per-student fields.
+    Parts that are the same for a whole class, such as the teacher's
+    reference image, go before the user text as `leading_parts`.
+
+    The user template is parsed once, when the prompt is built, so a
+    malformed placeholder fails at load time, not mid-grading.
+    """
+
+    def __init__(self, name, system, user, grade_band=None, language=None):
+        self.name = name
+        self.system = system
+        self.user = user
+        self.grade_band = grade_band
+        self.language = language
+        self.fields = frozenset(field for _, field, _, _ in string.Formatter().parse(user) if field)
+        self.version = template_version(system + user)
+
+    def messages(self, leading_parts=(), trailing_parts=(), **fields):
+        """Returns chat messages: the system prefix, then the user turn with `fields` filled in.
+
+        Image parts make the user turn a content list in the order
+        leading_parts, user text, trailing_parts. The list also works as
+        LangChain chat model input.
+        """
+        user_text = self.user.format(**fields)
+        if leading_parts or trailing_parts:
+            content = [*leading_parts, {"type": "text", "text": user_text}, *trailing_parts]
+        else:
+            content = user_text
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": content},
+        ]
+
+    @property
+    def variant(self):
+        return "/".join(part for part in (self.grade_band, self.language) if part) or "default"
+
+    def __str__(self):
+        # Stable across processes: cache keys and audit records name the exact template used
+        return f"{self.name}[{self.variant}]@{self.version}"
+
+    __repr__ = __str__
+
+
+def prompt_key(file_name):
+    """Returns (name, grade band, language) for a file named <subject>.<kind>[.<grade band>][.<language>].txt."""
+    parts = file_name[: -len(".txt")].split(".")
+    if len(parts) < 2:
+        raise ValueError("expected <subject>.<kind>[.<grade band>][.<language>].txt")
+    variant = parts[2:]
+    band = next((part for part in variant if part in GRADE_BANDS), None)
+    language = next((part for part in variant if part not in GRADE_BANDS), None)
+    return ".".join(parts[:2]), band, language
+
+
+def parse_prompt_file(path):
+    """Builds a SplitPrompt from a prompt file.
+
+    The file holds the system text, a line reading USER_SECTION_MARKER,
+    then the user template with {field} placeholders.
+    """
+    name, band, language = prompt_key(os.path.basename(path))
+    with open(path, encoding="utf-8") as prompt_file:
+        text = prompt_file.read()
+    system, marker, user = text.partition(f"\n{USER_SECTION_MARKER}\n")
+    if not marker:
+        raise ValueError(f"missing a '{USER_SECTION_MARKER}' line")
+    return SplitPrompt(name, system + "\n", user, band, language)
+
+
+# --- Registry ---
+class PromptRegistry:
+    """Grading prompts loaded once from PROMPT_DIR and looked up by name, grade band and language.
+
+    The directory is rechecked at most every PROMPT_RELOAD_INTERVAL seconds.
+    When a file is added, edited or removed, every prompt is re-read and
+    swapped in at once. A file that fails to parse is reported and its
+    previous version is kept, so a bad edit never takes grading down.
+    """
+
+    def __init__(self, directory, reload_interval=0):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self._prompts = {} # (name, grade band, language) -> SplitPrompt
+        self._signature = None
+        self._checked_at = 0.0
+        self._reloads = 0
+        self._lock = threading.Lock()
+
+    def _directory_signature(self):
+        try:
+            entries = sorted((entry for entry in os.scandir(self.directory) if entry.name.endswith(".txt")), key=lambda entry: entry.name)
+        except FileNotFoundError:
+            return ()
+        return tuple((entry.name, entry.stat().st_mtime_ns, entry.stat().st_size) for entry in entries)
+
+    def load(self):
+        """Reads every prompt file in the directory; returns the number of prompts loaded."""
+        signature = self._directory_signature()
+        with self._lock:
+            prompts = {}
+            for file_name, _, _ in signature:
+                try:
+                    prompt = parse_prompt_file(os.path.join(self.directory, file_name))
+                except (OSError, ValueError) as e:
+                    print(f"Warning: Could not load prompt {file_name} ({e}). Keeping the previous version.")
+                    try:
+                        key = prompt_key(file_name)
+                    except ValueError:
+                        continue
+                    if key in self._prompts:
+                        prompts[key] = self._prompts[key]
+                    continue
+                prompts[(prompt.name, prompt.grade_band, prompt.language)] = prompt
+            if self._signature is not None:
+                self._reloads += 1
+                print(f"Reloaded {len(prompts)} prompts from {self.directory}")
+            self._prompts = prompts
+            self._signature = signature
+            self._checked_at = time.monotonic()
+            return len(prompts)
+
+    def _reload_if_changed(self):
+        if not self.reload_interval or time.monotonic() - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = time.monotonic()
+        if self._directory_signature() != self._signature:
+            self.load()
+
+    def get(self, name, student_class=None, language=None):
+        """Returns the most specific prompt for a student's grade band and language.
+
+        Falls back to the language-only, band-only, then default variant.
+        """
+        self._reload_if_changed()
+        band = grade_band(student_class) if student_class is not None else None
+        if language == config.PROMPT_DEFAULT_LANGUAGE:
+            language = None
+        prompts = self._prompts
+        for key in ((name, band, language), (name, None, language), (name, band, None), (name, None, None)):
+            if key in prompts:
+                return prompts[key]
+        raise KeyError(f"No prompt named '{name}' in {self.directory}")
+
+    def version_for(self, names, student_class=None, language=None):
+        """Combined version of the prompts a grading call would use, for its result cache key."""
+        return template_version("".join(str(self.get(name, student_class, language)) for name in names))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "directory": self.directory,
+                "reloads": self._reloads,
+                "prompts": {f"{p.name}[{p.variant}]": p.version for p in self._prompts.values()},
+            }
+
+
+PROMPTS = PromptRegistry(config.PROMPT_DIR, config.PROMPT_RELOAD_INTERVAL)
+PROMPTS.load()
@@ -0,0 +1,316 @@
+import asyncio
+import base64
+import binascii
+import json
+import re
+import threading
+import time
+from io import BytesIO
+
+import httpx
+
+from app import config
+
+# Azure OpenAI request paths name the deployment: /openai/deployments/<name>/chat/completions
+DEPLOYMENT_PATH_PATTERN = re.compile(r"/deployments/([^/]+)/")
+# Base64 characters decoded to read an image's header; enough for JPEG EXIF blocks before the size marker
+IMAGE_HEADER_BASE64_CHARS = 96 * 1024
+# Azure counts max_tokens against TPM up front; used when a request leaves it unset
+DEFAULT_COMPLETION_TOKENS = 1000
+CHARS_PER_TOKEN = 4
+
+
+# --- Request Cost Estimation ---
+def estimate_image_part_tokens(image_url):
+    """Estimates the vision tokens of one image_url part, reading the size from a data URL's image header."""
+    detail = image_url.get("detail", "auto")
+    if detail == "low":
+        return 85
+    # Imported here so loading the governor does not pull in Pillow; a request with an image has loaded it already
+    from PIL import Image
+    from app.utils.image_utils import estimate_image_tokens
+    url = image_url.get("url", "")
+    if url.startswith("data:"):
+        try:
+            header = url[url.index(",") + 1:][:IMAGE_HEADER_BASE64_CHARS]
+            header = header[:len(header) - len(header) % 4]
+            with Image.open(BytesIO(base64.b64decode(header))) as img:
+                return estimate_image_tokens(*img.size, detail=detail)
+        except (ValueError, binascii.Error, OSError):
+            pass
+    # Remote or unreadable image: assume a full-page photo at high detail
+    return estimate_image_tokens(2048, 1536)
+
+
+def estimate_request_tokens(body):
+    """Estimates the TPM cost of a chat completions request body: prompt text, images and max_tokens."""
+    try:
+        request = json.loads(body)
+    except ValueError:
+        return len(body) // CHARS_PER_TOKEN
+    prompt_tokens = 0
+    for message in request.get("messages", []):
+        content = message.get("content") or ""
+        if isinstance(content, str):
+            prompt_tokens += len(content) // CHARS_PER_TOKEN
+            continue
+        for part in content:
+            if part.get("type") == "image_url":
+                prompt_tokens += estimate_image_part_tokens(part.get("image_url", {}))
+            else:
+                prompt_tokens += len(part.get("text", "")) // CHARS_PER_TOKEN
+    completion_tokens = request.get("max_tokens") or request.get("max_completion_tokens") or DEFAULT_COMPLETION_TOKENS
+    return prompt_tokens + completion_tokens
+
+
+def parse_retry_after(headers):
+    """Seconds to back off from a 429's retry-after-ms or Retry-After header, or None if absent."""
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+# --- Per-Deployment Budget ---
+class DeploymentBudget:
+    """Requests-per-minute and tokens-per-minute token buckets for one deployment.
+
+    Callers reserve their cost up front and are told how long to wait, so
+    queued requests are released in arrival order at the budget's rate
+    instead of bursting into 429s. A limit of 0 means unlimited.
+    """
+
+    def __init__(self, name, rpm, tpm, max_concurrency=0):
+        self.name = name
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+        now = time.monotonic()
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = now
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self._sync_slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._async_slots = None
+        self._stats = {"requests": 0, "throttled": 0, "waits": 0, "wait_s": 0.0, "estimated_tokens": 0, "refused": 0}
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def reserve(self, tokens, max_wait=None):
+        """Takes one request and `tokens` from the budget; returns the seconds to wait before sending.
+
+        If the wait would exceed `max_wait`, nothing is taken and None is
+        returned, so the caller can fail the attempt instead of queueing
+        past its timeout.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self._paused_until - now)
+            if self.rpm:
+                self._requests -= 1
+                if self._requests < 0:
+                    wait = max(wait, -self._requests * 60 / self.rpm)
+            if self.tpm:
+                # A request larger than the whole budget can still go once the bucket is full
+                self._tokens -= min(tokens, self.tpm)
+                if self._tokens < 0:
+                    wait = max(wait, -self._tokens * 60 / self.tpm)
+            if max_wait is not None and wait > max_wait:
+                if self.rpm:
+                    self._requests += 1
+                if self.tpm:
+                    self._tokens += min(tokens, self.tpm)
+                self._stats["refused"] += 1
+                return None
+            self._stats["requests"] += 1
+            self._stats["estimated_tokens"] += tokens
+            if wait > 0:
+                self._stats["waits"] += 1
+                self._stats["wait_s"] += wait
+            return wait
+
+    def expected_wait(self):
+        """Seconds until one more request fits the budget or a 429 pause ends."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self._paused_until - now)
+            if self.rpm and self._requests < 1:
+                wait = max(wait, (1 - self._requests) * 60 / self.rpm)
+            if self.tpm and self._tokens < 0:
+                wait = max(wait, -self._tokens * 60 / self.tpm)
+            return wait
+
+    def observe(self, response):
+        """Pauses the deployment on a 429 and syncs the buckets with Azure's remaining-budget headers."""
+        with self._lock:
+            now = time.monotonic()
+            if response.status_code == 429:
+                self._stats["throttled"] += 1
+                retry_after = parse_retry_after(response.headers)
+                if retry_after is None:
+                    retry_after = config.RATE_LIMIT_DEFAULT_BACKOFF
+                self._paused_until = max(self._paused_until, now + retry_after)
+                print(f"[rate limit] {self.name} throttled, pausing for {retry_after:.1f}s")
+                return
+            self._refill(now)
+            try:
+                if self.rpm and "x-ratelimit-remaining-requests" in response.headers:
+                    self._requests = min(self._requests, float(response.headers["x-ratelimit-remaining-requests"]))
+                if self.tpm and "x-ratelimit-remaining-tokens" in response.headers:
+                    self._tokens = min(self._tokens, float(response.headers["x-ratelimit-remaining-tokens"]))
+            except ValueError:
+                pass
+
+    def sync_slots(self):
+        """The threading semaphore capping in-flight requests, or None when concurrency is unlimited."""
+        return self._sync_slots
+
+    def async_slots(self):
+        """The asyncio semaphore capping in-flight requests, or None when concurrency is unlimited."""
+        if self.max_concurrency and self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+        return self._async_slots
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["paused_for_s"] = max(0.0, self._paused_until - time.monotonic())
+        stats.update({"rpm_limit": self.rpm, "tpm_limit": self.tpm})
+        return stats
+
+
+class RateGovernor:
+    """Holds a DeploymentBudget per Azure OpenAI deployment, created on first use from config."""
+
+    def __init__(self, default_rpm, default_tpm, overrides=None, max_concurrency=0):
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.overrides = overrides or {}
+        self.max_concurrency = max_concurrency
+        self._budgets = {}
+        self._lock = threading.Lock()
+
+    def _budget(self, host, name):
+        with self._lock:
+            budget = self._budgets.get((host, name))
+            if budget is None:
+                rpm, tpm = self.overrides.get(name, (self.default_rpm, self.default_tpm))
+                # The same deployment name in two regions has two separate quotas
+                budget = DeploymentBudget(f"{name}@{host}", rpm, tpm, self.max_concurrency)
+                self._budgets[(host, name)] = budget
+        return budget
+
+    def budget_for(self, request):
+        """Returns the budget for the deployment a request targets, or None for non-deployment calls."""
+        match = DEPLOYMENT_PATH_PATTERN.search(request.url.path)
+        if not match:
+            return None
+        return self._budget(request.url.host, match.group(1))
+
+    def expected_wait(self, host, name):
+        """Seconds a new request to this deployment would currently be held back, without reserving anything."""
+        return self._budget(host, name).expected_wait()
+
+    def stats(self):
+        with self._lock:
+            budgets = dict(self._budgets)
+        return {budget.name: budget.stats() for budget in budgets.values()}
+
+
+# --- httpx Transports ---
+def _reserve_or_timeout(budget, request, body):
+    """Reserves the request's cost, or raises a timeout if it would queue longer than one attempt's timeout.
+
+    Matches the async path, where wait_for bounds queueing plus the request
+    to twice LLM_ATTEMPT_TIMEOUT; the retry policy treats the error like any
+    other timeout.
+    """
+    wait = budget.reserve(estimate_request_tokens(body), max_wait=config.LLM_ATTEMPT_TIMEOUT)
+    if wait is None:
+        raise httpx.PoolTimeout(f"Rate budget for {budget.name} would hold this request over {config.LLM_ATTEMPT_TIMEOUT}s", request=request)
+    return wait
+
+
+class GovernedTransport(httpx.BaseTransport):
+    """Wraps an httpx transport so every deployment call waits for its RPM/TPM budget before it is sent.
+
+    Sits under the shared pooled client, so both the OpenAI SDK and
+    LangChain calls are governed, and retries after a 429 find the
+    deployment already paused.
+    """
+
+    def __init__(self, transport, governor):
+        self._transport = transport
+        self._governor = governor
+
+    def handle_request(self, request):
+        budget = self._governor.budget_for(request)
+        if budget is None:
+            return self._transport.handle_request(request)
+        wait = _reserve_or_timeout(budget, request, request.read())
+        if wait > 0:
+            time.sleep(wait)
+        slots = budget.sync_slots()
+        if slots is None:
+            response = self._transport.handle_request(request)
+        else:
+            with slots:
+                response = self._transport.handle_request(request)
+        budget.observe(response)
+        return response
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncGovernedTransport(httpx.AsyncBaseTransport):
+    """Async variant of GovernedTransport for the asyncio grading path."""
+
+    def __init__(self, transport, governor):
+        self._transport = transport
+        self._governor = governor
+
+    async def handle_async_request(self, request):
+        budget = self._governor.budget_for(request)
+        if budget is None:
+            return await self._transport.handle_async_request(request)
+        wait = _reserve_or_timeout(budget, request, await request.aread())
+        if wait > 0:
+            await asyncio.sleep(wait)
+        slots = budget.async_slots()
+        if slots is None:
+            response = await self._transport.handle_async_request(request)
+        else:
+            async with slots:
+                response = await self._transport.handle_async_request(request)
+        budget.observe(response)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+RATE_GOVERNOR = RateGovernor(
+    default_rpm=config.RATE_LIMIT_DEFAULT_RPM,
+    default_tpm=config.RATE_LIMIT_DEFAULT_TPM,
+    overrides=config.RATE_LIMIT_OVERRIDES,
+    max_concurrency=config.RATE_LIMIT_MAX_CONCURRENCY,
+)
+
+
+def get_rate_limit_stats():
+    """Returns per-deployment request, throttle and wait counts of the shared governor."""
+    return RATE_GOVERNOR.stats()
@@ -0,0 +1,151 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from app import config
+from app.storage.blob_storage import resolve_image
+from app.utils.image_utils import build_image_part
+
+
+# --- Reference Image Registry ---
+class ReferenceImageRegistry:
+    """Preprocesses, encodes and keeps the teacher's reference images, once per file.
+
+    Every submission for an assignment compares against the same reference
+    diagram, so its image part and SHA-256 are built on first use and served
+    to every later grading call. An entry is rebuilt when the file's mtime or
+    size changes, or, with validate="hash", when its content hash changes.
+    Pinned paths are never evicted; the rest are kept in an LRU of
+    max_entries. A part holding a time-limited storage URL instead of a data
+    URL is rebuilt once half of IMAGE_URL_TTL_SECONDS has passed, so an
+    in-flight call never gets an expired URL.
+    """
+
+    def __init__(self, max_entries, validate="mtime", pinned_paths=()):
+        self.max_entries = max_entries
+        self.validate = validate
+        self.pinned_paths = {os.path.abspath(path) for path in pinned_paths}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+    @staticmethod
+    def _is_remote(image_path_or_url):
+        return image_path_or_url.startswith("http://") or image_path_or_url.startswith("https://")
+
+    @staticmethod
+    def _file_hash(path):
+        digest = hashlib.sha256()
+        with open(path, "rb") as image_file:
+            for chunk in iter(lambda: image_file.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _current_entry(self, path):
+        """Returns the entry for path if it still matches the file on disk, dropping it if stale."""
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is None:
+            return None, stamp
+        if entry["stamp"] == stamp:
+            return entry, stamp
+        if self.validate == "hash" and entry["sha256"] == self._file_hash(path):
+            # Touched but unchanged (e.g. re-uploaded the same file): keep the encoded parts
+            entry["stamp"] = stamp
+            return entry, stamp
+        with self._lock:
+            if self._entries.get(path) is entry:
+                del self._entries[path]
+                self._stats["invalidations"] += 1
+        print(f"Reference image changed on disk, re-encoding: {path}")
+        return None, stamp
+
+    def _store(self, path, entry):
+        with self._lock:
+            self._entries[path] = entry
+            self._entries.move_to_end(path)
+            evictable = [key for key in self._entries if key not in self.pinned_paths]
+            while len(self._entries) > self.max_entries and evictable:
+                del self._entries[evictable.pop(0)]
+                self._stats["evictions"] += 1
+
+    def _entry(self, path):
+        entry, stamp = self._current_entry(path)
+        if entry is None:
+            entry = {"stamp": stamp, "sha256": self._file_hash(path), "parts": {}, "refresh_at": {}}
+            self._store(path, entry)
+        return entry
+
+    def fingerprint(self, image_path_or_url):
+        """SHA-256 of a reference image, hashed once per file version; remote URLs are fingerprinted by the URL."""
+        try:
+            image_path_or_url = resolve_image(image_path_or_url)
+        except (OSError, ValueError):
+            # A missing or invalid blob; the grader reports it, so key on the reference
+            return hashlib.sha256(image_path_or_url.encode("utf-8")).hexdigest()
+        if self._is_remote(image_path_or_url):
+            return hashlib.sha256(image_path_or_url.encode("utf-8")).hexdigest()
+        path = os.path.abspath(image_path_or_url)
+        try:
+            return self._entry(path)["sha256"]
+        except OSError:
+            # Let the grader report the missing file; key on the path instead
+            return hashlib.sha256(image_path_or_url.encode("utf-8")).hexdigest()
+
+    def image_part(self, image_path_or_url, route, label="expected output image"):
+        """Returns the chat "image_url" part for a reference image, encoding it only on first use.
+
+        Returns None if a local image cannot be read.
+        """
+        image_path_or_url = resolve_image(image_path_or_url)
+        if self._is_remote(image_path_or_url):
+            return build_image_part(image_path_or_url, route, label)
+        path = os.path.abspath(image_path_or_url)
+        try:
+            entry = self._entry(path)
+        except OSError:
+            print(f"Error: Image file not found at {image_path_or_url}")
+            return None
+
+        part = entry["parts"].get(route)
+        if part is not None and time.monotonic() >= entry["refresh_at"].get(route, float("inf")):
+            part = None # Its storage URL is about to expire
+        with self._lock:
+            self._stats["hits" if part is not None else "misses"] += 1
+        if part is None:
+            part = build_image_part(image_path_or_url, route, label)
+            if part is None:
+                return None
+            entry["parts"][route] = part
+            if not part["image_url"]["url"].startswith("data:"):
+                entry["refresh_at"][route] = time.monotonic() + config.IMAGE_URL_TTL_SECONDS / 2
+            else:
+                entry["refresh_at"].pop(route, None)
+        # Callers get their own dicts; the data URL string itself is shared
+        return {"type": part["type"], "image_url": dict(part["image_url"])}
+
+    def preload(self, route="diagram"):
+        """Encodes every pinned reference image that exists, e.g. at startup."""
+        for path in self.pinned_paths:
+            if os.path.exists(path):
+                self.image_part(path, route)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["pinned"] = len(self.pinned_paths)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+REFERENCE_IMAGES = ReferenceImageRegistry(
+    max_entries=config.REFERENCE_CACHE_MAX_ENTRIES,
+    validate=config.REFERENCE_CACHE_VALIDATE,
+    pinned_paths=config.REFERENCE_IMAGE_PATHS,
+)
@@ -0,0 +1,221 @@
+import asyncio
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+
+from app import config
+
+# Status codes worth another attempt: timeouts, conflicts, throttling and server errors
+TRANSIENT_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def _openai():
+    """The openai module once a client has imported it, else None; an error cannot come from an SDK that was never loaded."""
+    return sys.modules.get("openai")
+
+
+def is_transient(error):
+    """True for errors a fresh attempt can fix: timeouts, dropped connections, 429s and 5xx responses."""
+    if isinstance(error, (httpx.TransportError, asyncio.TimeoutError, TimeoutError)):
+        return True
+    openai = _openai()
+    if openai is None:
+        return False
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in TRANSIENT_STATUS_CODES
+    return False
+
+
+def _is_timeout(error):
+    openai = _openai()
+    return isinstance(error, (httpx.TimeoutException, asyncio.TimeoutError)) or (openai is not None and isinstance(error, openai.APITimeoutError))
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff before retry number `attempt` (1-based)."""
+    ceiling = min(config.LLM_RETRY_MAX_DELAY, config.LLM_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    return random.uniform(0, ceiling)
+
+
+# --- Per-Call Latency And Counters ---
+_stats_lock = threading.Lock()
+_call_stats = {}
+_call_latencies = {}
+
+
+def _stats_for(label):
+    return _call_stats.setdefault(
+        label, {"calls": 0, "attempts": 0, "retries": 0, "timeouts": 0, "hedges": 0, "hedge_wins": 0, "failures": 0}
+    )
+
+
+def _count(label, counter, amount=1):
+    with _stats_lock:
+        _stats_for(label)[counter] += amount
+
+
+def _record_attempt_latency(label, elapsed):
+    with _stats_lock:
+        _call_latencies.setdefault(label, deque(maxlen=config.LLM_LATENCY_WINDOW)).append(elapsed)
+
+
+def hedge_delay(label):
+    """Seconds to wait before hedging a call: the label's recent LLM_HEDGE_PERCENTILE latency.
+
+    Returns None while hedging is off or too few calls have been seen to
+    know what slow looks like.
+    """
+    if not config.LLM_HEDGE_ENABLED:
+        return None
+    with _stats_lock:
+        latencies = sorted(_call_latencies.get(label, ()))
+    if len(latencies) < config.LLM_HEDGE_MIN_SAMPLES:
+        return None
+    index = min(len(latencies) - 1, int(len(latencies) * config.LLM_HEDGE_PERCENTILE / 100))
+    return max(config.LLM_HEDGE_MIN_DELAY, latencies[index])
+
+
+def get_resilience_stats():
+    """Returns per-label attempt, retry, timeout and hedge counts plus the current hedge delay."""
+    with _stats_lock:
+        labels = {label: dict(stats) for label, stats in _call_stats.items()}
+    for label, stats in labels.items():
+        stats["hedge_delay_s"] = hedge_delay(label)
+    return labels
+
+
+# --- Sync Calls ---
+_hedge_executor_lock = threading.Lock()
+_hedge_executor = None
+
+
+def _get_hedge_executor():
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _hedge_executor_lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(max_workers=config.LLM_HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+    return _hedge_executor
+
+
+def _timed_attempt(label, call):
+    _count(label, "attempts")
+    start = time.perf_counter()
+    try:
+        result = call(config.LLM_ATTEMPT_TIMEOUT)
+    except Exception as e:
+        if _is_timeout(e):
+            _count(label, "timeouts")
+        raise
+    _record_attempt_latency(label, time.perf_counter() - start)
+    return result
+
+
+def _hedged_attempt(label, call, delay):
+    """Runs one attempt and, if it is still running after `delay`, a duplicate; returns the first success."""
+    executor = _get_hedge_executor()
+    primary = executor.submit(_timed_attempt, label, call)
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+    _count(label, "hedges")
+    print(f"[hedge] {label} slower than {delay:.1f}s, sending a duplicate request")
+    hedge = executor.submit(_timed_attempt, label, call)
+    done, pending = wait([primary, hedge], return_when=FIRST_COMPLETED)
+    first = done.pop()
+    if first.exception() is not None and pending:
+        # The other request may still succeed
+        first = pending.pop()
+    if first is hedge and first.exception() is None:
+        _count(label, "hedge_wins")
+    # A sync request cannot be cancelled mid-flight; the loser finishes in the background
+    return first.result()
+
+
+def call_with_retries(label, call):
+    """Runs `call(timeout)` with a per-attempt timeout, jittered retries on transient errors and optional hedging.
+
+    `call` receives the per-attempt timeout in seconds and must pass it on
+    to the OpenAI SDK or LangChain call it makes.
+    """
+    _count(label, "calls")
+    for attempt in range(1, config.LLM_MAX_ATTEMPTS + 1):
+        try:
+            delay = hedge_delay(label)
+            if delay is None:
+                return _timed_attempt(label, call)
+            return _hedged_attempt(label, call, delay)
+        except Exception as e:
+            if not is_transient(e) or attempt == config.LLM_MAX_ATTEMPTS:
+                _count(label, "failures")
+                raise
+            sleep_for = backoff_delay(attempt)
+            _count(label, "retries")
+            print(f"[retry] {label} attempt {attempt} failed ({type(e).__name__}), retrying in {sleep_for:.1f}s")
+            time.sleep(sleep_for)
+
+
+# --- Async Calls ---
+async def _atimed_attempt(label, call):
+    _count(label, "attempts")
+    start = time.perf_counter()
+    try:
+        # The SDK timeout covers the HTTP request; wait_for also bounds time spent queued in the rate governor
+        result = await asyncio.wait_for(call(config.LLM_ATTEMPT_TIMEOUT), config.LLM_ATTEMPT_TIMEOUT * 2)
+    except Exception as e:
+        if _is_timeout(e):
+            _count(label, "timeouts")
+        raise
+    _record_attempt_latency(label, time.perf_counter() - start)
+    return result
+
+
+async def _ahedged_attempt(label, call, delay):
+    """Async variant of _hedged_attempt; the losing request is cancelled."""
+    primary = asyncio.ensure_future(_atimed_attempt(label, call))
+    done, _ = await asyncio.wait([primary], timeout=delay)
+    if done:
+        return primary.result()
+    _count(label, "hedges")
+    print(f"[hedge] {label} slower than {delay:.1f}s, sending a duplicate request")
+    hedge = asyncio.ensure_future(_atimed_attempt(label, call))
+    tasks = {primary, hedge}
+    try:
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        _count(label, "hedge_wins")
+                    return task.result()
+        # Both failed: surface the primary's error
+        return primary.result()
+    finally:
+        for task in (primary, hedge):
+            task.cancel()
+
+
+async def acall_with_retries(label, call):
+    """Async variant of call_with_retries; `call(timeout)` returns an awaitable."""
+    _count(label, "calls")
+    for attempt in range(1, config.LLM_MAX_ATTEMPTS + 1):
+        try:
+            delay = hedge_delay(label)
+            if delay is None:
+                return await _atimed_attempt(label, call)
+            return await _ahedged_attempt(label, call, delay)
+        except Exception as e:
+            if not is_transient(e) or attempt == config.LLM_MAX_ATTEMPTS:
+                _count(label, "failures")
+                raise
+            sleep_for = backoff_delay(attempt)
+            _count(label, "retries")
+            print(f"[retry] {label} attempt {attempt} failed ({type(e).__name__}), retrying in {sleep_for:.1f}s")
+            await asyncio.sleep(sleep_for)
@@ -0,0 +1,217 @@
+import asyncio
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+from app import config
+from app.utils.openai_utils import get_async_openai_client, get_chat_llm, get_openai_client
+from app.utils.rate_limit_utils import RATE_GOVERNOR, parse_retry_after
+
+# Tiers the tools route to: "vision" calls send images, "scoring" calls are the text-only llm_response step
+VISION_TIER = "vision"
+SCORING_TIER = "scoring"
+
+
+# --- Deployments ---
+class Deployment:
+    """One Azure OpenAI deployment in one region, with its live latency, error rate and throttle state."""
+
+    def __init__(self, name, endpoint, api_key=None, region=None):
+        self.name = name
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.region = region or urlparse(endpoint or "").hostname
+        self.latency_s = None # Exponentially weighted; None until the first success
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.throttled_until = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.throttles = 0
+
+    @property
+    def label(self):
+        return f"{self.name}@{self.region}"
+
+    def client(self):
+        return get_openai_client(self.endpoint, self.api_key)
+
+    def async_client(self):
+        return get_async_openai_client(self.endpoint, self.api_key)
+
+    def chat_llm(self):
+        return get_chat_llm(self.name, self.endpoint, self.api_key)
+
+
+class DeploymentRouter:
+    """Spreads calls for a tier across its deployments by live latency, error rate and throttling.
+
+    Each tier lists deployments in priority groups. Calls go to the lowest
+    group with a deployment that is not throttled, and within it to the
+    deployment with the lowest expected latency. That estimate is the
+    recent latency, inflated by the error rate and by calls already in
+    flight, plus any wait the rate governor would impose. A call that
+    fails other than by throttling counts as taking LLM_ATTEMPT_TIMEOUT,
+    and a deployment not yet tried is assumed to be as fast as the best
+    one in its tier. A deployment that answers 429 is skipped until its
+    Retry-After passes. This gives failover to the next deployment or group
+    without operator action.
+    """
+
+    def __init__(self, tiers):
+        self.tiers = tiers # tier -> list of priority groups, each a list of Deployments
+        self._lock = threading.Lock()
+
+    def _expected_latency(self, deployment, untried_latency):
+        latency = deployment.latency_s if deployment.latency_s is not None else untried_latency
+        latency *= (1 + config.ROUTER_ERROR_PENALTY * deployment.error_rate) * (1 + deployment.in_flight)
+        host = urlparse(deployment.endpoint or "").hostname
+        return latency + RATE_GOVERNOR.expected_wait(host, deployment.name)
+
+    def choose(self, tier):
+        """Picks the deployment for the next call in a tier and counts it as in flight."""
+        with self._lock:
+            now = time.monotonic()
+            groups = self.tiers[tier]
+            candidates = next(
+                (available for available in ([d for d in group if d.throttled_until <= now] for group in groups) if available),
+                None,
+            )
+            if candidates is None:
+                # Everything is throttled: use whichever deployment frees up first
+                candidates = [min((d for group in groups for d in group), key=lambda d: d.throttled_until)]
+            # Untried deployments compete with the best observed one, so they are explored without being favoured
+            untried_latency = min((d.latency_s for group in groups for d in group if d.latency_s is not None), default=0.0)
+            expected = {d: self._expected_latency(d, untried_latency) for d in candidates}
+            best = min(expected.values())
+            deployment = random.choice([d for d in candidates if expected[d] == best])
+            deployment.in_flight += 1
+            deployment.calls += 1
+            return deployment
+
+    def release(self, deployment):
+        """Ends a call without counting it for or against the deployment."""
+        with self._lock:
+            deployment.in_flight -= 1
+
+    @staticmethod
+    def _observe_latency(deployment, elapsed):
+        alpha = config.ROUTER_LATENCY_ALPHA
+        deployment.latency_s = elapsed if deployment.latency_s is None else (1 - alpha) * deployment.latency_s + alpha * elapsed
+
+    def record_success(self, deployment, elapsed):
+        with self._lock:
+            deployment.in_flight -= 1
+            self._observe_latency(deployment, elapsed)
+            deployment.error_rate *= 1 - config.ROUTER_LATENCY_ALPHA
+
+    def record_failure(self, deployment, error):
+        with self._lock:
+            deployment.in_flight -= 1
+            alpha = config.ROUTER_LATENCY_ALPHA
+            deployment.error_rate = (1 - alpha) * deployment.error_rate + alpha
+            deployment.errors += 1
+            # openai.RateLimitError, matched by status so the SDK need not be imported here
+            if getattr(error, "status_code", None) == 429:
+                retry_after = parse_retry_after(error.response.headers)
+                cooldown = retry_after if retry_after is not None else config.RATE_LIMIT_DEFAULT_BACKOFF
+                deployment.throttled_until = time.monotonic() + cooldown
+                deployment.throttles += 1
+                print(f"[router] {deployment.label} throttled, routing around it for {cooldown:.1f}s")
+            else:
+                # The caller gets nothing and has to retry, however fast the error came back
+                self._observe_latency(deployment, config.LLM_ATTEMPT_TIMEOUT)
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            return {
+                tier: [
+                    {
+                        "deployment": d.label,
+                        "priority": priority,
+                        "latency_s": d.latency_s,
+                        "error_rate": round(d.error_rate, 4),
+                        "in_flight": d.in_flight,
+                        "calls": d.calls,
+                        "errors": d.errors,
+                        "throttles": d.throttles,
+                        "throttled_for_s": max(0.0, d.throttled_until - now),
+                    }
+                    for priority, group in enumerate(groups)
+                    for d in group
+                ]
+                for tier, groups in self.tiers.items()
+            }
+
+
+def build_router():
+    """Builds the router from the GPT-4o/GPT-4o-mini settings plus any AZURE_OPENAI_DEPLOYMENTS entries.
+
+    Vision calls go to GPT-4o. Scoring calls go to GPT-4o-mini when it is
+    configured and ROUTE_SCORING_TO_MINI is on, with GPT-4o as the fallback
+    group. Extra deployments join the tiers and priority they list.
+    """
+    primary = Deployment(config.GPT4O_DEPLOYMENT_NAME, config.AZURE_OPENAI_ENDPOINT, config.AZURE_OPENAI_API_KEY)
+    tiers = {VISION_TIER: [[primary]], SCORING_TIER: [[primary]]}
+    if config.ROUTE_SCORING_TO_MINI and config.GPT4O_MINI_DEPLOYMENT_NAME:
+        mini = Deployment(config.GPT4O_MINI_DEPLOYMENT_NAME, config.AZURE_OPENAI_ENDPOINT, config.AZURE_OPENAI_API_KEY)
+        tiers[SCORING_TIER] = [[mini], [primary]]
+
+    for entry in config.AZURE_OPENAI_DEPLOYMENTS:
+        deployment = Deployment(entry["name"], entry.get("endpoint", config.AZURE_OPENAI_ENDPOINT), entry.get("api_key"), entry.get("region"))
+        priority = entry.get("priority", 0)
+        for tier in entry.get("tiers", [VISION_TIER, SCORING_TIER]):
+            groups = tiers.setdefault(tier, [])
+            while len(groups) <= priority:
+                groups.append([])
+            groups[priority].append(deployment)
+    return DeploymentRouter({tier: [group for group in groups if group] for tier, groups in tiers.items()})
+
+
+ROUTER = build_router()
+
+
+# --- Routed Calls ---
+def routed(tier, call):
+    """Wraps `call(deployment, timeout)` into the `call(timeout)` that call_with_retries expects.
+
+    Every attempt, including retries and hedges, picks its own deployment,
+    so a retry after a 429 or an error goes to the next best deployment.
+    """
+    def attempt(timeout):
+        deployment = ROUTER.choose(tier)
+        start = time.perf_counter()
+        try:
+            result = call(deployment, timeout)
+        except Exception as e:
+            ROUTER.record_failure(deployment, e)
+            raise
+        ROUTER.record_success(deployment, time.perf_counter() - start)
+        return result
+    return attempt
+
+
+def arouted(tier, call):
+    """Async variant of routed; `call(deployment, timeout)` returns an awaitable."""
+    async def attempt(timeout):
+        deployment = ROUTER.choose(tier)
+        start = time.perf_counter()
+        try:
+            result = await call(deployment, timeout)
+        except asyncio.CancelledError:
+            # A losing hedge was cancelled; that says nothing about the deployment's health
+            ROUTER.release(deployment)
+            raise
+        except Exception as e:
+            ROUTER.record_failure(deployment, e)
+            raise
+        ROUTER.record_success(deployment, time.perf_counter() - start)
+        return result
+    return attempt
+
+
+def get_routing_stats():
+    """Returns each tier's deployments with their live latency, error rate and throttle state."""
+    return ROUTER.stats()
@@ -0,0 +1,175 @@
+import json
+
+from app.utils.openai_utils import record_latency, record_usage
+from app.utils.resilience_utils import acall_with_retries
+from app.utils.routing_utils import arouted
+
+
+# --- Incremental JSON ---
+_INVALID = object() # A value that did not parse, so no event is emitted for it
+
+
+class JSONEventParser:
+    """Reads a JSON object as it streams in and reports each top-level field as soon as it is complete.
+
+    List fields such as "feedback" are reported one item at a time instead,
+    so a teacher sees the first feedback point while the model is still
+    writing the rest. Anything before the opening brace, such as a ```json
+    fence, is skipped. A field that does not parse is left out; the full
+    reply is still parsed once the stream ends.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._depth = 0 # Open objects and lists, the top-level object included
+        self._in_string = False
+        self._escaped = False
+        self._started = False
+        self._done = False
+        self._key_start = None
+        self._key = None
+        self._after_colon = False
+        self._value_start = None
+        self._list_key = None # Key of the top-level list being read
+        self._item_start = None
+        self._item_index = 0
+
+    def feed(self, chunk):
+        """Adds the next piece of the reply; returns the events it completes, in order."""
+        self.text += chunk
+        events = []
+        while self._pos < len(self.text) and not self._done:
+            self._step(self.text[self._pos], self._pos, events)
+            self._pos += 1
+        return events
+
+    def _emit_field(self, end, events):
+        value = self._parse(self._value_start, end)
+        if value is not _INVALID:
+            events.append({"event": "field", "key": self._key, "value": value})
+        self._value_start = None
+        self._after_colon = False
+
+    def _emit_item(self, end, events):
+        value = self._parse(self._item_start, end)
+        if value is not _INVALID:
+            events.append({"event": "item", "key": self._list_key, "index": self._item_index, "value": value})
+        self._item_start = None
+        self._item_index += 1
+
+    def _parse(self, start, end):
+        try:
+            return json.loads(self.text[start:end])
+        except ValueError:
+            return _INVALID
+
+    def _step(self, char, pos, events):
+        if not self._started:
+            if char == "{":
+                self._started = True
+                self._depth = 1
+            return
+
+        if self._in_string:
+            if self._escaped:
+                self._escaped = False
+            elif char == "\\":
+                self._escaped = True
+            elif char == '"':
+                self._in_string = False
+                if self._key_start is not None:
+                    self._key = self._parse(self._key_start, pos + 1)
+                    self._key_start = None
+            return
+
+        if char.isspace():
+            return
+        in_list = self._depth == 2 and self._list_key is not None
+
+        if char in "}]":
+            if in_list and char == "]":
+                if self._item_start is not None:
+                    self._emit_item(pos, events)
+                self._list_key = None
+                self._value_start = None
+                self._after_colon = False
+            elif self._depth == 1:
+                if self._value_start is not None:
+                    self._emit_field(pos, events)
+                self._done = True
+            self._depth -= 1
+            if self._depth == 2 and self._list_key is not None and self._item_start is not None:
+                self._emit_item(pos + 1, events)
+            elif self._depth == 1 and self._value_start is not None:
+                self._emit_field(pos + 1, events)
+            return
+
+        if char == ",":
+            if self._depth == 1 and self._value_start is not None:
+                self._emit_field(pos, events)
+            elif in_list and self._item_start is not None:
+                self._emit_item(pos, events)
+            return
+
+        if self._depth == 1:
+            if char == ":":
+                self._after_colon = True
+            elif not self._after_colon:
+                if char == '"':
+                    self._key_start = pos
+            elif self._value_start is None:
+                self._value_start = pos
+                if char == "[":
+                    self._list_key = self._key
+                    self._item_index = 0
+        elif in_list and self._item_start is None:
+            self._item_start = pos
+
+        if char == '"':
+            self._in_string = True
+        elif char in "{[":
+            self._depth += 1
+
+
+# --- Streamed Completions ---
+async def astream_chat(label, tier, messages, **create_kwargs):
+    """Streams a routed chat completion, yielding the reply's text as it is generated.
+
+    Opening the stream goes through the deployment router and the retry
+    policy. Once text has been yielded a failure is raised to the caller
+    instead, since the client has already seen part of the reply. Token
+    usage is recorded from the stream's final chunk.
+    """
+    with record_latency(label):
+        stream = await acall_with_retries(label, arouted(tier, lambda deployment, timeout: deployment.async_client().chat.completions.create(
+            model=deployment.name,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=timeout,
+            **create_kwargs,
+        )))
+        try:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    record_usage(label, chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # Frees the connection if the client went away mid-reply
+            await stream.close()
+
+
+async def astream_evaluation(label, tier, messages, **create_kwargs):
+    """Streams a JSON evaluation as events for the client.
+
+    Every piece of text is yielded as a "delta" event, followed by a
+    "field" or "item" event for each value it completes (see
+    JSONEventParser). The caller joins the deltas to get the full reply.
+    """
+    parser = JSONEventParser()
+    async for text in astream_chat(label, tier, messages, **create_kwargs):
+        yield {"event": "delta", "text": text}
+        for event in parser.feed(text):
+            yield event
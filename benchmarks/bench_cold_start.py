@@ -0,0 +1,61 @@
+# benchmarks/bench_cold_start.py
+# Import time of the app's entry modules, which is most of a new instance's cold start.
+# Run with: python -m benchmarks.bench_cold_start [module ...]
+# Each import runs in a fresh interpreter under `python -X importtime`; the slowest
+# modules are listed so a new eager import of a heavy SDK shows up here.
+import os
+import statistics
+import subprocess
+import sys
+
+# What each process imports at startup, and what the first grading request adds
+DEFAULT_TARGETS = {
+    "startup (worker)": ["app.jobs.worker", "app.analysis.batch_grading"],
+    "startup (ASGI app)": ["app.app"],
+    "startup (Flask app)": ["app"],
+    "first grading request": ["app.jobs.worker", "app.analysis.english_tool", "app.analysis.math_tool", "app.analysis.map_tool", "openai", "langchain_openai"],
+}
+REPEATS = 5
+TOP_MODULES = 8
+
+
+def import_times(modules):
+    """Imports `modules` in a fresh interpreter; returns (wall seconds, {module: cumulative us}) or raises on failure."""
+    code = "; ".join(f"import {module}" for module in modules) or "pass"
+    if modules == ["app"]:
+        # The Flask entry point is app.py at the repo root, shadowed by the app package
+        code = "import runpy; runpy.run_path('app.py')"
+    command = [sys.executable, "-X", "importtime", "-c", f"import time; start = time.perf_counter(); {code}; print(time.perf_counter() - start)"]
+    result = subprocess.run(command, capture_output=True, text=True, env={**os.environ, "JOB_INPROCESS_WORKERS": "0"})
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "): # Top-level imports only, nested ones are counted in their parent
+            cumulative[name.strip()] = int(cumulative_us)
+    return float(result.stdout.strip().splitlines()[-1]), cumulative
+
+
+def main(targets):
+    _, interpreter_startup = import_times([])
+    for label, modules in targets.items():
+        try:
+            runs = [import_times(modules) for _ in range(REPEATS)]
+        except RuntimeError as e:
+            print(f"{label}: skipped ({e})\n")
+            continue
+        wall = statistics.median(elapsed for elapsed, _ in runs)
+        _, cumulative = runs[-1]
+        cumulative = {name: us for name, us in cumulative.items() if name not in interpreter_startup}
+        print(f"{label}: {wall * 1000:.0f} ms median over {REPEATS} runs ({', '.join(modules)})")
+        for name, cumulative_us in sorted(cumulative.items(), key=lambda item: item[1], reverse=True)[:TOP_MODULES]:
+            print(f"    {cumulative_us / 1000:>8.1f} ms  {name}")
+        print()
+
+
+if __name__ == "__main__":
+    main({" ".join(sys.argv[1:]): sys.argv[1:]} if len(sys.argv) > 1 else DEFAULT_TARGETS)
@@ -0,0 +1,75 @@
+# benchmarks/bench_image_encoding.py
+# Peak memory of turning a local image into a base64 "data:" URL.
+# Run with: python -m benchmarks.bench_image_encoding [image ...]
+# Each approach runs in a fresh interpreter so peak RSS is not shared between them.
+import base64
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+DEFAULT_IMAGES = ["trial_file/BadImage.jpg", "trial_file/presentation.png"]
+WARMUP_IMAGE = "trial_file/math.png" # Tiny, so warming up does not set the peak RSS itself
+REPEATS = 5
+
+
+def legacy_data_url(image_path):
+    """The pre-streaming path: file bytes, then base64 bytes, then a decoded str, then the f-string copy."""
+    from app.utils.image_utils import get_image_mime_type
+    with open(image_path, "rb") as image_file:
+        base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+    return f"data:{get_image_mime_type(image_path)};base64,{base64_image}"
+
+
+def streaming_data_url(image_path):
+    from app.utils.image_utils import encode_image_to_data_url
+    return encode_image_to_data_url(image_path)
+
+
+APPROACHES = {"legacy": legacy_data_url, "streaming": streaming_data_url}
+
+
+def peak_rss_kib():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_one(approach, image_path):
+    """Runs a single approach in this process and prints one result line."""
+    encode = APPROACHES[approach]
+    encode(WARMUP_IMAGE) # Warm up imports so they are not counted against the encoder
+    rss_before = peak_rss_kib()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        data_url = encode(image_path)
+        del data_url
+    elapsed = (time.perf_counter() - start) / REPEATS
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{approach:<10} {os.path.basename(image_path):<24} {os.path.getsize(image_path) / 1024:>9.0f} "
+        f"{traced_peak / 1024:>15.0f} {peak_rss_kib() - rss_before:>15} {elapsed * 1000:>9.2f}"
+    )
+
+
+def main(image_paths):
+    print(f"{'approach':<10} {'image':<24} {'file KiB':>9} {'heap peak KiB':>15} {'RSS growth KiB':>15} {'ms/call':>9}")
+    for image_path in image_paths:
+        for approach in APPROACHES:
+            subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_image_encoding", "--run", approach, image_path],
+                check=True,
+            )
+    print("Heap peak is Python allocations (tracemalloc). RSS growth also counts the memory-mapped file pages,")
+    print("which are shared page cache and reclaimable, unlike the heap copies.")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--run":
+        run_one(sys.argv[2], sys.argv[3])
+    else:
+        main(sys.argv[1:] or DEFAULT_IMAGES)
@@ -0,0 +1,58 @@
+# benchmarks/bench_image_hosting.py
+# Request body size and time to build the image part: inlined base64 versus a hosted storage URL.
+# Run with: python -m benchmarks.bench_image_hosting [image ...]
+# With AZURE_STORAGE_ACCOUNT_NAME set the images are uploaded to that container. Otherwise the
+# local backend stands in, handing out a URL of SAS length, so upload times are local disk times.
+import json
+import os
+import sys
+import tempfile
+import time
+
+from app import config
+from app.storage import blob_storage
+from app.utils.image_utils import build_image_part
+
+DEFAULT_IMAGES = ["trial_file/BadImage.jpg", "trial_file/presentation.png"]
+SAS_QUERY = "?sv=2024-11-04&se=2026-01-01T00%3A00%3A00Z&sr=b&sp=r&sig=" + "x" * 44
+
+
+class LocalURLStorage(blob_storage.LocalBlobStorage):
+    """The local backend with a fake fetchable URL, so the hosted path can be measured without Azure."""
+
+    name = "local-url"
+
+    def read_url(self, blob_name, expires_at):
+        return f"https://account.blob.core.windows.net/{self.container}/{blob_name}{SAS_QUERY}"
+
+
+def request_bytes(image_part):
+    return len(json.dumps({"messages": [{"role": "user", "content": [{"type": "text", "text": ""}, image_part]}]}))
+
+
+def measure(image_path, min_bytes):
+    config.IMAGE_URL_MIN_BYTES = min_bytes
+    start = time.perf_counter()
+    image_part = build_image_part(image_path, "diagram", "benchmark image")
+    return request_bytes(image_part), time.perf_counter() - start
+
+
+def main(image_paths):
+    if not blob_storage.can_host_images():
+        blob_storage.STORAGE = LocalURLStorage(tempfile.mkdtemp(prefix="bench_image_hosting_"), "benchmark")
+    print(f"storage: {blob_storage.STORAGE.name}")
+    rows = []
+    for image_path in image_paths:
+        # Hosted images are named by content hash, so the first hosted call uploads and the second reuses it
+        rows.append((image_path, "inline", *measure(image_path, 0)))
+        rows.append((image_path, "hosted (upload)", *measure(image_path, 1)))
+        rows.append((image_path, "hosted (reuse)", *measure(image_path, 1)))
+
+    print(f"\n{'image':<24} {'file KiB':>9} {'mode':<16} {'request bytes':>14} {'ms':>9}")
+    for image_path, mode, body_bytes, elapsed in rows:
+        print(f"{os.path.basename(image_path):<24} {os.path.getsize(image_path) / 1024:>9.0f} {mode:<16} {body_bytes:>14} {elapsed * 1000:>9.1f}")
+    print("\nms includes preprocessing; set IMAGE_PREPROCESS_ENABLED=false to time the original files alone.")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or DEFAULT_IMAGES)
@@ -0,0 +1,78 @@
+# benchmarks/bench_rate_governor.py
+# Fires a burst of chat completion requests at a local fake Azure deployment that
+# enforces a tokens-per-minute quota, with and without the rate governor in front.
+# Requests are not retried, so every 429 is a lost grading call.
+# Run with: python -m benchmarks.bench_rate_governor [requests] [tpm]
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from app.utils.rate_limit_utils import GovernedTransport, RateGovernor
+
+FAKE_ENDPOINT = "https://fake.openai.azure.com/openai/deployments/gpt-4o/chat/completions"
+PROMPT = "Evaluate the student's answer. " * 200 # ~1.5k prompt tokens per request
+MAX_TOKENS = 500
+LATENCY_S = 0.05
+
+
+class FakeAzureDeployment:
+    """A deployment whose TPM quota refills continuously, answering 429 + Retry-After when a request does not fit."""
+
+    def __init__(self, tpm):
+        self.tpm = tpm
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.throttled = 0
+
+    def handle(self, request):
+        body = json.loads(request.content)
+        cost = len(body["messages"][0]["content"]) // 4 + body["max_tokens"]
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.tpm, self._tokens + (now - self._updated) * self.tpm / 60)
+            self._updated = now
+            # Small tolerance for clock skew between the client and the fake
+            if cost > self._tokens + self.tpm / 600:
+                self.throttled += 1
+                retry_after = (cost - self._tokens) * 60 / self.tpm
+                return httpx.Response(429, headers={"retry-after-ms": str(int(retry_after * 1000))})
+            self._tokens -= cost
+        time.sleep(LATENCY_S)
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+
+def run(requests_count, tpm, governed):
+    deployment = FakeAzureDeployment(tpm)
+    transport = httpx.MockTransport(deployment.handle)
+    governor = RateGovernor(default_rpm=0, default_tpm=tpm)
+    if governed:
+        transport = GovernedTransport(transport, governor)
+    client = httpx.Client(transport=transport)
+    body = {"messages": [{"role": "user", "content": PROMPT}], "max_tokens": MAX_TOKENS}
+
+    def send(_):
+        return client.post(FAKE_ENDPOINT, json=body).status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        statuses = list(executor.map(send, range(requests_count)))
+    elapsed = time.perf_counter() - start
+    waits = governor.stats().get("gpt-4o@fake.openai.azure.com", {}).get("waits", 0)
+    print(
+        f"{'governed' if governed else 'ungoverned':<12} {statuses.count(200):>9} {deployment.throttled:>9} "
+        f"{waits:>8} {elapsed:>9.2f}"
+    )
+
+
+if __name__ == "__main__":
+    requests_count = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    tpm = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    print(f"{requests_count} requests of ~{len(PROMPT) // 4 + MAX_TOKENS} tokens against a {tpm} TPM deployment")
+    print(f"{'mode':<12} {'succeeded':>9} {'429s':>9} {'queued':>8} {'seconds':>9}")
+    run(requests_count, tpm, governed=False)
+    run(requests_count, tpm, governed=True)
@@ -0,0 +1,12 @@
+# Points every on-disk store at a scratch directory before app.config is imported,
+# and keeps the tests off the network: transcription uses the in-process fake backend.
+import os
+import tempfile
+
+_scratch = tempfile.mkdtemp(prefix="grading-tests-")
+os.environ.setdefault("CACHE_DB_PATH", os.path.join(_scratch, "grading_cache.sqlite3"))
+os.environ.setdefault("JOB_DB_PATH", os.path.join(_scratch, "jobs.sqlite3"))
+os.environ.setdefault("BLOB_LOCAL_ROOT", os.path.join(_scratch, "blobs"))
+os.environ.setdefault("BLOB_CACHE_DIR", os.path.join(_scratch, "blob_cache"))
+os.environ.setdefault("JOB_INPROCESS_WORKERS", "0")
+os.environ.setdefault("OCR_BACKEND_DEFAULT", "fake")
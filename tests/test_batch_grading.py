@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+import pytest
+
+from app import config
+from app.analysis import english_tool
+from app.analysis.batch_grading import grade_batch, validate_batch
+from app.ocr import ocr_processor
+from app.ocr.ocr_processor import FakeBackend
+from app.utils.cache_utils import RESULT_CACHE
+
+QUESTION = {"assignment_max_marks": 10, "student_class": 7, "assign_que": "Describe your school"}
+
+
+@pytest.fixture
+def scoring(monkeypatch):
+    """Fake transcription plus a stubbed scoring call that records what it graded and how many ran at once."""
+    monkeypatch.setattr(config, "AZURE_READY", True)
+    monkeypatch.setitem(ocr_processor.BACKENDS, "fake", FakeBackend())
+    RESULT_CACHE.clear()
+    calls = {"graded": [], "in_flight": 0, "max_in_flight": 0}
+
+    async def allm_response(ocr_data, assignment_max_marks, student_class, assign_que, prompt=None):
+        calls["graded"].append(ocr_data)
+        calls["in_flight"] += 1
+        calls["max_in_flight"] = max(calls["max_in_flight"], calls["in_flight"])
+        await asyncio.sleep(0.02)
+        calls["in_flight"] -= 1
+        return json.dumps({"score": 7, "feedback": ["Good structure"]})
+
+    monkeypatch.setattr(english_tool, "allm_response", allm_response)
+    return calls
+
+
+def make_sheets(tmp_path, *contents):
+    paths = []
+    for index, content in enumerate(contents):
+        path = tmp_path / f"sheet-{index}.png"
+        path.write_bytes(content)
+        paths.append(str(path))
+    return paths
+
+
+def run_batch(paths, **kwargs):
+    async def collect():
+        return [event async for event in grade_batch("text", paths, **QUESTION, **kwargs)]
+    events = asyncio.run(collect())
+    return {event["path"]: event for event in events[:-1]}, events[-1]["summary"]
+
+
+def test_identical_sheets_are_graded_once(scoring, tmp_path):
+    first, second, copy = make_sheets(tmp_path, b"essay one", b"essay two", b"essay one")
+    results, summary = run_batch([first, second, copy])
+
+    assert len(scoring["graded"]) == 2
+    assert results[first]["status"] == "graded"
+    assert results[copy] == {"path": copy, "status": "duplicate", "duplicate_of": first, "result": results[first]["result"]}
+    assert results[first]["result"]["result"]["score"] == 7
+    assert summary == {"total": 3, "graded": 2, "duplicates": 1, "previously_graded": 0, "errors": 0}
+
+
+def test_previously_graded_sheets_come_from_the_cache(scoring, tmp_path):
+    old, new = make_sheets(tmp_path, b"graded yesterday", b"new essay")
+    run_batch([old])
+    results, summary = run_batch([old, new])
+
+    assert len(scoring["graded"]) == 2 # One per distinct sheet, across both batches
+    assert results[old]["status"] == "previously_graded"
+    assert results[new]["status"] == "graded"
+    assert (summary["graded"], summary["previously_graded"]) == (1, 1)
+
+
+def test_concurrency_caps_sheets_in_flight(scoring, monkeypatch, tmp_path):
+    paths = make_sheets(tmp_path, *[f"essay {i}".encode() for i in range(6)])
+    run_batch(paths, concurrency=2)
+    assert len(scoring["graded"]) == 6
+    assert scoring["max_in_flight"] == 2
+
+    # A request can lower the configured cap but not raise it
+    monkeypatch.setattr(config, "BATCH_MAX_CONCURRENCY", 3)
+    RESULT_CACHE.clear()
+    scoring["max_in_flight"] = 0
+    run_batch(paths, concurrency=50)
+    assert scoring["max_in_flight"] == 3
+
+
+def test_errors_are_reported_per_sheet(scoring, tmp_path):
+    (sheet,) = make_sheets(tmp_path, b"essay")
+    missing = str(tmp_path / "missing.png")
+    results, summary = run_batch([sheet, missing])
+    assert results[missing]["status"] == "error"
+    assert results[sheet]["status"] == "graded"
+    assert summary["errors"] == 1
+
+
+def test_validate_batch():
+    assert validate_batch({"paths": ["a.png"], **QUESTION}) is None
+    assert "Unsupported mode" in validate_batch({"mode": "poetry", "paths": ["a.png"], **QUESTION})
+    assert "list of image paths" in validate_batch({"paths": "a.png", **QUESTION})
+    assert "between 1 and" in validate_batch({"paths": [], **QUESTION})
+    assert "Missing fields" in validate_batch({"paths": ["a.png"]})
+    assert "concurrency" in validate_batch({"paths": ["a.png"], "concurrency": True, **QUESTION})
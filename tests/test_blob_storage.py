@@ -0,0 +1,58 @@
+import hashlib
+import os
+
+import pytest
+
+from app.storage.blob_storage import BlobCache, LocalBlobStorage
+from app.utils.cache_utils import image_fingerprint
+
+
+def make_cache(tmp_path, max_bytes=1024 * 1024, ttl_seconds=60):
+    storage = LocalBlobStorage(str(tmp_path / "storage"), "container")
+    return storage, BlobCache(storage, str(tmp_path / "cache"), max_bytes, ttl_seconds)
+
+
+def test_local_blob_names_stay_inside_the_container(tmp_path):
+    storage = LocalBlobStorage(str(tmp_path), "container")
+    assert storage._path("uploads/a.png") == str(tmp_path / "container" / "uploads" / "a.png")
+    for name in ("../a.png", "uploads/../../a.png", "/etc/passwd", "", "."):
+        with pytest.raises(ValueError):
+            storage._path(name)
+
+
+def test_cached_copies_are_reused_until_the_blob_changes(tmp_path):
+    storage, cache = make_cache(tmp_path, ttl_seconds=0) # Revalidate on every use
+    storage.upload("sheet.png", b"first")
+    path = cache.resolve("blob://sheet.png")
+    assert open(path, "rb").read() == b"first"
+    assert cache.resolve("blob://sheet.png") == path
+    assert (cache.stats()["misses"], cache.stats()["revalidations"]) == (1, 1)
+
+    storage.upload("sheet.png", b"second version")
+    assert open(cache.resolve("blob://sheet.png"), "rb").read() == b"second version"
+    assert cache.stats()["misses"] == 2
+
+
+def test_least_recently_used_copies_are_evicted(tmp_path):
+    storage, cache = make_cache(tmp_path, max_bytes=10)
+    storage.upload("a.png", b"aaaaaa")
+    storage.upload("b.png", b"bbbbbb")
+    first = cache.resolve("blob://a.png")
+    cache.resolve("blob://b.png")
+
+    assert not os.path.exists(first)
+    stats = cache.stats()
+    assert (stats["evictions"], stats["entries"], stats["bytes"]) == (1, 1, 6)
+
+
+def test_missing_blobs_raise_and_leave_nothing_behind(tmp_path):
+    _, cache = make_cache(tmp_path)
+    with pytest.raises(FileNotFoundError):
+        cache.resolve("blob://missing.png")
+    assert [name for _, _, names in os.walk(tmp_path / "cache") for name in names] == []
+    assert cache.resolve("local/sheet.png") == "local/sheet.png" # Not a blob, returned as is
+
+
+@pytest.mark.parametrize("reference", ["blob://uploads/missing.png", "blob://../../etc/passwd"])
+def test_fingerprint_of_an_unresolvable_blob_falls_back_to_the_reference(reference):
+    assert image_fingerprint(reference) == hashlib.sha256(reference.encode("utf-8")).hexdigest()
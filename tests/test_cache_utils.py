@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+
+from app.utils.cache_utils import ResultCache, cached_grading, make_cache_key
+
+
+def make_cache(tmp_path, **overrides):
+    settings = {"memory_max_entries": 8, "max_disk_bytes": 1024 * 1024, "ttl_seconds": 60}
+    settings.update(overrides)
+    return ResultCache("test", str(tmp_path / "cache.sqlite3"), **settings)
+
+
+def test_make_cache_key_is_stable_and_order_independent():
+    assert make_cache_key("tool", "v1", {"a": 1, "b": 2}) == make_cache_key("tool", "v1", {"b": 2, "a": 1})
+    assert make_cache_key("tool", "v1", {"a": 1}) != make_cache_key("tool", "v2", {"a": 1})
+
+
+def test_get_returns_a_copy_from_memory_then_disk(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set("key", {"score": 7})
+    value = cache.get("key")
+    value["score"] = 0
+    assert cache.get("key") == {"score": 7}
+
+    # A second instance on the same file only has the disk tier
+    assert make_cache(tmp_path).get("key") == {"score": 7}
+    assert cache.stats()["memory_hits"] == 2
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = make_cache(tmp_path, ttl_seconds=0.05)
+    cache.set("key", {"score": 7})
+    time.sleep(0.1)
+    assert cache.get("key") is None
+    stats = cache.stats()
+    assert stats["expired"] >= 1
+    assert stats["misses"] == 1
+
+
+def test_memory_tier_is_an_lru(tmp_path):
+    cache = make_cache(tmp_path, memory_max_entries=2)
+    for key in ("a", "b", "c"):
+        cache.set(key, key)
+    assert cache.stats()["memory_entries"] == 2
+    assert cache.get("a") == "a" # Evicted from memory, still on disk
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_disabled_cache_never_stores(tmp_path):
+    cache = make_cache(tmp_path, enabled=False)
+    cache.set("key", {"score": 7})
+    assert cache.get("key") is None
+
+
+def test_cached_grading_serves_repeat_calls_and_skips_error_strings(tmp_path):
+    cache = make_cache(tmp_path)
+    image = tmp_path / "sheet.png"
+    image.write_bytes(b"not really a png")
+    calls = []
+
+    @cached_grading("tool", "v1", cache=cache)
+    def grade(image_path_or_url, question, fail=False):
+        calls.append(question)
+        return "Error: failed" if fail else {"question": question}
+
+    assert grade(str(image), "q1") == {"question": "q1"}
+    assert grade(str(image), "q1") == {"question": "q1"}
+    assert grade(str(image), "q2") == {"question": "q2"}
+    grade(str(image), "q3", fail=True)
+    grade(str(image), "q3", fail=True)
+    assert calls == ["q1", "q2", "q3", "q3"]
+
+    # Same bytes under another name share the entry
+    copy = tmp_path / "copy.png"
+    copy.write_bytes(image.read_bytes())
+    assert grade.cache_key(str(copy), "q1") == grade.cache_key(str(image), "q1")
+
+
+def test_cached_grading_normalizers_merge_equivalent_arguments(tmp_path):
+    image = tmp_path / "sheet.png"
+    image.write_bytes(b"sheet")
+
+    @cached_grading("tool", "v1", cache=make_cache(tmp_path), normalizers={"fused": bool})
+    def grade(image_path_or_url, fused=None):
+        return {}
+
+    assert grade.cache_key(str(image), fused=None) == grade.cache_key(str(image), fused=False)
+    assert grade.cache_key(str(image), fused=None) != grade.cache_key(str(image), fused=True)
+
+
+def test_async_cached_grading_keeps_cache_io_off_the_event_loop(tmp_path):
+    image = tmp_path / "sheet.png"
+    image.write_bytes(b"sheet")
+    cache_threads = []
+
+    class RecordingCache(ResultCache):
+        def get(self, key):
+            cache_threads.append(threading.get_ident())
+            return super().get(key)
+
+        def set(self, key, value):
+            cache_threads.append(threading.get_ident())
+            super().set(key, value)
+
+    @cached_grading("tool", "v1", cache=RecordingCache("test", str(tmp_path / "cache.sqlite3"), 8, 1024 * 1024, 60))
+    async def grade(image_path_or_url):
+        return {"score": 7}
+
+    async def grade_twice():
+        assert await grade(str(image)) == await grade(str(image))
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(grade_twice())
+    assert len(cache_threads) == 3 # Miss, store, hit
+    assert loop_thread not in cache_threads
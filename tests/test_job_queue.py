@@ -0,0 +1,112 @@
+import socket
+import time
+
+import pytest
+
+from app import config
+from app.jobs.job_queue import JobQueue, callback_url_error, public_job, validate_job
+
+TEXT_JOB = {"path": "a.jpg", "assignment_max_marks": 10, "student_class": 5, "assign_que": "Describe a river"}
+
+
+def make_queue(tmp_path, lease_seconds=60, max_attempts=3):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), lease_seconds=lease_seconds, max_attempts=max_attempts)
+
+
+def test_validate_job_reports_unknown_kinds_and_missing_fields():
+    assert "Unsupported kind" in validate_job("poetry", {})
+    assert "Missing fields" in validate_job("text", {"path": "sheet.jpg"})
+
+
+def test_claim_leases_jobs_oldest_first(tmp_path):
+    queue = make_queue(tmp_path)
+    first = queue.submit("text", {"path": "a.jpg"})
+    second = queue.submit("text", {"path": "b.jpg"})
+
+    job = queue.claim("worker-1")
+    assert job["id"] == first
+    assert job["status"] == "running"
+    assert job["attempts"] == 1
+    assert queue.claim("worker-2")["id"] == second
+    assert queue.claim("worker-3") is None
+
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=0.05)
+    job_id = queue.submit("text", {"path": "a.jpg"})
+    queue.claim("worker-1")
+    assert queue.claim("worker-2") is None # Lease still held
+
+    time.sleep(0.1)
+    job = queue.claim("worker-2")
+    assert job["id"] == job_id
+    assert job["worker"] == "worker-2"
+    assert job["attempts"] == 2
+
+
+def test_job_fails_once_its_leases_run_out(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=0.01, max_attempts=2)
+    job_id = queue.submit("text", {"path": "a.jpg"})
+    for _ in range(2):
+        assert queue.claim("worker") is not None
+        time.sleep(0.05)
+
+    assert queue.claim("worker") is None
+    job = queue.get(job_id)
+    assert job["status"] == "failed"
+    assert "lease expired" in job["error"]
+
+
+def test_complete_stores_the_result(tmp_path):
+    queue = make_queue(tmp_path)
+    job_id = queue.submit("text", {"path": "a.jpg"})
+    queue.claim("worker")
+    assert queue.complete(job_id, "worker", {"score": 7})
+
+    assert public_job(queue.get(job_id))["result"] == {"score": 7}
+    assert queue.stats() == {"queued": 0, "running": 0, "succeeded": 1, "failed": 0}
+
+
+def test_a_worker_whose_lease_was_taken_over_cannot_finish_the_job(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=0.05)
+    job_id = queue.submit("text", {"path": "a.jpg"})
+    queue.claim("slow-worker")
+    time.sleep(0.1)
+    queue.claim("new-worker")
+
+    assert not queue.complete(job_id, "slow-worker", {"score": 1})
+    assert queue.get(job_id)["status"] == "running"
+    assert queue.fail(job_id, "new-worker", "Error: unreadable sheet")
+    assert not queue.complete(job_id, "new-worker", {"score": 2}) # Already finished
+    assert queue.get(job_id)["error"] == "Error: unreadable sheet"
+
+
+@pytest.mark.parametrize("callback_url", [
+    "http://example.com/hook", # Plain HTTP is off by default
+    "ftp://example.com/hook",
+    "https:///hook",
+    "https://127.0.0.1/hook",
+    "https://10.0.0.5/hook",
+    "https://169.254.169.254/latest/meta-data",
+    "https://168.63.129.16/machine",
+    "https://[::1]/hook",
+    "https://[::ffff:192.168.1.1]/hook",
+    ["https://example.com/hook"],
+])
+def test_callbacks_to_other_schemes_and_internal_addresses_are_refused(callback_url):
+    assert validate_job("text", {**TEXT_JOB, "callback_url": callback_url}) is not None
+
+
+def test_callback_hosts_are_checked_once_resolved(monkeypatch):
+    assert validate_job("text", {**TEXT_JOB, "callback_url": "https://hooks.example.com/done"}) is None
+
+    def resolve_to(address):
+        return lambda host, port, proto=0: [(socket.AF_INET, socket.SOCK_STREAM, proto, "", (address, port))]
+
+    monkeypatch.setattr(socket, "getaddrinfo", resolve_to("10.1.2.3"))
+    assert "non-public" in callback_url_error("https://hooks.example.com/done", resolve=True)
+    monkeypatch.setattr(socket, "getaddrinfo", resolve_to("93.184.215.14"))
+    assert callback_url_error("https://hooks.example.com/done", resolve=True) is None
+
+    monkeypatch.setattr(config, "JOB_CALLBACK_ALLOW_PRIVATE", True)
+    assert callback_url_error("https://127.0.0.1/hook") is None
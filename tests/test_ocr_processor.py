@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from app import config
+from app.ocr import ocr_processor
+from app.ocr.ocr_processor import FakeBackend
+from app.utils.cache_utils import ResultCache
+
+
+@pytest.fixture
+def fake_backend(monkeypatch, tmp_path):
+    """A fresh FakeBackend on every route, with an empty transcription cache."""
+    backend = FakeBackend()
+    monkeypatch.setitem(ocr_processor.BACKENDS, "fake", backend)
+    monkeypatch.setattr(config, "OCR_BACKENDS", {})
+    monkeypatch.setattr(config, "OCR_BACKEND_DEFAULT", "fake")
+    monkeypatch.setattr(ocr_processor, "OCR_CACHE", ResultCache("ocr", str(tmp_path / "ocr.sqlite3"), 8, 1024 * 1024, 60))
+    return backend
+
+
+@pytest.fixture
+def sheet(tmp_path):
+    path = tmp_path / "sheet.png"
+    path.write_bytes(b"student answer sheet")
+    return str(path)
+
+
+def test_routes_use_their_configured_backend(monkeypatch, fake_backend):
+    monkeypatch.setattr(config, "OCR_BACKENDS", {"math": "azure"})
+    assert ocr_processor.get_backend("text") is fake_backend
+    assert ocr_processor.get_backend("math").name == "azure"
+
+
+def test_fake_transcription_is_deterministic_and_cached(fake_backend, sheet):
+    first = ocr_processor.transcribe_image(sheet, "Extract all text", "text", "test")
+    assert first.startswith("[fake transcription of image ")
+    assert ocr_processor.transcribe_image(sheet, "Extract all text", "text", "test") == first
+    assert len(fake_backend.calls) == 1
+
+    # A different prompt is a different transcription
+    ocr_processor.transcribe_image(sheet, "Extract the equations", "text", "test")
+    assert len(fake_backend.calls) == 2
+
+
+def test_canned_transcriptions_and_missing_files(fake_backend, sheet, tmp_path):
+    fake_backend.transcriptions[sheet] = "x = 2"
+    assert ocr_processor.transcribe_image(sheet, "prompt", "math", "test") == "x = 2"
+    assert ocr_processor.transcribe_image(str(tmp_path / "missing.png"), "prompt", "math", "test") is None
+
+
+def test_transcriptions_are_not_shared_between_backends(monkeypatch, fake_backend, sheet):
+    ocr_processor.transcribe_image(sheet, "prompt", "text", "test")
+    other = FakeBackend({sheet: "other model's text"})
+    other.name = other.model_id = "other-fake"
+    ocr_processor.register_backend(other)
+    try:
+        monkeypatch.setattr(config, "OCR_BACKEND_DEFAULT", "other-fake")
+        assert ocr_processor.transcribe_image(sheet, "prompt", "text", "test") == "other model's text"
+    finally:
+        del ocr_processor.BACKENDS["other-fake"]
+
+
+def test_async_transcription_shares_the_cache(fake_backend, sheet):
+    text = asyncio.run(ocr_processor.atranscribe_image(sheet, "prompt", "text", "test"))
+    assert ocr_processor.transcribe_image(sheet, "prompt", "text", "test") == text
+    assert len(fake_backend.calls) == 1
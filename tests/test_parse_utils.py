@@ -0,0 +1,51 @@
+import pytest
+
+from app.utils.parse_utils import get_parse_stats, normalize_key, parse_json_reply
+
+
+def test_normalize_key():
+    assert normalize_key(" Area of Improvement ") == "area_of_improvement"
+    assert normalize_key("Score:") == "score"
+
+
+def test_plain_and_fenced_json():
+    assert parse_json_reply('{"Score": 7, "Feedback": ["ok"]}', "plain") == {"score": 7, "feedback": ["ok"]}
+    assert parse_json_reply('```json\n{"score": 7}\n```', "plain") == {"score": 7}
+
+
+def test_json_inside_prose():
+    assert parse_json_reply('Here is the evaluation: {"score": 5} Hope this helps!', "prose") == {"score": 5}
+
+
+def test_truncated_reply_keeps_its_complete_fields():
+    reply = '{"score": 6, "feedback": ["Show units", "Check the sig'
+    assert parse_json_reply(reply, "truncated") == {"score": 6, "feedback": ["Show units"]}
+
+
+def test_markdown_layout():
+    reply = "## Score: 8.5\n## Feedback:\n- Neat work\n2) Label the axes\n**Summary:** Solid answer"
+    assert parse_json_reply(reply, "markdown") == {
+        "score": 8.5,
+        "feedback": ["Neat work", "Label the axes"],
+        "summary": "Solid answer",
+    }
+
+
+def test_garbage_raises_value_error():
+    with pytest.raises(ValueError):
+        parse_json_reply("I cannot grade this sheet.", "garbage")
+    with pytest.raises(ValueError):
+        parse_json_reply(None, "garbage")
+
+
+def test_parse_stats_count_each_strategy_per_label():
+    parse_json_reply('{"score": 1}', "stats")
+    parse_json_reply('Result: {"score": 1}', "stats")
+    parse_json_reply("## Score: 1", "stats")
+    with pytest.raises(ValueError):
+        parse_json_reply("nothing here", "stats")
+
+    stats = get_parse_stats()["stats"]
+    assert (stats["json"], stats["embedded"], stats["markdown"], stats["failed"]) == (1, 1, 1, 1)
+    assert stats["recovered_rate"] == 0.5
+    assert stats["failure_rate"] == 0.25
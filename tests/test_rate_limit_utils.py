@@ -0,0 +1,87 @@
+import json
+
+import httpx
+import pytest
+
+from app import config
+from app.utils.rate_limit_utils import (
+    DeploymentBudget,
+    GovernedTransport,
+    RateGovernor,
+    estimate_request_tokens,
+    parse_retry_after,
+)
+
+ENDPOINT = "https://fake.openai.azure.com/openai/deployments/gpt-4o/chat/completions"
+
+
+def test_estimate_request_tokens_counts_text_and_max_tokens():
+    body = json.dumps({"messages": [{"role": "user", "content": "x" * 400}], "max_tokens": 50})
+    assert estimate_request_tokens(body.encode()) == 100 + 50
+
+
+def test_estimate_request_tokens_counts_low_detail_images_as_85():
+    content = [{"type": "text", "text": ""}, {"type": "image_url", "image_url": {"url": "https://x/sheet.jpg", "detail": "low"}}]
+    body = json.dumps({"messages": [{"role": "user", "content": content}], "max_tokens": 10})
+    assert estimate_request_tokens(body.encode()) == 85 + 10
+
+
+def test_parse_retry_after_prefers_milliseconds():
+    assert parse_retry_after({"retry-after-ms": "1500", "retry-after": "9"}) == 1.5
+    assert parse_retry_after({"retry-after": "2"}) == 2.0
+    assert parse_retry_after({}) is None
+
+
+def test_budget_waits_once_requests_per_minute_run_out():
+    budget = DeploymentBudget("d", rpm=60, tpm=0)
+    waits = [budget.reserve(1) for _ in range(61)]
+    assert waits[:60] == [0.0] * 60
+    assert waits[60] == pytest.approx(1.0, abs=0.05) # One request refills every second at 60 rpm
+
+
+def test_budget_waits_for_tokens_per_minute():
+    budget = DeploymentBudget("d", rpm=0, tpm=600)
+    assert budget.reserve(600) == 0.0
+    assert budget.reserve(60) == pytest.approx(6.0, abs=0.05)
+
+
+def test_budget_refuses_a_wait_over_max_wait_without_taking_from_it():
+    budget = DeploymentBudget("d", rpm=1, tpm=0)
+    assert budget.reserve(1) == 0.0
+    assert budget.reserve(1, max_wait=1) is None
+    assert budget.stats()["refused"] == 1
+    # The refused request left the bucket as it was
+    assert budget.reserve(1) == pytest.approx(60, abs=0.1)
+
+
+def test_429_pauses_the_budget_for_retry_after():
+    budget = DeploymentBudget("d", rpm=0, tpm=0)
+    budget.observe(httpx.Response(429, headers={"retry-after": "5"}))
+    assert budget.expected_wait() == pytest.approx(5, abs=0.1)
+    assert budget.stats()["throttled"] == 1
+
+
+def test_governor_keys_budgets_by_host_and_deployment():
+    governor = RateGovernor(default_rpm=10, default_tpm=0, overrides={"gpt-4o-mini": (100, 0)})
+    request = httpx.Request("POST", ENDPOINT)
+    assert governor.budget_for(request) is governor.budget_for(httpx.Request("POST", ENDPOINT))
+    assert governor.budget_for(httpx.Request("POST", ENDPOINT.replace("fake", "other"))) is not governor.budget_for(request)
+    mini = governor.budget_for(httpx.Request("POST", ENDPOINT.replace("gpt-4o", "gpt-4o-mini")))
+    assert mini.rpm == 100
+    assert governor.budget_for(httpx.Request("GET", "https://fake.openai.azure.com/openai/models")) is None
+
+
+def test_governed_transport_times_out_instead_of_queueing_past_the_attempt_timeout(monkeypatch):
+    monkeypatch.setattr(config, "LLM_ATTEMPT_TIMEOUT", 0.5)
+    sent = []
+
+    def handler(request):
+        sent.append(request)
+        return httpx.Response(200, json={})
+
+    governor = RateGovernor(default_rpm=1, default_tpm=0)
+    with httpx.Client(transport=GovernedTransport(httpx.MockTransport(handler), governor)) as client:
+        assert client.post(ENDPOINT, json={"messages": []}).status_code == 200
+        with pytest.raises(httpx.TimeoutException):
+            client.post(ENDPOINT, json={"messages": []})
+    assert len(sent) == 1
@@ -0,0 +1,83 @@
+import httpx
+import pytest
+
+from app import config
+from app.utils.routing_utils import Deployment, DeploymentRouter
+
+
+class FakeAPIError(Exception):
+    """Carries what the router reads from openai.APIStatusError."""
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = httpx.Response(status_code, headers=headers or {})
+
+
+def make_router(*groups):
+    deployments = [[Deployment(name, f"https://{name}.example.com") for name in group] for group in groups]
+    return DeploymentRouter({"vision": deployments}), {d.name: d for group in deployments for d in group}
+
+
+def run(router, outcomes, calls=50):
+    """Routes `calls` calls, each ending as outcomes[name] says: a latency in seconds or an exception."""
+    picks = {}
+    for _ in range(calls):
+        deployment = router.choose("vision")
+        picks[deployment.name] = picks.get(deployment.name, 0) + 1
+        outcome = outcomes[deployment.name]
+        if isinstance(outcome, Exception):
+            router.record_failure(deployment, outcome)
+        else:
+            router.record_success(deployment, outcome)
+    return picks
+
+
+def test_choose_prefers_the_faster_deployment():
+    router, deployments = make_router(["fast", "slow"])
+    deployments["fast"].latency_s, deployments["slow"].latency_s = 1.0, 3.0
+    assert run(router, {"fast": 1.0, "slow": 3.0}) == {"fast": 50}
+
+
+def test_a_deployment_that_always_fails_does_not_take_the_traffic():
+    router, deployments = make_router(["healthy", "broken"])
+    deployments["healthy"].latency_s = 3.0
+    picks = run(router, {"healthy": 3.0, "broken": FakeAPIError(401)})
+    assert picks.get("broken", 0) <= 1 # Tried once as an unknown, then avoided
+    assert deployments["broken"].latency_s == config.LLM_ATTEMPT_TIMEOUT
+
+
+def test_untried_deployments_are_explored_when_nothing_is_known():
+    router, _ = make_router(["broken", "healthy"])
+    picks = run(router, {"healthy": 3.0, "broken": FakeAPIError(500)}, calls=20)
+    assert picks.get("broken", 0) <= 1
+    assert picks["healthy"] >= 19
+
+
+def test_calls_in_flight_spread_the_load():
+    router, deployments = make_router(["a", "b"])
+    deployments["a"].latency_s = deployments["b"].latency_s = 1.0
+    first, second = router.choose("vision"), router.choose("vision")
+    assert {first.name, second.name} == {"a", "b"}
+    assert first.in_flight == second.in_flight == 1
+
+
+def test_success_updates_the_latency_average_and_forgives_errors():
+    router, deployments = make_router(["a"])
+    deployment = deployments["a"]
+    router.record_success(router.choose("vision"), 2.0)
+    assert deployment.latency_s == 2.0
+    router.record_failure(router.choose("vision"), FakeAPIError(500))
+    assert deployment.error_rate == pytest.approx(config.ROUTER_LATENCY_ALPHA)
+    router.record_success(router.choose("vision"), 2.0)
+    assert deployment.error_rate < config.ROUTER_LATENCY_ALPHA
+    assert deployment.in_flight == 0
+
+
+def test_a_throttled_deployment_is_skipped_until_retry_after():
+    router, deployments = make_router(["primary"], ["fallback"])
+    router.record_failure(router.choose("vision"), FakeAPIError(429, {"retry-after": "30"}))
+    assert deployments["primary"].throttles == 1
+    assert deployments["primary"].latency_s is None # Throttling is not a latency sample
+    assert router.choose("vision").name == "fallback"
+    assert router.stats()["vision"][0]["throttled_for_s"] == pytest.approx(30, abs=1)
@@ -0,0 +1,146 @@
+import time
+
+from app.analysis.sendmail import DigestCoalescer, EmailDispatcher, build_message, validate_notifications
+
+
+class FakeSession:
+    """Stands in for SMTPSession; fails any message whose subject starts with "fail"."""
+
+    def __init__(self, sent):
+        self.sent = sent
+        self.connects = 1
+        self.closed = 0
+
+    def send(self, message):
+        if message['Subject'].startswith("fail"):
+            raise OSError("rejected by server")
+        self.sent.append(message['Subject'])
+
+    def close(self):
+        self.closed += 1
+
+
+def make_dispatcher(workers=2, max_queue=10, idle_timeout=60):
+    sent = []
+    return EmailDispatcher(lambda: FakeSession(sent), workers, max_queue, idle_timeout), sent
+
+
+def test_validate_notifications():
+    assert validate_notifications([]) == "No notifications given"
+    assert validate_notifications([{"subject": "s", "message": "m"}]) == "Missing fields: to"
+    assert validate_notifications([{"subject": "s", "message": "m", "to": "a@example.com"}]) is None
+
+
+def test_queued_emails_are_sent_in_the_background():
+    dispatcher, sent = make_dispatcher()
+    messages = [build_message(f"subject {i}", "body", "a@example.com") for i in range(5)]
+    messages.append(build_message("fail me", "body", "a@example.com"))
+    assert dispatcher.submit(messages)
+    dispatcher.join()
+
+    assert sorted(sent) == [f"subject {i}" for i in range(5)]
+    stats = dispatcher.stats()
+    assert (stats["queued"], stats["sent"], stats["failed"], stats["pending"]) == (6, 5, 1, 0)
+    assert stats["connects"] == 2 # One session per worker, reused for every message
+
+
+def test_a_submit_that_does_not_fit_is_refused_as_a_whole():
+    dispatcher, _ = make_dispatcher(workers=0, max_queue=3) # No workers, so nothing drains the queue
+    assert dispatcher.submit([build_message("s", "m", "a@example.com")] * 2)
+    assert not dispatcher.submit([build_message("s", "m", "a@example.com")] * 2)
+
+    stats = dispatcher.stats()
+    assert (stats["queued"], stats["rejected"], stats["pending"]) == (2, 2, 2)
+
+
+def test_idle_sessions_are_closed():
+    sessions = []
+
+    def factory():
+        sessions.append(FakeSession([]))
+        return sessions[-1]
+
+    dispatcher = EmailDispatcher(factory, workers=1, max_queue=10, idle_timeout=0.01)
+    dispatcher.submit([build_message("s", "m", "a@example.com")])
+    dispatcher.join()
+    for _ in range(100):
+        if sessions[0].closed:
+            break
+        time.sleep(0.01)
+    assert sessions[0].closed
+
+
+class FakeDispatcher:
+    """Records submitted messages; refuses them while `accept` is False."""
+
+    def __init__(self):
+        self.messages = []
+        self.accept = True
+
+    def submit(self, messages):
+        if not self.accept:
+            return False
+        self.messages.extend(messages)
+        return True
+
+
+def make_coalescer(window=0.1, max_items=50, max_pending=100):
+    dispatcher = FakeDispatcher()
+    coalescer = DigestCoalescer(dispatcher, window, max_items, max_pending, "{count} updates for {to}", "* {subject}: {message}")
+    return coalescer, dispatcher
+
+
+def notification(to, subject="Graded", message="7/10"):
+    return {"to": to, "subject": subject, "message": message}
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_notifications_for_one_recipient_become_one_digest():
+    coalescer, dispatcher = make_coalescer()
+    assert coalescer.add([notification("a@example.com", "Quiz 1"), notification("A@Example.com ", "Quiz 2")])
+    assert coalescer.add([notification("b@example.com", "Quiz 1", "Well done")])
+    assert dispatcher.messages == [] # Held until the window closes
+
+    assert wait_for(lambda: len(dispatcher.messages) == 2)
+    by_recipient = {message['To']: message for message in dispatcher.messages}
+    digest = by_recipient["a@example.com"]
+    assert digest['Subject'] == "2 updates for a@example.com"
+    assert digest.get_payload()[0].get_payload() == "* Quiz 1: 7/10\n\n* Quiz 2: 7/10"
+    # A lone notification goes out as it is
+    assert by_recipient["b@example.com"]['Subject'] == "Quiz 1"
+
+    stats = coalescer.stats()
+    assert (stats["notifications"], stats["digests"], stats["messages_merged"], stats["sessions_saved"]) == (3, 2, 2, 1)
+
+
+def test_a_full_digest_is_sent_before_its_window_closes():
+    coalescer, dispatcher = make_coalescer(window=60, max_items=3)
+    coalescer.add([notification("a@example.com", f"Quiz {i}") for i in range(3)])
+    assert wait_for(lambda: dispatcher.messages)
+    assert dispatcher.messages[0]['Subject'] == "3 updates for a@example.com"
+
+
+def test_too_many_pending_notifications_are_refused():
+    coalescer, _ = make_coalescer(window=60, max_pending=2)
+    assert coalescer.add([notification("a@example.com")] * 2)
+    assert not coalescer.add([notification("b@example.com")])
+    assert coalescer.stats()["pending"] == 2
+
+
+def test_a_digest_refused_by_the_dispatcher_is_held_for_another_window():
+    coalescer, dispatcher = make_coalescer(window=0.05)
+    dispatcher.accept = False
+    coalescer.add([notification("a@example.com", "Quiz 1")])
+    assert wait_for(lambda: coalescer.stats()["deferred"] >= 1)
+    coalescer.add([notification("a@example.com", "Quiz 2")])
+    dispatcher.accept = True
+
+    assert wait_for(lambda: dispatcher.messages)
+    assert len(dispatcher.messages) == 1
+    assert dispatcher.messages[0]['Subject'] == "2 updates for a@example.com"
@@ -0,0 +1,55 @@
+import json
+
+from app.utils.stream_utils import JSONEventParser
+
+REPLY = json.dumps({
+    "score": 7,
+    "summary": "Good work, but check {units} and \"signs\".",
+    "feedback": ["Show your steps", {"line": 2, "note": "x = 3, not 4"}, ["nested", "list"]],
+    "passed": True,
+})
+
+
+def feed_all(chunks):
+    parser = JSONEventParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return events
+
+
+def test_fields_and_list_items_are_reported_in_order():
+    assert feed_all([REPLY]) == [
+        {"event": "field", "key": "score", "value": 7},
+        {"event": "field", "key": "summary", "value": "Good work, but check {units} and \"signs\"."},
+        {"event": "item", "key": "feedback", "index": 0, "value": "Show your steps"},
+        {"event": "item", "key": "feedback", "index": 1, "value": {"line": 2, "note": "x = 3, not 4"}},
+        {"event": "item", "key": "feedback", "index": 2, "value": ["nested", "list"]},
+        {"event": "field", "key": "passed", "value": True},
+    ]
+
+
+def test_events_do_not_depend_on_chunk_boundaries():
+    expected = feed_all([REPLY])
+    assert feed_all(REPLY) == expected # One character at a time
+    assert feed_all([REPLY[i:i + 5] for i in range(0, len(REPLY), 5)]) == expected
+
+
+def test_a_field_is_reported_once_it_is_complete():
+    parser = JSONEventParser()
+    assert parser.feed('{"score": 7') == []
+    assert parser.feed(', "feedback": ["a"') == [{"event": "field", "key": "score", "value": 7}]
+    assert parser.feed(', "b"') == [{"event": "item", "key": "feedback", "index": 0, "value": "a"}]
+
+
+def test_text_before_the_object_is_skipped():
+    events = feed_all(["Here is the evaluation:\n```json\n", '{"score": 3}', "\n```"])
+    assert events == [{"event": "field", "key": "score", "value": 3}]
+
+
+def test_values_that_do_not_parse_are_left_out():
+    events = feed_all(['{"score": seven, "feedback": [oops, "fine"], "passed": false}'])
+    assert events == [
+        {"event": "item", "key": "feedback", "index": 1, "value": "fine"},
+        {"event": "field", "key": "passed", "value": False},
+    ]
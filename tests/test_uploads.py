@@ -0,0 +1,115 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+
+import pytest
+
+from app import config
+from app.storage import blob_storage
+from app.storage.blob_storage import LocalBlobStorage, is_upload_name, sign_upload_token, verify_upload_token
+
+SECRET = "test-secret"
+
+
+@pytest.fixture(autouse=True)
+def secret_key(monkeypatch):
+    monkeypatch.setattr(config, "SECRET_KEY", SECRET)
+
+
+def signed(payload):
+    """A token for an arbitrary payload, validly signed, to reach the checks behind the signature."""
+    encoded = base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+    return f"{encoded}.{hmac.new(SECRET.encode('utf-8'), encoded.encode('ascii'), hashlib.sha256).hexdigest()}"
+
+
+def test_a_signed_token_names_its_blob():
+    assert verify_upload_token(sign_upload_token("uploads/a.png", time.time() + 60)) == "uploads/a.png"
+
+
+def test_forged_tokens_are_refused(monkeypatch):
+    token = sign_upload_token("uploads/a.png", time.time() + 60)
+    payload, _, signature = token.partition(".")
+    other_payload = sign_upload_token("uploads/b.png", time.time() + 60).partition(".")[0]
+    assert verify_upload_token(f"{other_payload}.{signature}") is None
+    assert verify_upload_token(f"{payload}.{'0' * len(signature)}") is None
+
+    monkeypatch.setattr(config, "SECRET_KEY", "another-secret")
+    assert verify_upload_token(token) is None
+
+
+def test_expired_tokens_are_refused():
+    assert verify_upload_token(sign_upload_token("uploads/a.png", time.time() - 1)) is None
+
+
+@pytest.mark.parametrize("token", [
+    "",
+    "no-signature",
+    "payload.signature",
+    "ünïcode.signature",
+    signed(b"not json"),
+    signed(b'["uploads/a.png"]'),
+    signed(b'{"uploads/a.png": 1}'),
+    signed(json.dumps(["uploads/a.png", "tomorrow"]).encode()),
+    signed(json.dumps([["uploads/a.png"], 9999999999]).encode()),
+])
+def test_malformed_tokens_are_refused(token):
+    assert verify_upload_token(token) is None
+
+
+@pytest.mark.parametrize("blob_name", ["other/a.png", "uploads", "uploads/../a.png", "uploads/./a.png", "/uploads/a.png", "uploadsx/a.png"])
+def test_names_outside_the_upload_prefix_are_refused(blob_name):
+    assert not is_upload_name(blob_name)
+    assert verify_upload_token(sign_upload_token(blob_name, time.time() + 60)) is None
+
+
+@pytest.mark.parametrize("secret", ["", config.DEFAULT_SECRET_KEY])
+def test_local_uploads_are_disabled_without_a_real_secret_key(monkeypatch, secret):
+    monkeypatch.setattr(config, "SECRET_KEY", secret)
+    assert blob_storage.STORAGE.name == "local"
+    assert not blob_storage.uploads_enabled()
+    assert verify_upload_token(sign_upload_token("uploads/a.png", time.time() + 60)) is None
+
+
+def test_an_oversized_upload_is_aborted_without_leaving_a_partial_file(tmp_path):
+    storage = LocalBlobStorage(str(tmp_path), "container")
+    writer = storage.writer("uploads/a.png", max_bytes=10)
+    writer.write(b"123456")
+    with pytest.raises(ValueError):
+        writer.write(b"789012")
+    writer.abort()
+    assert os.listdir(tmp_path / "container" / "uploads") == []
+
+
+def test_a_committed_upload_replaces_the_blob_whole(tmp_path):
+    storage = LocalBlobStorage(str(tmp_path), "container")
+    writer = storage.writer("uploads/a.png", max_bytes=10)
+    writer.write(b"12345")
+    assert not os.path.exists(storage._path("uploads/a.png")) # Invisible until committed
+    writer.commit()
+    assert os.listdir(tmp_path / "container" / "uploads") == ["a.png"]
+    assert storage.properties("uploads/a.png")["size"] == 5
+
+
+def test_put_route_streams_to_disk_and_enforces_the_limit(monkeypatch):
+    quart = pytest.importorskip("quart")
+    from app.app import app
+
+    assert isinstance(app, quart.Quart)
+    monkeypatch.setattr(config, "UPLOAD_MAX_BYTES", 10)
+
+    async def scenario():
+        client = app.test_client()
+        token = sign_upload_token("uploads/route.png", time.time() + 60)
+        assert (await client.put("/uploads/not-a-token", data=b"123")).status_code == 403
+        assert (await client.put(f"/uploads/{token}", data=b"x" * 11)).status_code == 413
+        response = await client.put(f"/uploads/{token}", data=b"12345")
+        assert response.status_code == 201
+        assert (await response.get_json()) == {"blob": "blob://uploads/route.png", "size": 5}
+
+    asyncio.run(scenario())
+    directory = os.path.dirname(blob_storage.STORAGE._path("uploads/route.png"))
+    assert [name for name in os.listdir(directory) if name.endswith(".part")] == []